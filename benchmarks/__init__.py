@@ -0,0 +1 @@
+"""Benchmarks and stress tests run against a local PostgreSQL database."""
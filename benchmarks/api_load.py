@@ -0,0 +1,116 @@
+"""Load test for library_api: many kiosks hitting one API process.
+
+Each kiosk loops over a typical desk mix (browse a page of books, look up
+a book by id, search, list active loans, loan and return its own book) for the given duration
+and the harness reports requests/sec and latency percentiles per request
+type. Start the API first; fixtures are created and removed directly in
+the database, like the checkout stress test.
+
+    python library_api.py --port 8080 --pool 16 &
+    python -m benchmarks.api_load --url http://127.0.0.1:8080 --kiosks 50 --duration 20
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from benchmarks.stress_checkout import create_fixtures, drop_fixtures
+from library_db import Database
+
+SEARCH_TERMS = ["Title 1", "Author 2", "Title", "99", "an", "Author 3"]
+
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+async def kiosk(session, url, book_id, member_id, deadline, latencies, errors, rng):
+    async def request(name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url + path, **kwargs) as response:
+                await response.read()
+                # A lookup of an id that does not exist is an answer, not a failure
+                ok = response.status < 400 or response.status == 404
+        except aiohttp.ClientError:
+            ok = False
+        latencies[name].append(time.perf_counter() - start)
+        if not ok:
+            errors[name] += 1
+
+    while time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < 0.30:
+            await request("browse books", "GET", "/books", params={"after": rng.randrange(5000), "limit": 50})
+        elif roll < 0.50:
+            await request("lookup book", "GET", f"/books/{rng.randrange(1, 5000)}")
+        elif roll < 0.70:
+            await request("search books", "GET", "/books", params={"q": rng.choice(SEARCH_TERMS), "limit": 50})
+        elif roll < 0.85:
+            await request("active loans", "GET", "/loans", params={"limit": 50})
+        else:
+            await request("loan", "POST", "/loans", json={"book_id": book_id, "member_id": member_id})
+            await request("return", "POST", "/returns", json={"book_id": book_id})
+
+
+async def run(url, kiosks, duration, book_ids, member_id, seed):
+    latencies, errors = defaultdict(list), defaultdict(int)
+    connector = aiohttp.TCPConnector(limit=kiosks)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(url + "/health") as response:
+            response.raise_for_status()
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            kiosk(session, url, book_ids[n], member_id, deadline, latencies, errors, random.Random(seed + n))
+            for n in range(kiosks)
+        ))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def report(latencies, errors, elapsed, kiosks):
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} requests from {kiosks} kiosks in {elapsed:.1f}s: {total / elapsed:.0f} requests/sec, "
+          f"{sum(errors.values())} errors")
+    print(f"{'request':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    rows = sorted(latencies.items()) + [("all", [v for values in latencies.values() for v in values])]
+    for name, values in rows:
+        values = sorted(values)
+        if not values:
+            continue
+        count_errors = sum(errors.values()) if name == "all" else errors[name]
+        print(f"{name:<14}{len(values):>8}{percentile(values, 50) * 1000:>10.2f}"
+              f"{percentile(values, 95) * 1000:>10.2f}{percentile(values, 99) * 1000:>10.2f}{count_errors:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--kiosks", type=int, default=50, help="concurrent simulated kiosks")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    db = Database(min_size=1, max_size=1)
+    book_ids, member_id = create_fixtures(db, args.kiosks)
+    try:
+        latencies, errors, elapsed = asyncio.run(
+            run(args.url.rstrip("/"), args.kiosks, args.duration, book_ids, member_id, args.seed)
+        )
+    finally:
+        drop_fixtures(db, book_ids, member_id)
+        db.close()
+    report(latencies, errors, elapsed, args.kiosks)
+    return 1 if sum(errors.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""Headless latency and memory benchmark of LibraryApp against a synthetic library.
+
+Seeds the database with benchmarks.datagen, opens the real LibraryApp
+under the Qt offscreen platform and times its operations end to end, from
+the handler call until the result is on screen: table refreshes, paging,
+search, the loans views, the loan preview, and loan_book/return_book.
+Each operation runs --repeat times. One more run is then made under
+tracemalloc to record its peak Python allocation. Message boxes are
+replaced by no-ops; any error they would have shown is counted.
+
+Results, including the process's peak RSS and the library_metrics
+snapshot, are written as JSON. Pass an earlier file with --compare to
+see which operation got slower. Everything runs against the local
+database from the usual LIBRARY_DB_* settings, with no network access.
+
+    python -m benchmarks.app_scale --books 1000000 --members 100000 --loans 10000000 --keep --output base.json
+    python -m benchmarks.app_scale --reuse --output new.json --compare base.json
+"""
+import os
+
+# Must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# The results file carries the metrics snapshot; the app's own copy is not needed
+os.environ.setdefault("LIBRARY_METRICS_FILE", os.devnull)
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from benchmarks.datagen import drop_library, find_library, seed_library
+from library_db import Database
+from library_metrics import METRICS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Seconds an operation may take before the benchmark gives up on it
+OPERATION_TIMEOUT = 300
+
+# Pages fetched by the scrolling benchmark
+SCROLL_PAGES = 10
+
+
+class Timeout(Exception):
+    """Raised when the application does not finish an operation in time."""
+
+
+class Harness:
+    """Drives one LibraryApp window and waits for its background work."""
+
+    def __init__(self, app, library):
+        self.app = app
+        self.library = library
+        self.window = None
+        self.errors = []
+        for kind in ("warning", "critical"):
+            setattr(QMessageBox, kind, staticmethod(self._error_box))
+        QMessageBox.information = staticmethod(lambda *args: QMessageBox.Ok)
+
+    def _error_box(self, parent, title, text, *args):
+        self.errors.append(f"{title}: {text}")
+        return QMessageBox.Ok
+
+    def wait(self, until=None):
+        """Processes events until no task is running and until() holds, if given."""
+        deadline = time.perf_counter() + OPERATION_TIMEOUT
+        while True:
+            self.app.processEvents()
+            if not self.window._tasks and (until is None or until()):
+                # Results queued by the last task are delivered before its finished signal
+                self.app.processEvents()
+                return
+            if time.perf_counter() > deadline:
+                raise Timeout(f"still busy after {OPERATION_TIMEOUT}s")
+            # Sleeping releases the GIL to the worker threads
+            time.sleep(0.001)
+
+    def open(self):
+        import maso
+        self.window = maso.LibraryApp()
+        self.wait(lambda: self.window.service is not None)
+
+    def show_tab(self, tab):
+        """Opens a tab as staff would; the first time, this builds it and loads its data."""
+        if self.window.tab_widget.currentWidget() is not tab:
+            self.window.tab_widget.setCurrentWidget(tab)
+            self.wait()
+
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+            self.app.processEvents()
+            self.window = None
+
+    # --- Operations; each starts some work and waits for it to reach the screen ---
+    def startup(self, run):
+        self.close()
+        self.open()
+
+    def refresh_books_table(self, run):
+        self.show_tab(self.window.books_tab)
+        self.window.refresh_books_table()
+        self.wait()
+
+    def scroll_books(self, run):
+        self.window.refresh_books_table()
+        self.wait()
+        for _ in range(SCROLL_PAGES):
+            self.window.books_model.fetchMore()
+            self.wait()
+
+    def search_books(self, run):
+        self.window.book_search_input.setText(f"Bench title {run * 7 + 1}")
+        self.window.search_books()
+        self.wait()
+
+    def clear_search(self, run):
+        self.window.book_search_input.setText("")
+        self.window.search_books()
+        self.wait()
+
+    def refresh_members_table(self, run):
+        self.show_tab(self.window.members_tab)
+        self.window.refresh_members_table()
+        self.wait()
+
+    def active_loans(self, run):
+        self.show_tab(self.window.loans_tab)
+        self.window.filter_loans(False)
+        self.wait()
+
+    def loan_history(self, run):
+        self.window.filter_loans(True)
+        self.wait()
+
+    def preview_loan(self, run):
+        self.window.loan_book_id_input.setText(str(self.library.last_book - run))
+        self.window.loan_member_id_input.setText(str(self.library.first_member))
+        self.window.preview_loan()
+        self.wait()
+
+    def loan_book(self, run):
+        self.window.loan_book_id_input.setText(str(self.library.last_book - run))
+        self.window.loan_member_id_input.setText(str(self.library.first_member))
+        self.window.loan_book()
+        self.wait()
+
+    def return_book(self, run):
+        self.window.loan_book_id_input.setText(str(self.library.last_book - run))
+        self.window.return_book()
+        self.wait()
+
+
+# (name, harness method, setup run untimed before the runs)
+OPERATIONS = [
+    ("startup", "startup", None),
+    ("refresh_books_table", "refresh_books_table", None),
+    (f"scroll_books_{SCROLL_PAGES}_pages", "scroll_books", None),
+    ("search_books", "search_books", None),
+    ("refresh_members_table", "refresh_members_table", "clear_search"),
+    ("active_loans", "active_loans", None),
+    ("loan_history", "loan_history", None),
+    ("preview_loan", "preview_loan", None),
+    ("loan_book", "loan_book", None),
+    ("return_book", "return_book", None),
+]
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(harness, method, setup, repeat):
+    """Times repeat runs of one operation, then measures one more under tracemalloc."""
+    if setup:
+        getattr(harness, setup)(0)
+    errors_before = len(harness.errors)
+    timings = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        getattr(harness, method)(run)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    try:
+        getattr(harness, method)(repeat)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        "runs": repeat,
+        "median_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "min_ms": round(timings[0], 3),
+        "max_ms": round(timings[-1], 3),
+        "peak_python_kb": round(peak / 1024, 1),
+        "errors": harness.errors[errors_before:],
+    }
+
+
+def environment(db):
+    def server_version(cursor):
+        cursor.execute("SHOW server_version")
+        return cursor.fetchone()[0]
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "postgres": db.run(server_version),
+        "platform": platform.platform(),
+    }
+
+
+def table_sizes(db):
+    def sizes(cursor):
+        cursor.execute("SELECT relname, reltuples::bigint FROM pg_class WHERE relname IN ('books', 'members', 'loans')")
+        return dict(cursor.fetchall())
+    return db.run(sizes)
+
+
+def compare(results, baseline):
+    print(f"{'operation':<26}{'before ms':>12}{'after ms':>12}{'change':>10}")
+    for name, after in results["operations"].items():
+        before = baseline["operations"].get(name)
+        if not before:
+            continue
+        change = after["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0
+        print(f"{name:<26}{before['median_ms']:>12.2f}{after['median_ms']:>12.2f}{change:>+10.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--loans", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--reuse", action="store_true", help="benchmark rows generated by an earlier --keep run")
+    parser.add_argument("--keep", action="store_true", help="leave the generated rows in place afterwards")
+    parser.add_argument("--output", default="app_scale.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    db = Database(min_size=1, max_size=1)
+    if args.reuse:
+        library = find_library(db)
+        if library is None:
+            parser.error("--reuse: no generated rows found; run once with --keep first")
+    else:
+        start = time.perf_counter()
+        library = seed_library(db, args.books, args.members, args.loans)
+        print(f"Seeded {args.books} books, {args.members} members and {args.loans} loans "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    harness = Harness(app, library)
+    try:
+        harness.open()
+        # Logging every click is part of the application, but not of what is measured here
+        logging.getLogger().setLevel(logging.WARNING)
+        METRICS.reset()
+        operations = {}
+        for name, method, setup in OPERATIONS:
+            repeat = 1 if method == "startup" else args.repeat
+            operations[name] = measure(harness, method, setup, repeat)
+            print(f"{name:<26}{operations[name]['median_ms']:>10.2f} ms median")
+        results = {
+            "benchmark": "app_scale",
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "environment": environment(db),
+            "generated": library._asdict(),
+            "table_rows": table_sizes(db),
+            "repeat": args.repeat,
+            "operations": operations,
+            "peak_rss_mb": peak_rss_mb(),
+            "metrics": METRICS.snapshot(),
+        }
+    finally:
+        harness.close()
+        if not args.keep and not args.reuse:
+            drop_library(db)
+        db.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 1 if any(op["errors"] for op in operations.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Synthetic large-library data for benchmarks, generated inside PostgreSQL.
+
+Books, members and loans are produced with generate_series and simple
+arithmetic on the row number, so the same sizes always give the same data
+and even 10 million rows never pass through Python. Every generated row is
+recognisable (authors start with "Bench author", emails end in
+@bench.example), so drop_library removes them again without touching
+real records. Use a scratch database for the largest sizes:
+
+    LIBRARY_DB_NAME=library_bench python -m benchmarks.datagen --books 1000000 --members 100000 --loans 5000000
+    LIBRARY_DB_NAME=library_bench python -m benchmarks.datagen --drop
+"""
+import argparse
+import logging
+import sys
+import time
+from collections import namedtuple
+
+from library_db import Database
+
+BENCH_AUTHOR = "Bench author"
+BENCH_EMAIL_DOMAIN = "bench.example"
+
+# Share of the loans that are still open (each on a different book)
+ACTIVE_LOAN_SHARE = 0.05
+
+# Bench books and members are ids first_id..last_id; active loans are on the first active_loans books
+Library = namedtuple("Library", "first_book last_book first_member last_member active_loans loans")
+
+
+def _insert_books(cursor, books, unavailable):
+    cursor.execute(
+        "WITH ins AS ("
+        " INSERT INTO Books (title, author, isbn, is_available)"
+        " SELECT 'Bench title ' || n, %(author)s || ' ' || (n %% 5000),"
+        "  '979' || lpad(n::text, 10, '0'), n > %(unavailable)s"
+        " FROM generate_series(1, %(books)s) AS n"
+        " RETURNING book_id)"
+        " SELECT min(book_id), max(book_id) FROM ins",
+        {"books": books, "unavailable": unavailable, "author": BENCH_AUTHOR}
+    )
+    return cursor.fetchone()
+
+
+def _insert_members(cursor, members):
+    cursor.execute(
+        "WITH ins AS ("
+        " INSERT INTO Members (name, email)"
+        " SELECT 'Bench member ' || n, 'member' || n || '@' || %(domain)s"
+        " FROM generate_series(1, %(members)s) AS n"
+        " RETURNING member_id)"
+        " SELECT min(member_id), max(member_id) FROM ins",
+        {"members": members, "domain": BENCH_EMAIL_DOMAIN}
+    )
+    return cursor.fetchone()
+
+
+def _insert_loans(cursor, first_book, books, first_member, members, active, returned):
+    params = {"first_book": first_book, "books": books, "first_member": first_member,
+              "members": members, "active": active, "returned": returned}
+    # n is a bigint below, so multiplying it to spread the rows cannot overflow
+    # Open loans: one per book on the first `active` books, made in the last 30 days, each of
+    # the book's first copy (created on loan, as the book row is inserted unavailable)
+    cursor.execute(
+        "INSERT INTO Loans (book_id, copy_id, member_id, loan_date)"
+        " SELECT c.book_id, c.copy_id, %(first_member)s + (n * 7919 %% %(members)s),"
+        "  CURRENT_DATE - (n %% 30)::int"
+        " FROM generate_series(1::bigint, %(active)s) AS n"
+        " JOIN Copies c ON c.book_id = %(first_book)s + n - 1",
+        params
+    )
+    # Returned loans spread over every book, member and the last ten years
+    cursor.execute(
+        "INSERT INTO Loans (book_id, member_id, loan_date, return_date)"
+        " SELECT %(first_book)s + (n * 104729 %% %(books)s), %(first_member)s + (n * 7919 %% %(members)s),"
+        "  CURRENT_DATE - 31 - (n %% 3650)::int, CURRENT_DATE - 31 - (n %% 3650)::int + (n %% 28)::int"
+        " FROM generate_series(1::bigint, %(returned)s) AS n",
+        params
+    )
+
+
+def seed_library(db, books, members, loans, active_share=ACTIVE_LOAN_SHARE):
+    """Inserts the synthetic rows in one transaction and returns their Library ranges."""
+    if books < 1 or members < 1:
+        raise ValueError("at least one book and one member are needed")
+    active = min(int(loans * active_share), books)
+
+    def seed(cursor):
+        first_book, last_book = _insert_books(cursor, books, active)
+        first_member, last_member = _insert_members(cursor, members)
+        _insert_loans(cursor, first_book, books, first_member, members, active, loans - active)
+        return Library(first_book, last_book, first_member, last_member, active, loans)
+
+    library = db.run(seed)
+    # Fresh statistics, so the planner sees the new table sizes straight away
+    with db.autocommit_cursor() as cursor:
+        for table in ("Books", "Copies", "Members", "Loans"):
+            cursor.execute(f"ANALYZE {table}")
+    return library
+
+
+def find_library(db):
+    """Returns the Library ranges of previously generated rows, or None if there are none."""
+    def find(cursor):
+        cursor.execute("SELECT min(book_id), max(book_id) FROM Books WHERE author LIKE %s", (BENCH_AUTHOR + " %",))
+        first_book, last_book = cursor.fetchone()
+        cursor.execute("SELECT min(member_id), max(member_id) FROM Members WHERE email LIKE %s",
+                       ("%@" + BENCH_EMAIL_DOMAIN,))
+        first_member, last_member = cursor.fetchone()
+        if first_book is None or first_member is None:
+            return None
+        cursor.execute(
+            "SELECT count(*) FILTER (WHERE return_date IS NULL), count(*) FROM Loans"
+            " WHERE book_id BETWEEN %s AND %s",
+            (first_book, last_book)
+        )
+        active, loans = cursor.fetchone()
+        return Library(first_book, last_book, first_member, last_member, active, loans)
+    return db.run(find)
+
+
+def drop_library(db):
+    """Deletes every generated book, member and the loans that reference them."""
+    def drop(cursor):
+        cursor.execute(
+            "DELETE FROM Loans WHERE book_id IN (SELECT book_id FROM Books WHERE author LIKE %(author)s)"
+            " OR member_id IN (SELECT member_id FROM Members WHERE email LIKE %(email)s)",
+            {"author": BENCH_AUTHOR + " %", "email": "%@" + BENCH_EMAIL_DOMAIN}
+        )
+        cursor.execute("DELETE FROM Books WHERE author LIKE %s", (BENCH_AUTHOR + " %",))
+        cursor.execute("DELETE FROM Members WHERE email LIKE %s", ("%@" + BENCH_EMAIL_DOMAIN,))
+    db.run(drop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--loans", type=int, default=50000)
+    parser.add_argument("--drop", action="store_true", help="remove previously generated rows instead")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    db = Database(min_size=1, max_size=1)
+    try:
+        start = time.perf_counter()
+        if args.drop:
+            drop_library(db)
+            print(f"Generated rows removed in {time.perf_counter() - start:.1f}s")
+        else:
+            library = seed_library(db, args.books, args.members, args.loans)
+            print(f"Seeded in {time.perf_counter() - start:.1f}s: books {library.first_book}-{library.last_book}, "
+                  f"members {library.first_member}-{library.last_member}, "
+                  f"{library.loans} loans ({library.active_loans} open)")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Holds benchmark: long queues on a few bestsellers, allocation on return and bulk expiry.
+
+Seeds --titles bench books, each with its one copy on loan, and queues
+--holds bench members for every one of them. Then it times, against those
+queues: placing a hold at the end of a full queue, looking up the queue
+position of holds spread along it, listing a member's holds and the head of
+a title's queue, and --cycles return/checkout rounds, where each return
+sets the copy aside for the head of the queue and its member then picks it
+up. Each round checks that the copy went to the oldest waiting hold, so a
+queue served out of order fails the run. Finally every hold is made due
+and the whole lot is expired in batches, the way the background job does.
+
+    python -m benchmarks.holds_queue --titles 3 --holds 5000 --output holds_queue.json
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.datagen import drop_library, seed_library
+from library_db import Database, db_loan_book, db_return_book
+from library_holds import (HOLD_EXPIRY_BATCH, db_book_holds, db_fetch_hold, db_member_holds, db_place_hold,
+                           expire_holds)
+
+# Lookups timed per operation
+SAMPLES = 200
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {"runs": len(timings), "median_ms": round(percentile(timings, 50) * 1000, 3),
+            "p95_ms": round(percentile(timings, 95) * 1000, 3), "max_ms": round(timings[-1] * 1000, 3)}
+
+
+def timed(db, job, *args):
+    start = time.perf_counter()
+    result = db.run(job, *args)
+    return time.perf_counter() - start, result
+
+
+def fill_queues(db, library, titles, holds):
+    """Queues the first holds bench members for each title, in member order, in one statement."""
+    def fill(cursor):
+        cursor.execute(
+            "INSERT INTO Holds (book_id, member_id, expires_at)"
+            " SELECT b, m, now() + interval '180 days'"
+            " FROM generate_series(%s::int, %s::int) AS b, generate_series(%s::int, %s::int) AS m"
+            " ORDER BY b, m",
+            (library.first_book, library.first_book + titles - 1, library.first_member,
+             library.first_member + holds - 1)
+        )
+    db.run(fill)
+    with db.autocommit_cursor() as cursor:
+        cursor.execute("ANALYZE Holds")
+
+
+def queue_heads(db, book_id, count):
+    def heads(cursor):
+        cursor.execute("SELECT member_id FROM Holds WHERE book_id = %s AND status = 'waiting' "
+                       "ORDER BY hold_id LIMIT %s", (book_id, count))
+        return [row[0] for row in cursor.fetchall()]
+    return db.run(heads)
+
+
+def cycle(db, book_id, cycles, errors):
+    """Returns the copy and lends it to whoever it was set aside for, cycles times."""
+    returns, pickups = [], []
+    expected = queue_heads(db, book_id, cycles)
+    for member_id in expected:
+        seconds, _ = timed(db, db_return_book, book_id)
+        returns.append(seconds)
+        ready = db.run(db_book_holds, book_id, 1)[0]
+        if ready[3] != "ready" or ready[2] != member_id:
+            errors.append(f"book {book_id}: copy set aside for member {ready[2]} ({ready[3]}), "
+                          f"expected member {member_id}")
+        seconds, _ = timed(db, db_loan_book, book_id, ready[2])
+        pickups.append(seconds)
+    return returns, pickups
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=3, help="bestsellers, each with one copy on loan")
+    parser.add_argument("--holds", type=int, default=5000, help="holds queued on each title")
+    parser.add_argument("--cycles", type=int, default=50, help="return/pickup rounds per title")
+    parser.add_argument("--batch", type=int, default=HOLD_EXPIRY_BATCH, help="holds expired per transaction")
+    parser.add_argument("--output", default="holds_queue.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    db = Database(min_size=1, max_size=1)
+    # One extra member places the timed holds at the end of the full queues
+    library = seed_library(db, args.titles, args.holds + 1, args.titles, active_share=1)
+    titles = range(library.first_book, library.first_book + args.titles)
+    rng = random.Random(1)
+    errors, results = [], {}
+    try:
+        start = time.perf_counter()
+        fill_queues(db, library, args.titles, args.holds)
+        results["fill_seconds"] = round(time.perf_counter() - start, 3)
+
+        placed = [timed(db, db_place_hold, book_id, library.last_member) for book_id in titles]
+        results["place_hold"] = summary([seconds for seconds, _ in placed])
+        for _, hold in placed:
+            if hold[6] != args.holds + 1:
+                errors.append(f"hold {hold[0]} placed at position {hold[6]}, expected {args.holds + 1}")
+        hold_ids = [hold[0] for _, hold in placed]
+
+        def all_holds(cursor):
+            cursor.execute("SELECT hold_id FROM Holds WHERE book_id = ANY(%s)", (list(titles),))
+            return [row[0] for row in cursor.fetchall()]
+        sample = rng.sample(db.run(all_holds), min(SAMPLES, args.titles * args.holds)) + hold_ids
+        results["queue_position"] = summary([timed(db, db_fetch_hold, hold_id)[0] for hold_id in sample])
+        members = [rng.randint(library.first_member, library.last_member) for _ in range(SAMPLES)]
+        results["member_holds"] = summary([timed(db, db_member_holds, member_id)[0] for member_id in members])
+        results["book_holds"] = summary([timed(db, db_book_holds, rng.choice(titles), 50)[0]
+                                         for _ in range(SAMPLES)])
+
+        returns, pickups = [], []
+        for book_id in titles:
+            book_returns, book_pickups = cycle(db, book_id, min(args.cycles, args.holds), errors)
+            returns += book_returns
+            pickups += book_pickups
+        results["return_and_allocate"] = summary(returns)
+        results["pickup"] = summary(pickups)
+
+        def make_due(cursor):
+            cursor.execute("UPDATE Holds SET expires_at = now() WHERE book_id = ANY(%s) "
+                           "AND status IN ('waiting', 'ready')", (list(titles),))
+            return cursor.rowcount
+        due = db.run(make_due)
+        start = time.perf_counter()
+        expired = expire_holds(db, args.batch)
+        seconds = time.perf_counter() - start
+        results["expire"] = {"holds": expired, "seconds": round(seconds, 3),
+                             "holds_per_second": round(expired / seconds) if seconds else None}
+        if expired != due:
+            errors.append(f"{expired} of {due} due holds expired")
+    finally:
+        drop_library(db)
+        db.close()
+
+    for name, result in results.items():
+        if isinstance(result, dict) and "median_ms" in result:
+            print(f"{name:<22}{result['median_ms']:>10.2f} ms median{result['p95_ms']:>10.2f} ms p95")
+    if "expire" in results:
+        print(f"{'expire':<22}{results['expire']['holds']:>10} holds in {results['expire']['seconds']}s")
+    for error in errors:
+        print(f"ERROR: {error}")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": "holds_queue", "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "titles": args.titles, "holds": args.holds, "results": results, "errors": errors}, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
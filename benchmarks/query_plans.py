@@ -0,0 +1,143 @@
+"""Before/after query plans and timings for the migration indexes.
+
+Runs the hot circulation queries with the indexes from library_migrations
+in place, then drops those indexes inside the same transaction and runs
+them again, and finally rolls everything back, so the database is left
+untouched. --loans seeds that many synthetic returned loans first (also
+rolled back) so the difference shows on a small test database.
+
+    python -m benchmarks.query_plans --loans 200000 --repeat 50
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+import psycopg2
+
+from library_db import DB_SETTINGS
+from library_migrations import MIGRATIONS
+
+# Every index the migrations create, read from their statements so a new one is measured too
+MIGRATION_INDEXES = sorted({
+    match.group(1)
+    for migration in MIGRATIONS for statement in migration.statements
+    for match in re.finditer(r"CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?(?:IF NOT EXISTS )?(\w+)", statement)
+})
+
+HOT_QUERIES = [
+    ("open loan by book (return)",
+     "SELECT loan_id FROM Loans WHERE book_id = %(book_id)s AND return_date IS NULL"),
+    ("loans by member (member delete FK check)",
+     "SELECT 1 FROM Loans WHERE member_id = %(member_id)s LIMIT 1"),
+    ("loans by book (book delete FK check)",
+     "SELECT 1 FROM Loans WHERE book_id = %(book_id)s LIMIT 1"),
+    ("book by ISBN (import de-duplication)",
+     "SELECT book_id FROM Books WHERE isbn = %(isbn)s"),
+    ("first page of active loans (loans tab)",
+     "SELECT loan_id FROM Loans WHERE loan_id > 0 AND return_date IS NULL ORDER BY loan_id LIMIT 500"),
+    ("oldest active loans (overdue report)",
+     "SELECT loan_id FROM Loans WHERE return_date IS NULL ORDER BY loan_date, loan_id LIMIT 500"),
+    ("open loan by copy (barcode return)",
+     "SELECT loan_id FROM Loans WHERE copy_id = %(copy_id)s AND return_date IS NULL"),
+]
+
+
+def seed_loans(cursor, loans):
+    cursor.execute(
+        "WITH b AS (SELECT array_agg(book_id) AS ids FROM Books), "
+        "m AS (SELECT array_agg(member_id) AS ids FROM Members) "
+        "INSERT INTO Loans (book_id, member_id, loan_date, return_date) "
+        "SELECT b.ids[1 + floor(random() * array_length(b.ids, 1))::int], "
+        "m.ids[1 + floor(random() * array_length(m.ids, 1))::int], CURRENT_DATE - 30, CURRENT_DATE - 1 "
+        "FROM generate_series(1, %s), b, m",
+        (loans,)
+    )
+
+
+def sample_params(cursor):
+    cursor.execute("SELECT book_id FROM Books ORDER BY book_id DESC LIMIT 1")
+    book_id = cursor.fetchone()[0]
+    cursor.execute("SELECT member_id FROM Members ORDER BY member_id DESC LIMIT 1")
+    member_id = cursor.fetchone()[0]
+    cursor.execute("SELECT copy_id FROM Loans WHERE copy_id IS NOT NULL ORDER BY loan_id DESC LIMIT 1")
+    copy = cursor.fetchone()
+    cursor.execute("SELECT isbn FROM Books WHERE isbn IS NOT NULL LIMIT 1")
+    row = cursor.fetchone()
+    return {"book_id": book_id, "member_id": member_id, "copy_id": copy[0] if copy else 0,
+            "isbn": row[0] if row else ""}
+
+
+def measure(cursor, params, repeat):
+    """Returns [(name, plan node summary, median ms)] for every hot query."""
+    results = []
+    for name, sql in HOT_QUERIES:
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results.append((name, describe(plan[0]["Plan"]), timings[len(timings) // 2]))
+    return results
+
+
+def describe(node):
+    """Condenses a JSON plan to its node types and index names, outermost first."""
+    parts = []
+    while node:
+        label = node["Node Type"]
+        if "Index Name" in node:
+            label += f" using {node['Index Name']}"
+        elif "Relation Name" in node:
+            label += f" on {node['Relation Name'].lower()}"
+        parts.append(label)
+        node = (node.get("Plans") or [None])[0]
+    return " -> ".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=0, help="synthetic returned loans to seed first")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs per query")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**DB_SETTINGS)
+    try:
+        with conn.cursor() as cursor:
+            if args.loans:
+                seed_loans(cursor, args.loans)
+            cursor.execute("ANALYZE Loans")
+            cursor.execute("ANALYZE Books")
+            params = sample_params(cursor)
+            cursor.execute(
+                "SELECT c.relname FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = ANY(%s) AND i.indisvalid",
+                (MIGRATION_INDEXES,)
+            )
+            present = [row[0] for row in cursor.fetchall()]
+            after = measure(cursor, params, args.repeat)
+            for index in present:
+                cursor.execute(f"DROP INDEX {index}")
+            before = measure(cursor, params, args.repeat)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    missing = sorted(set(MIGRATION_INDEXES) - set(present))
+    if missing:
+        print(f"Not applied here, so no difference expected from: {', '.join(missing)}")
+    for (name, before_plan, before_ms), (_, after_plan, after_ms) in zip(before, after):
+        print(f"\n{name}")
+        print(f"  before {before_ms:8.3f} ms  {before_plan}")
+        print(f"  after  {after_ms:8.3f} ms  {after_plan}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
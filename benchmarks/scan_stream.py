@@ -0,0 +1,128 @@
+"""Scanner-stream benchmark: copies checked out and returned by barcode at a steady scan rate.
+
+Seeds bench books with benchmarks.datagen (each gets its first copy),
+opens the real LibraryApp under the Qt offscreen platform and feeds the
+Loan tab's scan box the way a scanner does, one barcode and Enter at a
+time, --scans barcodes at each of --rates scans per second: first in Check
+out mode, then in Return mode. Every scan is timed from Enter until its
+line is in the scan log. Scans that arrive while a batch is in flight are
+sent together, so the batch count shows how much batching the rate needed.
+Scan mode must not open dialogs, so any message box counts as an error.
+
+    python -m benchmarks.scan_stream --rates 5,20,100,500 --scans 200 --output scan_stream.json
+"""
+import os
+
+# Must be set before Qt is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ.setdefault("LIBRARY_METRICS_FILE", os.devnull)
+
+import argparse
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from benchmarks.app_scale import Harness, percentile
+from benchmarks.datagen import drop_library, seed_library
+from library_db import Database
+
+
+def bench_barcodes(db, library, count):
+    def barcodes(cursor):
+        cursor.execute("SELECT barcode FROM Copies WHERE book_id BETWEEN %s AND %s ORDER BY copy_id LIMIT %s",
+                       (library.first_book, library.last_book, count))
+        return [row[0] for row in cursor.fetchall()]
+    return db.run(barcodes)
+
+
+def stream(harness, mode, barcodes, rate):
+    """Scans barcodes at rate per second in one mode and waits until every scan is logged."""
+    window = harness.window
+    window.scan_mode_combo.setCurrentIndex(window.scan_mode_combo.findData(mode))
+    sent, logged, batches = {}, {}, []
+    log_scan, scans_done = window.log_scan, window.scans_done
+
+    def record(text, refused=False):
+        logged[text.split()[0]] = (time.perf_counter(), refused)
+        log_scan(text, refused)
+
+    def count_batch(mode, batch, result):
+        batches.append(len(batch))
+        scans_done(mode, batch, result)
+
+    window.log_scan, window.scans_done = record, count_batch
+    errors_before = len(harness.errors)
+    start = time.perf_counter()
+    try:
+        for n, barcode in enumerate(barcodes):
+            due = start + n / rate
+            while time.perf_counter() < due:
+                harness.app.processEvents()
+                time.sleep(0.0005)
+            window.scan_input.setText(barcode)
+            sent[barcode] = time.perf_counter()
+            window.scan_barcode()
+        harness.wait(lambda: len(logged) >= len(barcodes) and not window._scans)
+    finally:
+        del window.log_scan, window.scans_done
+    elapsed = time.perf_counter() - start
+    latencies = sorted((logged[barcode][0] - sent[barcode]) * 1000 for barcode in barcodes)
+    return {
+        "scans": len(barcodes),
+        "seconds": round(elapsed, 3),
+        "scans_per_second": round(len(barcodes) / elapsed, 1),
+        "median_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "max_ms": round(latencies[-1], 3),
+        "batches": len(batches),
+        "largest_batch": max(batches, default=0),
+        "refused": sum(1 for _, refused in logged.values() if refused),
+        "errors": harness.errors[errors_before:],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", default="5,20,100", help="comma-separated scans per second")
+    parser.add_argument("--scans", type=int, default=200, help="barcodes scanned per rate and mode")
+    parser.add_argument("--output", default="scan_stream.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    db = Database(min_size=1, max_size=1)
+    library = seed_library(db, args.scans, 1, 0)
+    app = QApplication.instance() or QApplication(sys.argv)
+    harness = Harness(app, library)
+    # Every dialog is an error here, including the ones that only report success
+    QMessageBox.information = staticmethod(harness._error_box)
+    results = {}
+    try:
+        barcodes = bench_barcodes(db, library, args.scans)
+        harness.open()
+        logging.getLogger().setLevel(logging.WARNING)
+        harness.show_tab(harness.window.loans_tab)
+        harness.window.loan_member_id_input.setText(str(library.first_member))
+        for rate in (float(r) for r in args.rates.split(",")):
+            results[rate] = {mode: stream(harness, mode, barcodes, rate) for mode in ("checkout", "return")}
+            for mode, result in results[rate].items():
+                print(f"{rate:>6g}/s {mode:<9}{result['scans_per_second']:>8} scans/s"
+                      f"{result['median_ms']:>10.1f} ms median{result['p95_ms']:>10.1f} ms p95"
+                      f"{result['batches']:>6} batches  {result['refused']} refused")
+    finally:
+        harness.close()
+        drop_library(db)
+        db.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": "scan_stream", "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "scans": args.scans, "rates": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    failed = any(r["errors"] or r["refused"] for modes in results.values() for r in modes.values())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Startup benchmark: time to first paint, to a connection and to the first rows, by library size.
+
+For each size, the database is seeded with benchmarks.datagen and the
+application is started --runs times, each in a fresh Python process under
+the Qt offscreen platform. Each start records, from the top of the child
+process's main module (the interpreter's own startup is not included):
+
+    imports_ms       PyQt5 and maso imported
+    first_paint_ms   the window's first paint event
+    connected_ms     the service is open and the tabs are enabled
+    first_rows_ms    the first page of books is on screen
+
+The window is painted before the connection is made, so first_paint_ms
+should be the same at every size, and only the later steps can grow with
+the data. Results are written as JSON.
+
+    python -m benchmarks.startup --sizes 0,100000,1000000 --runs 5 --output startup.json
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+# Seconds a single start may take before it is counted as failed
+START_TIMEOUT = 120
+
+STEPS = ("imports_ms", "first_paint_ms", "connected_ms", "first_rows_ms")
+
+
+def child():
+    """Starts the application once and prints its step timings as one JSON line."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ.setdefault("LIBRARY_METRICS_FILE", os.devnull)
+    from PyQt5.QtCore import QEvent, QObject
+    from PyQt5.QtWidgets import QApplication, QMessageBox
+    import maso
+    marks = {"imports_ms": time.perf_counter()}
+    errors = []
+
+    class PaintProbe(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and "first_paint_ms" not in marks:
+                marks["first_paint_ms"] = time.perf_counter()
+            return False
+
+    for kind in ("warning", "critical"):
+        setattr(QMessageBox, kind, staticmethod(lambda parent, title, text, *args: errors.append(text)))
+    app = QApplication(sys.argv)
+    window = maso.LibraryApp()
+    probe = PaintProbe()
+    window.installEventFilter(probe)
+    window.show()
+    deadline = time.perf_counter() + START_TIMEOUT
+    while "first_rows_ms" not in marks and not errors and time.perf_counter() < deadline:
+        app.processEvents()
+        if window.service is not None and "connected_ms" not in marks:
+            marks["connected_ms"] = time.perf_counter()
+        if window.books_model.rowCount():
+            marks["first_rows_ms"] = time.perf_counter()
+        time.sleep(0.001)
+    window.close()
+    result = {step: round((marks[step] - STARTED) * 1000, 1) if step in marks else None for step in STEPS}
+    result["errors"] = errors
+    print(json.dumps(result))
+    return 0 if len(marks) == len(STEPS) and not errors else 1
+
+
+def start_once():
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"], capture_output=True,
+                            text=True, timeout=START_TIMEOUT + 30)
+    lines = output.stdout.strip().splitlines()
+    if not lines:
+        raise RuntimeError(f"child process failed: {output.stderr.strip()[-500:]}")
+    return json.loads(lines[-1])
+
+
+def measure(runs):
+    starts = [start_once() for _ in range(runs)]
+    summary = {}
+    for step in STEPS:
+        values = [start[step] for start in starts if start[step] is not None]
+        summary[step] = round(statistics.median(values), 1) if values else None
+    summary["errors"] = sorted({error for start in starts for error in start["errors"]})
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="0,100000",
+                        help="comma-separated numbers of books to generate (members are a tenth, loans 5x)")
+    parser.add_argument("--runs", type=int, default=5, help="application starts per size")
+    parser.add_argument("--output", default="startup.json", help="JSON results file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child()
+
+    from benchmarks.datagen import drop_library, seed_library
+    from library_db import Database
+
+    db = Database(min_size=1, max_size=1)
+    results = {}
+    try:
+        # One unmeasured start, so every size starts with warm file caches
+        start_once()
+        for size in (int(s) for s in args.sizes.split(",")):
+            if size:
+                seed_library(db, size, max(size // 10, 1), size * 5)
+            try:
+                results[size] = measure(args.runs)
+            finally:
+                if size:
+                    drop_library(db)
+            print(f"{size:>10} books  " + "  ".join(f"{step} {results[size][step]}" for step in STEPS))
+    finally:
+        db.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": "startup", "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                   "runs": args.runs, "sizes": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 1 if any(r["errors"] for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Concurrent checkout/return stress test against a local PostgreSQL.
+
+Several desk threads loan and return a small set of books as fast as they
+can, each through its own pooled connection. Afterwards every copy must
+have at most one open loan, each book's open-loan count must equal its
+successful checkouts minus its successful returns, and every copy's
+is_available must agree with its open loans. Exits with status 1 when a
+double loan or inconsistency is found.
+
+    python -m benchmarks.stress_checkout --desks 16 --books 10 --copies 3 --operations 200
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+from collections import Counter
+
+from library_db import Database, CirculationError, db_add_copy, db_loan_book, db_return_book
+
+
+def create_fixtures(db, books, copies=1):
+    def insert(cursor):
+        cursor.execute(
+            "INSERT INTO Books (title, author) SELECT 'Stress copy ' || n, 'stress' "
+            "FROM generate_series(1, %s) AS n RETURNING book_id",
+            (books,)
+        )
+        book_ids = [row[0] for row in cursor.fetchall()]
+        # Each book already has its first copy
+        for book_id in book_ids:
+            for _ in range(copies - 1):
+                db_add_copy(cursor, book_id)
+        cursor.execute("INSERT INTO Members (name) VALUES ('Stress member') RETURNING member_id")
+        return book_ids, cursor.fetchone()[0]
+    return db.run(insert)
+
+
+def drop_fixtures(db, book_ids, member_id):
+    def delete(cursor):
+        cursor.execute("DELETE FROM Loans WHERE book_id = ANY(%s)", (book_ids,))
+        cursor.execute("DELETE FROM Books WHERE book_id = ANY(%s)", (book_ids,))
+        cursor.execute("DELETE FROM Members WHERE member_id = %s", (member_id,))
+    db.run(delete)
+
+
+def desk(db, book_ids, member_id, operations, loaned, returned, lock, seed):
+    rng = random.Random(seed)
+    for _ in range(operations):
+        book_id = rng.choice(book_ids)
+        try:
+            if rng.random() < 0.6:
+                db.run(db_loan_book, book_id, member_id)
+                counter = loaned
+            else:
+                db.run(db_return_book, book_id)
+                counter = returned
+        except CirculationError:
+            continue
+        with lock:
+            counter[book_id] += 1
+
+
+def check(db, book_ids, loaned, returned):
+    def state(cursor):
+        cursor.execute(
+            "SELECT c.book_id, c.copy_id, c.is_available, COUNT(l.loan_id) FROM Copies c "
+            "LEFT JOIN Loans l ON l.copy_id = c.copy_id AND l.return_date IS NULL "
+            "WHERE c.book_id = ANY(%s) GROUP BY c.book_id, c.copy_id, c.is_available",
+            (book_ids,)
+        )
+        return cursor.fetchall()
+
+    problems = []
+    open_per_book = Counter()
+    for book_id, copy_id, is_available, open_loans in db.run(state):
+        open_per_book[book_id] += open_loans
+        if open_loans > 1 or is_available != (open_loans == 0):
+            problems.append(f"copy {copy_id} of book {book_id}: {open_loans} open loans, "
+                            f"is_available={is_available}")
+    for book_id in book_ids:
+        expected = loaned[book_id] - returned[book_id]
+        if open_per_book[book_id] != expected:
+            problems.append(
+                f"book {book_id}: {open_per_book[book_id]} open loans, {loaned[book_id]} checkouts, "
+                f"{returned[book_id]} returns"
+            )
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--desks", type=int, default=16, help="concurrent checkout desks")
+    parser.add_argument("--books", type=int, default=10, help="books competed for")
+    parser.add_argument("--copies", type=int, default=1, help="copies of each book")
+    parser.add_argument("--operations", type=int, default=200, help="checkouts/returns per desk")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Refused checkouts are expected here; only report real errors
+    logging.basicConfig(level=logging.ERROR)
+    db = Database(min_size=1, max_size=args.desks + 1)
+    book_ids, member_id = create_fixtures(db, args.books, args.copies)
+    loaned, returned, lock = Counter(), Counter(), threading.Lock()
+    try:
+        threads = [
+            threading.Thread(target=desk, args=(db, book_ids, member_id, args.operations,
+                                                loaned, returned, lock, args.seed + n))
+            for n in range(args.desks)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        problems = check(db, book_ids, loaned, returned)
+    finally:
+        drop_fixtures(db, book_ids, member_id)
+        db.close()
+
+    print(f"{sum(loaned.values())} checkouts and {sum(returned.values())} returns "
+          f"by {args.desks} desks over {args.books} books with {args.copies} copies each")
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        return 1
+    print("OK: no double loans")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
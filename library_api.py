@@ -0,0 +1,459 @@
+"""Async HTTP/JSON API over LibraryService, so many desks share one backend.
+
+One process holds a single connection pool; aiohttp serves every kiosk
+and desk on one event loop and hands each call to a thread per pooled
+connection, so the loop never blocks on PostgreSQL. Needs aiohttp
+(pip install aiohttp).
+
+    python library_api.py --port 8080 --pool 16
+
+    GET    /books?after=0&limit=500&q=term      POST /books
+    GET    /books/{id}     PUT /books/{id}      DELETE /books/{id}
+    GET    /members?after=0&limit=500&q=term    POST /members
+    GET    /members/{id}   PUT /members/{id}    DELETE /members/{id}
+    GET    /books/{id}/copies                   POST /books/{id}/copies  {"barcode": "..."} (optional)
+    DELETE /copies/{id}
+    GET    /availability?book_ids=1,2,3         copies and available copies per title
+    POST   /holds    {"book_id": 1, "member_id": 2}  queues a member for a title that is out
+    GET    /holds/{id}     DELETE /holds/{id}   a hold and its queue position; DELETE cancels it
+    GET    /books/{id}/holds?limit=50           ready holds, then the head of the queue
+    GET    /members/{id}/holds                  a member's open holds
+    GET    /loans?after=0&limit=500&all=0
+    POST   /loans    {"book_id": 1, "member_id": 2} or {"book_ids": [...], "member_id": 2}
+                     or {"barcodes": [...], "member_id": 2} for scanned copies
+    POST   /returns  {"book_id": 1} or {"book_ids": [...]} or {"barcodes": [...]}
+                     scanned returns list the copies set aside for a hold under "held"
+    GET    /reports  available reports and their columns
+    GET    /reports/{name}?limit=50&start=2024-01-01&end=2025-01-01&format=columns
+                     one list per column; format=rows for row objects, format=csv for CSV
+    GET    /stats    cache hit/miss counters
+    GET    /metrics  latency histograms and row counts (Prometheus text; ?format=json for JSON)
+    GET    /health
+
+Errors come back as {"error": message, "kind": kind} with status 400
+(validation), 404 (not_found), 409 (circulation or conflict), 503
+(commit_unknown: the database connection was lost while saving) or 500.
+
+The server also expires overdue holds every HOLD_EXPIRY_SECONDS.
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+
+import psycopg2
+from aiohttp import web
+
+from library_db import CirculationError, CommitUnknownError
+from library_holds import HOLD_EXPIRY_SECONDS
+from library_logging import configure_logging, stop_logging
+from library_metrics import METRICS
+from library_reports import REPORT_LIMIT, REPORTS, to_columns
+from library_service import (PAGE_SIZE, BOOK_COLUMNS, MEMBER_COLUMNS, LOAN_COLUMNS, COPY_COLUMNS,
+                             AVAILABILITY_COLUMNS, HOLD_COLUMNS, HOLD_QUEUE_LIMIT, ValidationError, open_service)
+
+# Pooled connections, and so concurrent database calls, in the API process
+API_POOL_SIZE = int(os.environ.get("LIBRARY_API_POOL", "16"))
+
+# Log file (JSON lines, rotated); records are written by a background thread, off the event loop
+LOG_FILE = "library_api.log"
+
+SERVICE_KEY = web.AppKey("service", object)
+EXECUTOR_KEY = web.AppKey("executor", ThreadPoolExecutor)
+EXPIRY_KEY = web.AppKey("hold_expiry", asyncio.Task)
+
+
+def to_json(columns, row):
+    return {c: v.isoformat() if isinstance(v, date) else v for c, v in zip(columns, row)}
+
+
+def error_response(status, kind, message):
+    return web.json_response({"error": message, "kind": kind}, status=status)
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """Times every request into METRICS, labelled by route and status."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else "unmatched"
+        METRICS.observe("library_api_request_seconds", time.perf_counter() - start,
+                        method=request.method, route=route, status=status)
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """Turns service exceptions into JSON error responses."""
+    try:
+        return await handler(request)
+    except ValidationError as e:
+        return error_response(400, "validation", str(e))
+    except CirculationError as e:
+        return error_response(409, "circulation", str(e).strip())
+    except CommitUnknownError as e:
+        # Not retried here either: the client decides after checking what was saved
+        return error_response(503, "commit_unknown", str(e))
+    except psycopg2.IntegrityError as e:
+        # e.g. removing a book or member that still has loans
+        logging.warning("%s %s refused by the database: %s", request.method, request.path, e)
+        return error_response(409, "conflict", e.diag.message_primary or str(e))
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logging.error("%s %s failed: %s", request.method, request.path, e)
+        return error_response(500, "server", "internal error")
+
+
+async def call(request, method, *args, **kwargs):
+    """Runs a blocking service method on the database thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app[EXECUTOR_KEY], partial(method, *args, **kwargs))
+
+
+def service(request):
+    return request.app[SERVICE_KEY]
+
+
+def int_param(request, name, default):
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        raise ValidationError(f"{name} must be a number.") from None
+
+
+def date_param(request, name):
+    value = request.query.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"{name} must be a date (YYYY-MM-DD).") from None
+
+
+def ids_param(request, name):
+    try:
+        return [int(i) for i in request.query.get(name, "").split(",") if i.strip()]
+    except ValueError:
+        raise ValidationError("IDs must be numbers.") from None
+
+
+def path_id(request):
+    try:
+        return int(request.match_info["id"])
+    except ValueError:
+        raise ValidationError("IDs must be numbers.") from None
+
+
+async def json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValidationError("request body must be JSON.") from None
+    if not isinstance(body, dict):
+        raise ValidationError("request body must be a JSON object.")
+    return body
+
+
+def page_response(columns, rows, limit):
+    items = [to_json(columns, row) for row in rows]
+    next_after = rows[-1][0] if len(rows) == limit else None
+    return web.json_response({"items": items, "next_after": next_after})
+
+
+def row_response(columns, row, status=200):
+    if row is None:
+        return error_response(404, "not_found", "no such record.")
+    return web.json_response(to_json(columns, row), status=status)
+
+
+# --- Books ---
+async def list_books(request):
+    limit = int_param(request, "limit", PAGE_SIZE)
+    rows = await call(request, service(request).list_books, int_param(request, "after", 0), limit,
+                      request.query.get("q", ""))
+    return page_response(BOOK_COLUMNS, rows, limit)
+
+
+async def get_book(request):
+    return row_response(BOOK_COLUMNS, await call(request, service(request).get_book, path_id(request)))
+
+
+async def add_book(request):
+    body = await json_body(request)
+    row = await call(request, service(request).add_book, body.get("title"), body.get("author"), body.get("isbn"))
+    return row_response(BOOK_COLUMNS, row, status=201)
+
+
+async def update_book(request):
+    body = await json_body(request)
+    row = await call(request, service(request).update_book, path_id(request),
+                     body.get("title"), body.get("author"), body.get("isbn"))
+    return row_response(BOOK_COLUMNS, row)
+
+
+async def delete_book(request):
+    await call(request, service(request).delete_book, path_id(request))
+    return web.Response(status=204)
+
+
+# --- Members ---
+async def list_members(request):
+    limit = int_param(request, "limit", PAGE_SIZE)
+    rows = await call(request, service(request).list_members, int_param(request, "after", 0), limit,
+                      request.query.get("q", ""))
+    return page_response(MEMBER_COLUMNS, rows, limit)
+
+
+async def get_member(request):
+    return row_response(MEMBER_COLUMNS, await call(request, service(request).get_member, path_id(request)))
+
+
+async def add_member(request):
+    body = await json_body(request)
+    row = await call(request, service(request).add_member, body.get("name"), body.get("email"))
+    return row_response(MEMBER_COLUMNS, row, status=201)
+
+
+async def update_member(request):
+    body = await json_body(request)
+    row = await call(request, service(request).update_member, path_id(request),
+                     body.get("name"), body.get("email"))
+    return row_response(MEMBER_COLUMNS, row)
+
+
+async def delete_member(request):
+    await call(request, service(request).delete_member, path_id(request))
+    return web.Response(status=204)
+
+
+# --- Copies ---
+async def list_copies(request):
+    rows = await call(request, service(request).get_copies, path_id(request))
+    return web.json_response({"items": [to_json(COPY_COLUMNS, row) for row in rows], "copies": len(rows),
+                              "available": sum(1 for row in rows if row[3])})
+
+
+async def add_copy(request):
+    body = await json_body(request)
+    row = await call(request, service(request).add_copy, path_id(request), body.get("barcode"))
+    return row_response(COPY_COLUMNS, row, status=201)
+
+
+async def delete_copy(request):
+    row = await call(request, service(request).delete_copy, path_id(request))
+    if row is None:
+        return error_response(404, "not_found", "no such record.")
+    return web.Response(status=204)
+
+
+async def availability(request):
+    rows = await call(request, service(request).availability, ids_param(request, "book_ids"))
+    return web.json_response({"items": [to_json(AVAILABILITY_COLUMNS, row) for row in rows]})
+
+
+def scan_response(loaned, refused, held=None, status=200):
+    loans = [{"barcode": barcode, **to_json(LOAN_COLUMNS, loan)} for barcode, loan in loaned]
+    body = {"loans": loans, "refused": [{"barcode": barcode, "reason": reason} for barcode, reason in refused]}
+    if held is not None:
+        body["held"] = [{"barcode": barcode, "held_for": held_for} for barcode, held_for in held]
+    return web.json_response(body, status=status)
+
+
+# --- Loans ---
+async def list_loans(request):
+    limit = int_param(request, "limit", PAGE_SIZE)
+    rows = await call(request, service(request).list_loans, int_param(request, "after", 0), limit,
+                      request.query.get("all", "0") != "1")
+    return page_response(LOAN_COLUMNS, rows, limit)
+
+
+async def loan_books(request):
+    body = await json_body(request)
+    if "barcodes" in body:
+        return scan_response(*await call(request, service(request).checkout_copies, body["barcodes"],
+                                         body.get("member_id")), status=201)
+    if "book_ids" not in body:
+        loan = await call(request, service(request).loan_book, body.get("book_id"), body.get("member_id"))
+        return row_response(LOAN_COLUMNS, loan, status=201)
+    loans, refused = await call(request, service(request).loan_books, body["book_ids"], body.get("member_id"))
+    return web.json_response({"loans": [to_json(LOAN_COLUMNS, loan) for loan in loans], "refused": refused},
+                             status=201)
+
+
+async def return_books(request):
+    body = await json_body(request)
+    if "barcodes" in body:
+        return scan_response(*await call(request, service(request).return_copies, body["barcodes"]))
+    if "book_ids" not in body:
+        loans = await call(request, service(request).return_book, body.get("book_id"))
+        not_on_loan = []
+    else:
+        loans, not_on_loan = await call(request, service(request).return_books, body["book_ids"])
+    return web.json_response({"loans": [to_json(LOAN_COLUMNS, loan) for loan in loans],
+                              "not_on_loan": not_on_loan})
+
+
+# --- Holds ---
+async def place_hold(request):
+    body = await json_body(request)
+    row = await call(request, service(request).place_hold, body.get("book_id"), body.get("member_id"))
+    return row_response(HOLD_COLUMNS, row, status=201)
+
+
+async def get_hold(request):
+    return row_response(HOLD_COLUMNS, await call(request, service(request).get_hold, path_id(request)))
+
+
+async def cancel_hold(request):
+    return row_response(HOLD_COLUMNS, await call(request, service(request).cancel_hold, path_id(request)))
+
+
+async def book_holds(request):
+    rows = await call(request, service(request).book_holds, path_id(request),
+                      int_param(request, "limit", HOLD_QUEUE_LIMIT))
+    return web.json_response({"items": [to_json(HOLD_COLUMNS, row) for row in rows]})
+
+
+async def member_holds(request):
+    rows = await call(request, service(request).member_holds, path_id(request))
+    return web.json_response({"items": [to_json(HOLD_COLUMNS, row) for row in rows]})
+
+
+async def expire_holds_forever(app):
+    """Expires overdue holds every HOLD_EXPIRY_SECONDS on the database thread pool."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(HOLD_EXPIRY_SECONDS)
+        try:
+            await loop.run_in_executor(app[EXECUTOR_KEY], app[SERVICE_KEY].expire_holds)
+        except Exception as e:
+            logging.error("Expiring holds failed: %s", e)
+
+
+# --- Reports ---
+async def list_reports(request):
+    return web.json_response({"reports": [
+        {"name": r.name, "title": r.title, "columns": list(r.columns), "ranged": r.ranged} for r in REPORTS.values()
+    ]})
+
+
+async def get_report(request):
+    name = request.match_info["name"]
+    args = (name, int_param(request, "limit", REPORT_LIMIT), date_param(request, "start"), date_param(request, "end"))
+    output = request.query.get("format", "columns")
+    if output == "csv":
+        buffer = io.StringIO()
+        await call(request, service(request).export_report, name, buffer, *args[1:])
+        return web.Response(text=buffer.getvalue(), content_type="text/csv", charset="utf-8")
+    rows = await call(request, service(request).report, *args)
+    columns = REPORTS[name].columns
+    if output == "rows":
+        return web.json_response({"report": name, "items": [to_json(columns, row) for row in rows]})
+    data = {column: [v.isoformat() if isinstance(v, date) else v for v in values]
+            for column, values in to_columns(columns, rows).items()}
+    return web.json_response({"report": name, "columns": list(columns), "rows": len(rows), "data": data})
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def stats(request):
+    return web.json_response({"cache": service(request).cache_stats()})
+
+
+async def metrics(request):
+    if request.query.get("format") == "json":
+        return web.json_response(METRICS.snapshot())
+    return web.Response(text=METRICS.to_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+def create_app(library_service):
+    """Builds the aiohttp application around an open LibraryService.
+
+    The service is closed when the application shuts down.
+    """
+    app = web.Application(middlewares=[metrics_middleware, error_middleware])
+    app[SERVICE_KEY] = library_service
+    app[EXECUTOR_KEY] = ThreadPoolExecutor(library_service.max_concurrency, thread_name_prefix="library-db")
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/stats", stats),
+        web.get("/metrics", metrics),
+        web.get("/books", list_books),
+        web.post("/books", add_book),
+        web.get("/books/{id}", get_book),
+        web.put("/books/{id}", update_book),
+        web.delete("/books/{id}", delete_book),
+        web.get("/books/{id}/copies", list_copies),
+        web.get("/books/{id}/holds", book_holds),
+        web.post("/books/{id}/copies", add_copy),
+        web.delete("/copies/{id}", delete_copy),
+        web.get("/availability", availability),
+        web.get("/members", list_members),
+        web.post("/members", add_member),
+        web.get("/members/{id}", get_member),
+        web.get("/members/{id}/holds", member_holds),
+        web.put("/members/{id}", update_member),
+        web.delete("/members/{id}", delete_member),
+        web.get("/loans", list_loans),
+        web.post("/loans", loan_books),
+        web.post("/returns", return_books),
+        web.post("/holds", place_hold),
+        web.get("/holds/{id}", get_hold),
+        web.delete("/holds/{id}", cancel_hold),
+        web.get("/reports", list_reports),
+        web.get("/reports/{name}", get_report),
+    ])
+
+    async def start_expiry(app):
+        if HOLD_EXPIRY_SECONDS > 0:
+            app[EXPIRY_KEY] = asyncio.create_task(expire_holds_forever(app))
+
+    async def close(app):
+        if EXPIRY_KEY in app:
+            app[EXPIRY_KEY].cancel()
+        app[EXECUTOR_KEY].shutdown(wait=True)
+        logging.info("Cache statistics: %s", app[SERVICE_KEY].cache_stats())
+        app[SERVICE_KEY].close()
+        logging.info("Library API stopped; database connections closed.")
+
+    app.on_startup.append(start_expiry)
+    app.on_cleanup.append(close)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool", type=int, default=API_POOL_SIZE, help="pooled database connections")
+    args = parser.parse_args(argv)
+
+    log_listener = configure_logging(LOG_FILE)
+    library_service = open_service(min_size=1, max_size=args.pool)
+    logging.info("Library API listening on http://%s:%s with %s connections.", args.host, args.port, args.pool)
+    # No per-request access log: at kiosk request rates it costs more than the requests
+    web.run_app(create_app(library_service), host=args.host, port=args.port, access_log=None, print=None)
+    stop_logging(log_listener)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""In-process cache of book and member rows, kept in sync across clients.
+
+RecordCache is a bounded LRU with a time-to-live per entry. Writes made
+through LibraryService update or drop their entries straight away, and the
+service's ChangeListener invalidates them when the database announces a
+change from any other client. The TTL only bounds how long an entry can
+outlive a missed notification.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Entries kept per cache, and seconds an entry stays valid
+CACHE_SIZE = int(os.environ.get("LIBRARY_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.environ.get("LIBRARY_CACHE_TTL", "300"))
+
+
+class RecordCache:
+    """Thread-safe LRU cache of rows keyed by id, with a TTL per entry.
+
+    Ids that have no row are cached as None, so repeated lookups of a
+    missing id do not reach the database either.
+    """
+
+    def __init__(self, name, max_size=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a load that raced with one is not stored
+        self._generation = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def lookup(self, key):
+        """Returns (found, value) and counts a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, generation=None):
+        """Stores value, unless an invalidation happened since generation was read."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, load):
+        """Returns the cached value for key, calling load(key) and caching it on a miss."""
+        found, value = self.lookup(key)
+        if found:
+            return value
+        generation = self.generation()
+        value = load(key)
+        self.put(key, value, generation)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss counters and current size as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
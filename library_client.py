@@ -0,0 +1,239 @@
+"""HTTP client for library_api with the same methods as LibraryService.
+
+Lets the desktop client run against a shared API process instead of its
+own connection pool: set LIBRARY_API_URL and maso.py uses this client in
+place of a local LibraryService. Rows come back as the same tuples, and
+API errors are raised as the same ValidationError/CirculationError.
+"""
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime
+
+from library_db import CirculationError, CommitUnknownError
+from library_reports import DATE_COLUMNS, REPORT_LIMIT
+from library_service import (PAGE_SIZE, BOOK_COLUMNS, MEMBER_COLUMNS, LOAN_COLUMNS, COPY_COLUMNS,
+                             AVAILABILITY_COLUMNS, HOLD_COLUMNS, HOLD_QUEUE_LIMIT, ValidationError)
+
+# Seconds before a request to the API is given up on
+API_TIMEOUT = 30
+
+# Calls the desktop client may have in flight at once
+CLIENT_CONCURRENCY = 4
+
+
+class ApiError(Exception):
+    """Raised for API failures that are not validation or circulation errors."""
+
+
+ERROR_KINDS = {"validation": ValidationError, "circulation": CirculationError, "commit_unknown": CommitUnknownError}
+
+
+def _row(columns, item):
+    return tuple(date.fromisoformat(item[c]) if c.endswith("_date") and item[c] else
+                 datetime.fromisoformat(item[c]) if c.endswith("_at") and item[c] else item[c]
+                 for c in columns)
+
+
+class LibraryClient:
+    """LibraryService stand-in that forwards every call to a library_api server.
+
+    on_connection is accepted for compatibility and ignored: a cancelled
+    call simply has its response dropped.
+    """
+
+    def __init__(self, base_url, timeout=API_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_concurrency = CLIENT_CONCURRENCY
+        self.db = None
+
+    def close(self):
+        pass
+
+    def _request(self, method, path, query=None, body=None, raw=False):
+        url = self.base_url + path
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = response.read()
+                if raw:
+                    return payload.decode("utf-8")
+                return json.loads(payload) if payload else None
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read())
+            except ValueError:
+                raise ApiError(f"HTTP {e.code} from {path}") from None
+            if e.code == 404 and error.get("kind") == "not_found":
+                return None
+            raise ERROR_KINDS.get(error.get("kind"), ApiError)(error.get("error", f"HTTP {e.code}")) from None
+        except urllib.error.URLError as e:
+            raise ApiError(f"cannot reach the library API at {self.base_url}: {e.reason}") from None
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def add_change_handler(self, handler):
+        """Pushed changes need a database connection; API clients see them on their next page load."""
+
+    def cache_stats(self):
+        """Returns the API server's cache counters; this client keeps no cache of its own."""
+        return self._request("GET", "/stats")["cache"]
+
+    # --- Books ---
+    def list_books(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        result = self._request("GET", "/books", {"after": after_id, "limit": limit, "q": term or ""})
+        return [_row(BOOK_COLUMNS, item) for item in result["items"]]
+
+    def get_book(self, book_id, on_connection=None):
+        item = self._request("GET", f"/books/{book_id}")
+        return _row(BOOK_COLUMNS, item) if item else None
+
+    def add_book(self, title, author, isbn=None, on_connection=None):
+        item = self._request("POST", "/books", body={"title": title, "author": author, "isbn": isbn})
+        return _row(BOOK_COLUMNS, item)
+
+    def update_book(self, book_id, title, author, isbn=None, on_connection=None):
+        if book_id is None:
+            raise ValidationError("please select a book first.")
+        item = self._request("PUT", f"/books/{book_id}", body={"title": title, "author": author, "isbn": isbn})
+        return _row(BOOK_COLUMNS, item) if item else None
+
+    def delete_book(self, book_id, on_connection=None):
+        if book_id is None:
+            raise ValidationError("please select a book first.")
+        self._request("DELETE", f"/books/{book_id}")
+
+    # --- Members ---
+    def list_members(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        result = self._request("GET", "/members", {"after": after_id, "limit": limit, "q": term or ""})
+        return [_row(MEMBER_COLUMNS, item) for item in result["items"]]
+
+    def get_member(self, member_id, on_connection=None):
+        item = self._request("GET", f"/members/{member_id}")
+        return _row(MEMBER_COLUMNS, item) if item else None
+
+    def add_member(self, name, email=None, on_connection=None):
+        return _row(MEMBER_COLUMNS, self._request("POST", "/members", body={"name": name, "email": email}))
+
+    def update_member(self, member_id, name, email=None, on_connection=None):
+        if member_id is None:
+            raise ValidationError("please select a member first.")
+        item = self._request("PUT", f"/members/{member_id}", body={"name": name, "email": email})
+        return _row(MEMBER_COLUMNS, item) if item else None
+
+    def delete_member(self, member_id, on_connection=None):
+        if member_id is None:
+            raise ValidationError("please select a member first.")
+        self._request("DELETE", f"/members/{member_id}")
+
+    # --- Loans ---
+    def list_loans(self, after_id=0, limit=PAGE_SIZE, active_only=True, on_connection=None):
+        query = {"after": after_id, "limit": limit, "all": "0" if active_only else "1"}
+        return [_row(LOAN_COLUMNS, item) for item in self._request("GET", "/loans", query)["items"]]
+
+    def loan_book(self, book_id, member_id, on_connection=None):
+        item = self._request("POST", "/loans", body={"book_id": book_id, "member_id": member_id})
+        return _row(LOAN_COLUMNS, item)
+
+    def return_book(self, book_id, on_connection=None):
+        result = self._request("POST", "/returns", body={"book_id": book_id})
+        return [_row(LOAN_COLUMNS, item) for item in result["loans"]]
+
+    def loan_books(self, book_ids, member_id, on_connection=None):
+        result = self._request("POST", "/loans", body={"book_ids": book_ids, "member_id": member_id})
+        return [_row(LOAN_COLUMNS, item) for item in result["loans"]], result["refused"]
+
+    def return_books(self, book_ids, on_connection=None):
+        result = self._request("POST", "/returns", body={"book_ids": book_ids})
+        return [_row(LOAN_COLUMNS, item) for item in result["loans"]], result["not_on_loan"]
+
+    def _scan_result(self, result):
+        scans = ([(item["barcode"], _row(LOAN_COLUMNS, item)) for item in result["loans"]],
+                 [(item["barcode"], item["reason"]) for item in result["refused"]])
+        if "held" in result:
+            scans += ([(item["barcode"], item["held_for"]) for item in result["held"]],)
+        return scans
+
+    def checkout_copies(self, barcodes, member_id, on_connection=None):
+        return self._scan_result(self._request("POST", "/loans", body={"barcodes": barcodes, "member_id": member_id}))
+
+    def return_copies(self, barcodes, on_connection=None):
+        return self._scan_result(self._request("POST", "/returns", body={"barcodes": barcodes}))
+
+    # --- Copies ---
+    def get_copies(self, book_id, on_connection=None):
+        if book_id is None:
+            raise ValidationError("please select a book first.")
+        result = self._request("GET", f"/books/{book_id}/copies")
+        return [_row(COPY_COLUMNS, item) for item in result["items"]] if result else []
+
+    def availability(self, book_ids, on_connection=None):
+        if not book_ids:
+            raise ValidationError("please insert the book id.")
+        result = self._request("GET", "/availability", {"book_ids": ",".join(str(i) for i in book_ids)})
+        return [_row(AVAILABILITY_COLUMNS, item) for item in result["items"]]
+
+    def add_copy(self, book_id, barcode=None, on_connection=None):
+        if book_id is None:
+            raise ValidationError("please select a book first.")
+        item = self._request("POST", f"/books/{book_id}/copies", body={"barcode": barcode})
+        return _row(COPY_COLUMNS, item) if item else None
+
+    def delete_copy(self, copy_id, on_connection=None):
+        """Returns None either way; the API does not send the deleted row back."""
+        if copy_id is None:
+            raise ValidationError("please select a copy first.")
+        self._request("DELETE", f"/copies/{copy_id}")
+
+    # --- Holds ---
+    def place_hold(self, book_id, member_id, on_connection=None):
+        item = self._request("POST", "/holds", body={"book_id": book_id, "member_id": member_id})
+        return _row(HOLD_COLUMNS, item)
+
+    def get_hold(self, hold_id, on_connection=None):
+        if hold_id is None:
+            raise ValidationError("please select a hold first.")
+        item = self._request("GET", f"/holds/{hold_id}")
+        return _row(HOLD_COLUMNS, item) if item else None
+
+    def cancel_hold(self, hold_id, on_connection=None):
+        if hold_id is None:
+            raise ValidationError("please select a hold first.")
+        item = self._request("DELETE", f"/holds/{hold_id}")
+        return _row(HOLD_COLUMNS, item) if item else None
+
+    def member_holds(self, member_id, on_connection=None):
+        if member_id is None:
+            raise ValidationError("please insert the members id.")
+        result = self._request("GET", f"/members/{member_id}/holds")
+        return [_row(HOLD_COLUMNS, item) for item in result["items"]] if result else []
+
+    def book_holds(self, book_id, limit=HOLD_QUEUE_LIMIT, on_connection=None):
+        if book_id is None:
+            raise ValidationError("please select a book first.")
+        result = self._request("GET", f"/books/{book_id}/holds", {"limit": limit})
+        return [_row(HOLD_COLUMNS, item) for item in result["items"]] if result else []
+
+    # --- Reports ---
+    def _report_query(self, name, limit, start, end, output):
+        if not isinstance(name, str) or not name.isidentifier():
+            raise ValidationError(f"no such report: {name}.")
+        query = {"limit": limit, "format": output}
+        query.update({key: value.isoformat() for key, value in (("start", start), ("end", end)) if value})
+        return f"/reports/{name}", query
+
+    def report(self, name, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        result = self._request("GET", *self._report_query(name, limit, start, end, "columns"))
+        columns = [[date.fromisoformat(v) if c in DATE_COLUMNS and v else v for v in result["data"][c]]
+                   for c in result["columns"]]
+        return list(zip(*columns))
+
+    def export_report(self, name, file, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        file.write(self._request("GET", *self._report_query(name, limit, start, end, "csv"), raw=True))
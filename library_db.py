@@ -0,0 +1,667 @@
+import os
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+
+from library_metrics import METRICS, TimedCursor
+
+# Connection details; each one can be overridden with an environment variable
+DB_SETTINGS = {
+    "host": os.environ.get("LIBRARY_DB_HOST", "localhost"),
+    "database": os.environ.get("LIBRARY_DB_NAME", "myDatabase"),
+    "user": os.environ.get("LIBRARY_DB_USER", "postgres"),
+    "password": os.environ.get("LIBRARY_DB_PASSWORD", "1360"),
+}
+
+# Connections kept open / allowed at most in the pool
+POOL_MIN_SIZE = int(os.environ.get("LIBRARY_DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.environ.get("LIBRARY_DB_POOL_MAX", "4"))
+
+# How many times a job is retried on a fresh connection after the old one died
+RECONNECT_ATTEMPTS = 1
+
+# Channel on which the database announces changed rows as "table:id,id,..."
+# ("table:*" for bulk changes); the triggers are created by a migration
+CHANGES_CHANNEL = "library_changes"
+
+# How often the change listener checks for shutdown, and waits before reconnecting
+LISTEN_POLL_SECONDS = 0.5
+LISTEN_RETRY_SECONDS = 5
+
+# Days a book may be kept before its loan counts as overdue
+LOAN_PERIOD_DAYS = int(os.environ.get("LIBRARY_LOAN_PERIOD_DAYS", "14"))
+
+# Days a copy set aside for a hold waits to be picked up, and days a hold may wait in the queue
+HOLD_PICKUP_DAYS = int(os.environ.get("LIBRARY_HOLD_PICKUP_DAYS", "7"))
+HOLD_WAIT_DAYS = int(os.environ.get("LIBRARY_HOLD_WAIT_DAYS", "180"))
+
+# The circulation statements below all return loan rows of the form
+# (loan_id, book_id, member_id, loan_date, return_date, title, member_name),
+# with the book title and member name joined in, so the loans view can be
+# patched from a write without a second lookup.
+
+# Each title has one or more copies in Copies; a loan is of one copy, and
+# the copy's is_available flag is what the statements below check and set.
+# A copy set aside for a hold is not available, except to the member whose
+# hold it is. Borrowing a title ends the member's open hold on it; a copy
+# set aside for them that they did not take goes back on the shelf, and
+# the job then passes it on to the next hold with _allocate_holds.
+
+# Checkout in one statement. The first available copy of the title is
+# locked with FOR UPDATE, so a second desk loaning the same copy waits,
+# re-checks is_available once the first one commits, and moves on to the
+# next available copy, if any. The trailing SELECT always returns one row:
+# the new loan (or NULLs) plus what is needed to explain a refusal.
+LOAN_BOOK_SQL = """
+WITH copy AS (
+    SELECT copy_id, book_id FROM Copies
+    WHERE book_id = %(book_id)s
+      AND (is_available OR copy_id IN (SELECT copy_id FROM Holds
+                                       WHERE member_id = %(member_id)s AND status = 'ready'))
+    ORDER BY is_available, copy_id LIMIT 1
+    FOR UPDATE
+), member AS (
+    SELECT member_id FROM Members WHERE member_id = %(member_id)s
+), loan AS (
+    INSERT INTO Loans (book_id, copy_id, member_id, loan_date)
+    SELECT copy.book_id, copy.copy_id, member.member_id, COALESCE(%(loan_date)s::date, CURRENT_DATE)
+    FROM copy, member
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), taken AS (
+    UPDATE Copies SET is_available = FALSE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+), fulfilled AS (
+    UPDATE Holds SET status = 'fulfilled', closed_at = now()
+    WHERE member_id = %(member_id)s AND status IN ('waiting', 'ready')
+      AND book_id IN (SELECT book_id FROM loan)
+    RETURNING copy_id
+), released AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM fulfilled) AND copy_id NOT IN (SELECT copy_id FROM loan)
+)
+SELECT loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name,
+       EXISTS (SELECT 1 FROM Books WHERE book_id = %(book_id)s),
+       EXISTS (SELECT 1 FROM member)
+FROM (VALUES (1)) AS one LEFT JOIN loan ON TRUE
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+# Return of a title in one statement: its oldest open loan is closed and
+# that copy freed. The loan row is locked, so a second return waits, then
+# skips it and closes the next open loan of the title, if there is one.
+RETURN_BOOK_SQL = """
+WITH open_loan AS (
+    SELECT loan_id FROM Loans
+    WHERE book_id = %(book_id)s AND return_date IS NULL
+    ORDER BY loan_id LIMIT 1
+    FOR UPDATE
+), loan AS (
+    UPDATE Loans SET return_date = COALESCE(%(return_date)s::date, CURRENT_DATE)
+    WHERE loan_id IN (SELECT loan_id FROM open_loan)
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), freed AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+)
+SELECT loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name
+FROM loan
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+# Multi-item versions of the two statements above for a stack of books:
+# one copy of every title in the stack is loaned (or one open loan of each
+# closed) in a single statement. As in the single-book statements, only the
+# one row picked per title is locked, so a batch leaves the other copies of
+# a popular title to the other desks. Titles are visited in id order so
+# overlapping batches from two desks cannot deadlock.
+LOAN_BOOKS_SQL = """
+WITH copy AS (
+    SELECT c.copy_id, c.book_id
+    FROM (SELECT DISTINCT unnest(%(book_ids)s::int[]) AS book_id ORDER BY 1) t
+    CROSS JOIN LATERAL (
+        SELECT copy_id, book_id FROM Copies
+        WHERE book_id = t.book_id
+          AND (is_available OR copy_id IN (SELECT copy_id FROM Holds
+                                           WHERE member_id = %(member_id)s AND status = 'ready'))
+        ORDER BY is_available, copy_id LIMIT 1
+        FOR UPDATE
+    ) c
+), member AS (
+    SELECT member_id FROM Members WHERE member_id = %(member_id)s
+), loan AS (
+    INSERT INTO Loans (book_id, copy_id, member_id, loan_date)
+    SELECT copy.book_id, copy.copy_id, member.member_id, CURRENT_DATE FROM copy, member
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), taken AS (
+    UPDATE Copies SET is_available = FALSE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+), fulfilled AS (
+    UPDATE Holds SET status = 'fulfilled', closed_at = now()
+    WHERE member_id = %(member_id)s AND status IN ('waiting', 'ready')
+      AND book_id IN (SELECT book_id FROM loan)
+    RETURNING copy_id
+), released AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM fulfilled) AND copy_id NOT IN (SELECT copy_id FROM loan)
+)
+SELECT loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name
+FROM loan
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+RETURN_BOOKS_SQL = """
+WITH open_loan AS (
+    SELECT l.loan_id
+    FROM (SELECT DISTINCT unnest(%(book_ids)s::int[]) AS book_id ORDER BY 1) t
+    CROSS JOIN LATERAL (
+        SELECT loan_id FROM Loans
+        WHERE book_id = t.book_id AND return_date IS NULL
+        ORDER BY loan_id LIMIT 1
+        FOR UPDATE
+    ) l
+), loan AS (
+    UPDATE Loans SET return_date = CURRENT_DATE
+    WHERE loan_id IN (SELECT loan_id FROM open_loan)
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), freed AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+)
+SELECT loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name
+FROM loan
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+# Scanned copies: checkout and return of exact copies by barcode, one
+# statement for a whole batch of scans. Copies are found through the unique
+# barcode index and open loans through loans_copy_id_idx. Each result
+# row is (barcode, *loan row).
+CHECKOUT_COPIES_SQL = """
+WITH copy AS (
+    SELECT copy_id, book_id, barcode FROM Copies
+    WHERE barcode = ANY(%(barcodes)s)
+      AND (is_available OR copy_id IN (SELECT copy_id FROM Holds
+                                       WHERE member_id = %(member_id)s AND status = 'ready'))
+    ORDER BY copy_id
+    FOR UPDATE
+), member AS (
+    SELECT member_id FROM Members WHERE member_id = %(member_id)s
+), loan AS (
+    INSERT INTO Loans (book_id, copy_id, member_id, loan_date)
+    SELECT copy.book_id, copy.copy_id, member.member_id, CURRENT_DATE FROM copy, member
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), taken AS (
+    UPDATE Copies SET is_available = FALSE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+), fulfilled AS (
+    UPDATE Holds SET status = 'fulfilled', closed_at = now()
+    WHERE member_id = %(member_id)s AND status IN ('waiting', 'ready')
+      AND book_id IN (SELECT book_id FROM loan)
+    RETURNING copy_id
+), released AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM fulfilled) AND copy_id NOT IN (SELECT copy_id FROM loan)
+)
+SELECT copy.barcode, loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name
+FROM loan
+JOIN copy ON copy.copy_id = loan.copy_id
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+RETURN_COPIES_SQL = """
+WITH open_loan AS (
+    SELECT l.loan_id, c.barcode FROM Copies c
+    JOIN Loans l ON l.copy_id = c.copy_id AND l.return_date IS NULL
+    WHERE c.barcode = ANY(%(barcodes)s)
+    ORDER BY l.loan_id
+    FOR UPDATE OF l
+), loan AS (
+    UPDATE Loans SET return_date = CURRENT_DATE
+    WHERE loan_id IN (SELECT loan_id FROM open_loan)
+    RETURNING loan_id, book_id, copy_id, member_id, loan_date, return_date
+), freed AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM loan)
+)
+SELECT open_loan.barcode, loan.loan_id, loan.book_id, loan.member_id, loan.loan_date, loan.return_date,
+       b.title, m.name
+FROM loan
+JOIN open_loan ON open_loan.loan_id = loan.loan_id
+LEFT JOIN Books b ON b.book_id = loan.book_id
+LEFT JOIN Members m ON m.member_id = loan.member_id
+"""
+
+# Hands the free copies of the given titles to their waiting holds, oldest
+# hold first, so a returned copy goes to the next member in line in the
+# same transaction as the return. Only as many holds as there are free
+# copies are read, from the head of each queue; rows another transaction
+# has locked (a copy being loaned, a hold being cancelled) are skipped.
+# Returns (hold_id, book_id, member_id, copy_id, barcode, expires_at,
+# member_name) for each copy set aside.
+ALLOCATE_HOLDS_SQL = """
+WITH free AS (
+    SELECT copy_id, book_id FROM Copies
+    WHERE book_id = ANY(%(book_ids)s) AND is_available
+    ORDER BY copy_id
+    FOR UPDATE SKIP LOCKED
+), free_ranked AS (
+    SELECT copy_id, book_id, row_number() OVER (PARTITION BY book_id ORDER BY copy_id) AS n FROM free
+), waiting AS (
+    SELECT h.hold_id, h.book_id, row_number() OVER (PARTITION BY h.book_id ORDER BY h.hold_id) AS n
+    FROM (SELECT book_id, count(*) AS copies FROM free GROUP BY book_id) f
+    CROSS JOIN LATERAL (
+        SELECT hold_id, book_id FROM Holds
+        WHERE book_id = f.book_id AND status = 'waiting'
+        ORDER BY hold_id LIMIT f.copies
+        FOR UPDATE SKIP LOCKED
+    ) h
+), ready AS (
+    UPDATE Holds h SET status = 'ready', copy_id = c.copy_id,
+                       expires_at = now() + make_interval(days => %(pickup_days)s)
+    FROM waiting w JOIN free_ranked c ON c.book_id = w.book_id AND c.n = w.n
+    WHERE h.hold_id = w.hold_id
+    RETURNING h.hold_id, h.book_id, h.member_id, h.copy_id, h.expires_at
+), held AS (
+    UPDATE Copies SET is_available = FALSE
+    WHERE copy_id IN (SELECT copy_id FROM ready)
+)
+SELECT ready.hold_id, ready.book_id, ready.member_id, ready.copy_id, c.barcode, ready.expires_at, m.name
+FROM ready
+JOIN Copies c ON c.copy_id = ready.copy_id
+LEFT JOIN Members m ON m.member_id = ready.member_id
+ORDER BY ready.hold_id
+"""
+
+
+class CirculationError(Exception):
+    """Raised by a loan or return job when the request cannot be honoured."""
+
+
+class CommitUnknownError(Exception):
+    """Raised when the connection is lost during COMMIT, so whether the job's writes were saved is unknown.
+
+    Callers must not treat this like a connection lost before the commit:
+    repeating or queueing the job could apply it twice.
+    """
+
+
+class Database:
+    """Thread-safe pool of PostgreSQL connections.
+
+    Every job gets its own connection, cursor and transaction through
+    ``run``, so concurrent jobs no longer queue behind one shared cursor and
+    a failed statement only rolls back its own transaction.
+    """
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, **settings):
+        self.max_size = max_size
+        self._settings = {**(settings or DB_SETTINGS), "cursor_factory": TimedCursor}
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, **self._settings)
+
+    def run(self, fn, *args, on_connection=None):
+        """Runs fn(cursor, *args) in one transaction and returns its result.
+
+        Commits when fn returns and rolls back when it raises. If the pooled
+        connection turns out to be dead, it is dropped and the job is retried
+        on a new one; nothing was committed yet, so a retried write cannot be
+        applied twice. A connection lost during the commit itself raises
+        CommitUnknownError instead, as the server may or may not have committed.
+
+        on_connection, if given, is called with the borrowed connection and
+        with None before it goes back to the pool, so another thread can
+        cancel the running statement in between.
+
+        The whole job, commit included, is timed into METRICS under the name
+        of fn, and so are its statements.
+        """
+        job = getattr(fn, "__name__", type(fn).__name__)
+        start = time.perf_counter()
+        try:
+            for attempt in range(RECONNECT_ATTEMPTS + 1):
+                conn = self._getconn()
+                if on_connection:
+                    on_connection(conn)
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.job = job
+                        result = fn(cursor, *args)
+                except Exception as e:
+                    lost = self._release(conn, on_connection, rollback=True)
+                    if lost and isinstance(e, psycopg2.Error) and attempt < RECONNECT_ATTEMPTS:
+                        logging.warning("Database connection lost, reconnecting: %s", e)
+                        continue
+                    METRICS.count("library_db_job_errors_total", job=job)
+                    raise
+                try:
+                    conn.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    METRICS.count("library_db_job_errors_total", job=job)
+                    logging.error("Database connection lost while committing %s: %s", job, e)
+                    raise CommitUnknownError("the connection to the database was lost while saving; check "
+                                             "whether the change went through before repeating it.") from e
+                finally:
+                    self._release(conn, on_connection)
+                return result
+        finally:
+            METRICS.observe("library_db_job_seconds", time.perf_counter() - start, job=job)
+
+    @contextmanager
+    def autocommit_cursor(self):
+        """Yields a cursor whose statements each commit on their own.
+
+        Needed for statements that cannot run inside a transaction block,
+        such as CREATE INDEX CONCURRENTLY.
+        """
+        conn = self._getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                yield cursor
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
+            if not self._pool.closed:
+                self._pool.putconn(conn, close=bool(conn.closed))
+
+    def connect(self):
+        """Opens a dedicated autocommit connection outside the pool, e.g. for LISTEN."""
+        conn = psycopg2.connect(**self._settings)
+        conn.autocommit = True
+        return conn
+
+    def _getconn(self):
+        """Borrows a pooled connection.
+
+        A closed pool is reported as a lost connection (InterfaceError); an
+        exhausted one raises PoolError, which is not a connection problem.
+        """
+        try:
+            return self._pool.getconn()
+        except pool.PoolError:
+            if self._pool.closed:
+                raise psycopg2.InterfaceError("connection pool is closed") from None
+            raise
+
+    def _release(self, conn, on_connection=None, rollback=False):
+        """Returns a connection to the pool, closing it if it is broken.
+
+        Returns True when the connection was found broken.
+        """
+        if on_connection:
+            on_connection(None)
+        try:
+            if rollback and not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        finally:
+            lost = bool(conn.closed)
+            # A pool closed while the job ran has closed the connection already
+            if not self._pool.closed:
+                self._pool.putconn(conn, close=lost)
+        return lost
+
+    def close(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+
+
+def parse_change(payload):
+    """Splits a "table:id,id,..." payload into (table, ids); ids is None for "table:*"."""
+    table, _, ids = payload.partition(":")
+    if ids == "*":
+        return table, None
+    return table, [int(i) for i in ids.split(",") if i.isdigit()]
+
+
+class ChangeListener(threading.Thread):
+    """Passes every change notification from the database on to handlers.
+
+    Handlers are called on the listener thread as handler(table, ids), where
+    ids is None when every row of the table may have changed. After a
+    reconnect, notifications may have been missed, so handlers get
+    handler(None, None): anything in any table may have changed.
+    """
+
+    def __init__(self, db, handlers=()):
+        super().__init__(name="library-change-listener", daemon=True)
+        self._db = db
+        self._handlers = list(handlers)
+        self._stopped = threading.Event()
+        self.listening = threading.Event()
+
+    def add_handler(self, handler):
+        # Replaced rather than appended to, so the listener thread never sees it change mid-loop
+        self._handlers = self._handlers + [handler]
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                conn = self._db.connect()
+            except psycopg2.Error as e:
+                logging.warning("Change listener cannot connect, retrying: %s", e)
+                self._stopped.wait(LISTEN_RETRY_SECONDS)
+                continue
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+                if self.listening.is_set():
+                    # Reconnected: whatever changed while nobody listened is unknown
+                    self._dispatch(None, None)
+                self.listening.set()
+                self._listen(conn)
+            except psycopg2.Error as e:
+                logging.warning("Change listener lost its connection, reconnecting: %s", e)
+            finally:
+                conn.close()
+
+    def _listen(self, conn):
+        while not self._stopped.is_set():
+            if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self._dispatch(*parse_change(conn.notifies.pop(0).payload))
+
+    def _dispatch(self, table, ids):
+        for handler in self._handlers:
+            try:
+                handler(table, ids)
+            except Exception as e:
+                logging.error("Change handler failed for %s: %s", table, e)
+
+
+# --- Circulation jobs ---
+def db_loan_book(cursor, book_id, member_id, loan_date=None):
+    """Atomically records a loan, dated today unless loan_date is given; returns the loan row."""
+    cursor.execute(LOAN_BOOK_SQL, {"book_id": book_id, "member_id": member_id, "loan_date": loan_date})
+    *loan, book_exists, member_exists = cursor.fetchone()
+    if loan[0] is not None:
+        _allocate_holds(cursor, [book_id])
+        return tuple(loan)
+    if not book_exists:
+        logging.error("Book with ID %s does not exist.", book_id)
+        raise CirculationError("This book doesn't exist.")
+    if not member_exists:
+        logging.error("Member with ID %s does not exist.", member_id)
+        raise CirculationError("This member doesn't exist.")
+    cursor.execute("SELECT 1 FROM Holds WHERE book_id = %s AND status = 'ready' LIMIT 1", (book_id,))
+    if cursor.fetchone():
+        logging.warning("Every free copy of book with ID %s is set aside for a hold.", book_id)
+        raise CirculationError("Every copy of this book is on loan or set aside for a member's hold.")
+    logging.warning("Every copy of book with ID %s is on loan.", book_id)
+    raise CirculationError("Every copy of this book is currently on loan.")
+
+
+def db_return_book(cursor, book_id, return_date=None):
+    """Atomically closes the oldest open loan of a book; returns the updated loan rows."""
+    cursor.execute(RETURN_BOOK_SQL, {"book_id": book_id, "return_date": return_date})
+    loans = cursor.fetchall()
+    if not loans:
+        logging.warning("Book with ID %s is not currently on loan.", book_id)
+        raise CirculationError(" This book didn't got loaned or has been returned.")
+    _allocate_holds(cursor, [book_id])
+    return loans
+
+
+def db_loan_books(cursor, book_ids, member_id):
+    """Loans one copy of every book in book_ids to one member in one transaction.
+
+    Returns (loans, refused_ids); refused books are missing or have no copy left.
+    """
+    cursor.execute(LOAN_BOOKS_SQL, {"book_ids": list(book_ids), "member_id": member_id})
+    loans = cursor.fetchall()
+    if not loans:
+        cursor.execute("SELECT 1 FROM Members WHERE member_id = %s", (member_id,))
+        if not cursor.fetchone():
+            logging.error("Member with ID %s does not exist.", member_id)
+            raise CirculationError("This member doesn't exist.")
+    loaned = {loan[1] for loan in loans}
+    _allocate_holds(cursor, sorted(loaned))
+    refused = sorted(set(book_ids) - loaned)
+    if refused:
+        logging.warning("Books %s could not be loaned to member %s.", refused, member_id)
+    return loans, refused
+
+
+def db_return_books(cursor, book_ids):
+    """Returns every book in book_ids that is on loan, in one transaction.
+
+    Returns (loans, not_on_loan_ids).
+    """
+    cursor.execute(RETURN_BOOKS_SQL, {"book_ids": list(book_ids)})
+    loans = cursor.fetchall()
+    _allocate_holds(cursor, sorted({loan[1] for loan in loans}))
+    not_on_loan = sorted(set(book_ids) - {loan[1] for loan in loans})
+    if not_on_loan:
+        logging.warning("Books %s are not currently on loan.", not_on_loan)
+    return loans, not_on_loan
+
+
+def _allocate_holds(cursor, book_ids):
+    """Sets free copies of the given books aside for their waiting holds; returns the holds now ready."""
+    if not book_ids:
+        return []
+    cursor.execute(ALLOCATE_HOLDS_SQL, {"book_ids": list(book_ids), "pickup_days": HOLD_PICKUP_DAYS})
+    ready = cursor.fetchall()
+    for hold_id, book_id, member_id, _, barcode, _, _ in ready:
+        logging.info("Copy %s of book %s set aside for member %s (hold %s).", barcode, book_id, member_id, hold_id)
+    return ready
+
+
+def _refusals(cursor, barcodes, known_reason):
+    """Returns [(barcode, reason)] for scans that were not honoured, in scan order."""
+    cursor.execute("SELECT c.barcode, EXISTS (SELECT 1 FROM Holds h WHERE h.copy_id = c.copy_id "
+                   "AND h.status = 'ready') FROM Copies c WHERE c.barcode = ANY(%s)", (barcodes,))
+    held = dict(cursor.fetchall())
+    return [(barcode, "unknown barcode" if barcode not in held else
+             "on hold for another member" if held[barcode] and known_reason == "on loan" else known_reason)
+            for barcode in barcodes]
+
+
+def db_checkout_copies(cursor, barcodes, member_id):
+    """Loans the scanned copies to one member in one transaction.
+
+    Returns (loaned, refused): [(barcode, loan row)] and [(barcode, reason)],
+    both in scan order; a barcode scanned twice counts once.
+    """
+    barcodes = list(dict.fromkeys(barcodes))
+    cursor.execute(CHECKOUT_COPIES_SQL, {"barcodes": barcodes, "member_id": member_id})
+    loans = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    if not loans:
+        cursor.execute("SELECT 1 FROM Members WHERE member_id = %s", (member_id,))
+        if not cursor.fetchone():
+            logging.error("Member with ID %s does not exist.", member_id)
+            raise CirculationError("This member doesn't exist.")
+    loaned = [(barcode, loans[barcode]) for barcode in barcodes if barcode in loans]
+    _allocate_holds(cursor, sorted({loan[1] for loan in loans.values()}))
+    refused = _refusals(cursor, [barcode for barcode in barcodes if barcode not in loans], "on loan")
+    if refused:
+        logging.warning("Copies %s could not be loaned to member %s.", refused, member_id)
+    return loaned, refused
+
+
+def db_return_copies(cursor, barcodes):
+    """Returns the scanned copies in one transaction.
+
+    Returns (returned, refused, held): the first two as for
+    db_checkout_copies, and [(barcode, member_name)] for each returned copy
+    that was set aside for the next hold on its title.
+    """
+    barcodes = list(dict.fromkeys(barcodes))
+    cursor.execute(RETURN_COPIES_SQL, {"barcodes": barcodes})
+    loans = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    returned = [(barcode, loans[barcode]) for barcode in barcodes if barcode in loans]
+    ready = _allocate_holds(cursor, sorted({loan[1] for loan in loans.values()}))
+    held = [(hold[4], hold[6] or f"#{hold[2]}") for hold in ready if hold[4] in loans]
+    refused = _refusals(cursor, [barcode for barcode in barcodes if barcode not in loans], "not on loan")
+    if refused:
+        logging.warning("Copies %s could not be returned.", refused)
+    return returned, refused, held
+
+
+# --- Copy jobs ---
+def db_fetch_copies(cursor, book_id):
+    """Returns the copies of one book as (copy_id, book_id, barcode, is_available) rows."""
+    cursor.execute("SELECT copy_id, book_id, barcode, is_available FROM Copies WHERE book_id = %s "
+                   "ORDER BY copy_id", (book_id,))
+    return cursor.fetchall()
+
+
+def db_availability(cursor, book_ids):
+    """Returns (book_id, copies, available) for each of book_ids that has copies."""
+    cursor.execute("SELECT book_id, count(*), count(*) FILTER (WHERE is_available) FROM Copies "
+                   "WHERE book_id = ANY(%s) GROUP BY book_id ORDER BY book_id", (list(book_ids),))
+    return cursor.fetchall()
+
+
+def db_add_copy(cursor, book_id, barcode=None):
+    """Adds a copy of a book, with a generated barcode unless one is given; returns the copy row."""
+    cursor.execute("SELECT 1 FROM Books WHERE book_id = %s", (book_id,))
+    if not cursor.fetchone():
+        raise CirculationError("This book doesn't exist.")
+    if barcode:
+        cursor.execute("SELECT 1 FROM Copies WHERE barcode = %s", (barcode,))
+        if cursor.fetchone():
+            raise CirculationError(f"Barcode {barcode} is already in use.")
+    cursor.execute(
+        "WITH next AS (SELECT nextval(pg_get_serial_sequence('copies', 'copy_id')) AS copy_id) "
+        "INSERT INTO Copies (copy_id, book_id, barcode) "
+        "SELECT copy_id, %s, COALESCE(%s, library_barcode(copy_id)) FROM next "
+        "RETURNING copy_id", (book_id, barcode))
+    copy_id = cursor.fetchone()[0]
+    # A new copy of a title with a queue goes straight to the next hold
+    _allocate_holds(cursor, [book_id])
+    cursor.execute("SELECT copy_id, book_id, barcode, is_available FROM Copies WHERE copy_id = %s", (copy_id,))
+    return cursor.fetchone()
+
+
+def db_delete_copy(cursor, copy_id):
+    """Deletes a copy that is not on loan; returns the deleted row, or None if there is no such copy."""
+    cursor.execute("SELECT is_available FROM Copies WHERE copy_id = %s FOR UPDATE", (copy_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if not row[0]:
+        raise CirculationError("This copy is on loan or set aside for a hold and cannot be removed.")
+    cursor.execute("DELETE FROM Copies WHERE copy_id = %s RETURNING copy_id, book_id, barcode, is_available",
+                   (copy_id,))
+    return cursor.fetchone()
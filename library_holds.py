@@ -0,0 +1,206 @@
+"""Holds: members queue for a title that is out, and returned copies go to the next in line.
+
+Migration 12 adds the Holds table. A waiting hold sits in its title's queue,
+oldest first. Whenever a copy of the title comes free (a return, a new
+copy, a cancelled or expired hold), the same transaction sets it aside for
+the hold at the head of the queue (see ALLOCATE_HOLDS_SQL in library_db).
+The hold is then ready and waits HOLD_PICKUP_DAYS for its member, who gets
+that copy on checkout. A hold can only be placed while no copy is on the
+shelf, so an available copy never has a queue waiting for it.
+
+Holds that waited too long are expired in batches by db_expire_holds, which
+the API server runs every HOLD_EXPIRY_SECONDS; without the API, run it from
+cron:
+
+    python library_holds.py --expire
+"""
+import argparse
+import logging
+import os
+import sys
+
+from library_db import HOLD_WAIT_DAYS, CirculationError, Database, _allocate_holds
+
+# Holds expired per transaction, and seconds between expiry runs in the API server (0 turns them off)
+HOLD_EXPIRY_BATCH = 1000
+HOLD_EXPIRY_SECONDS = int(os.environ.get("LIBRARY_HOLD_EXPIRY_SECONDS", "300"))
+
+# Hold rows are (hold_id, book_id, member_id, status, placed_at, expires_at,
+# position, barcode, title, member_name). position is the place in the
+# queue of a waiting hold, counted on the queue index, and barcode is the
+# copy set aside for a ready one.
+HOLD_SELECT = """
+SELECT h.hold_id, h.book_id, h.member_id, h.status, h.placed_at, h.expires_at,
+       CASE WHEN h.status = 'waiting' THEN (
+           SELECT count(*) FROM Holds w
+           WHERE w.book_id = h.book_id AND w.status = 'waiting' AND w.hold_id <= h.hold_id
+       ) END,
+       c.barcode, b.title, m.name
+FROM Holds h
+LEFT JOIN Copies c ON c.copy_id = h.copy_id AND h.status = 'ready'
+LEFT JOIN Books b ON b.book_id = h.book_id
+LEFT JOIN Members m ON m.member_id = h.member_id
+"""
+
+# A title's ready holds, then the head of its queue; positions come from
+# row_number, so listing the queue does not count it once per row
+BOOK_HOLDS_SQL = """
+SELECT q.hold_id, q.book_id, q.member_id, q.status, q.placed_at, q.expires_at, q.position,
+       c.barcode, b.title, m.name
+FROM (
+    (SELECT hold_id, book_id, member_id, status, placed_at, expires_at, copy_id, NULL::bigint AS position
+     FROM Holds WHERE book_id = %(book_id)s AND status = 'ready' ORDER BY hold_id)
+    UNION ALL
+    (SELECT hold_id, book_id, member_id, status, placed_at, expires_at, copy_id,
+            row_number() OVER (ORDER BY hold_id)
+     FROM Holds WHERE book_id = %(book_id)s AND status = 'waiting' ORDER BY hold_id LIMIT %(limit)s)
+) q
+LEFT JOIN Copies c ON c.copy_id = q.copy_id
+LEFT JOIN Books b ON b.book_id = q.book_id
+LEFT JOIN Members m ON m.member_id = q.member_id
+ORDER BY q.position NULLS FIRST, q.hold_id
+"""
+
+# One batch of due holds closed in one statement; the copies set aside for
+# the ready ones go back on the shelf, for the job to pass on
+EXPIRE_HOLDS_SQL = """
+WITH due AS (
+    SELECT hold_id FROM Holds
+    WHERE status IN ('waiting', 'ready') AND expires_at <= now()
+    ORDER BY expires_at LIMIT %(batch)s
+    FOR UPDATE SKIP LOCKED
+), expired AS (
+    UPDATE Holds h SET status = 'expired', closed_at = now()
+    FROM due WHERE h.hold_id = due.hold_id
+    RETURNING h.book_id, h.copy_id
+), freed AS (
+    UPDATE Copies SET is_available = TRUE
+    WHERE copy_id IN (SELECT copy_id FROM expired)
+)
+SELECT book_id, count(*) FROM expired GROUP BY book_id
+"""
+
+# Titles with a queue and a copy on the shelf; only a desk that gave up
+# a copy while another was placing a hold can leave one behind
+UNSERVED_QUEUES_SQL = """
+SELECT q.book_id FROM (SELECT DISTINCT book_id FROM Holds WHERE status = 'waiting') q
+WHERE EXISTS (SELECT 1 FROM Copies c WHERE c.book_id = q.book_id AND c.is_available)
+"""
+
+
+# --- Database jobs ---
+def db_fetch_hold(cursor, hold_id):
+    """Returns one hold row, with its queue position if it is waiting, or None."""
+    cursor.execute(HOLD_SELECT + "WHERE h.hold_id = %s", (hold_id,))
+    return cursor.fetchone()
+
+
+def db_member_holds(cursor, member_id):
+    """Returns a member's waiting and ready holds, oldest first."""
+    cursor.execute(HOLD_SELECT + "WHERE h.member_id = %s AND h.status IN ('waiting', 'ready') ORDER BY h.hold_id",
+                   (member_id,))
+    return cursor.fetchall()
+
+
+def db_book_holds(cursor, book_id, limit):
+    """Returns the ready holds on a title and the first limit holds of its queue."""
+    cursor.execute(BOOK_HOLDS_SQL, {"book_id": book_id, "limit": limit})
+    return cursor.fetchall()
+
+
+def db_place_hold(cursor, book_id, member_id):
+    """Puts a member at the end of a title's queue; returns the hold row."""
+    cursor.execute("SELECT 1 FROM Books WHERE book_id = %s", (book_id,))
+    if not cursor.fetchone():
+        raise CirculationError("This book doesn't exist.")
+    cursor.execute("SELECT 1 FROM Members WHERE member_id = %s", (member_id,))
+    if not cursor.fetchone():
+        raise CirculationError("This member doesn't exist.")
+    # Locking the copies makes a concurrent return wait for this hold, so it cannot free a copy unseen
+    cursor.execute("SELECT bool_or(is_available) FROM (SELECT is_available FROM Copies "
+                   "WHERE book_id = %s FOR SHARE) c", (book_id,))
+    if cursor.fetchone()[0]:
+        raise CirculationError("A copy of this book is available; loan it instead.")
+    cursor.execute("SELECT 1 FROM Loans WHERE book_id = %s AND member_id = %s AND return_date IS NULL",
+                   (book_id, member_id))
+    if cursor.fetchone():
+        raise CirculationError("This member already has this book on loan.")
+    cursor.execute("SELECT 1 FROM Holds WHERE member_id = %s AND book_id = %s AND status IN ('waiting', 'ready')",
+                   (member_id, book_id))
+    if cursor.fetchone():
+        raise CirculationError("This member already has a hold on this book.")
+    cursor.execute("INSERT INTO Holds (book_id, member_id, expires_at) "
+                   "VALUES (%s, %s, now() + make_interval(days => %s)) RETURNING hold_id",
+                   (book_id, member_id, HOLD_WAIT_DAYS))
+    hold_id = cursor.fetchone()[0]
+    logging.info("Member %s placed hold %s on book %s.", member_id, hold_id, book_id)
+    return db_fetch_hold(cursor, hold_id)
+
+
+def db_cancel_hold(cursor, hold_id):
+    """Cancels an open hold, passing its copy on if one was set aside; returns the row, or None."""
+    cursor.execute("UPDATE Holds SET status = 'cancelled', closed_at = now() "
+                   "WHERE hold_id = %s AND status IN ('waiting', 'ready') RETURNING book_id, copy_id", (hold_id,))
+    row = cursor.fetchone()
+    if row is None:
+        hold = db_fetch_hold(cursor, hold_id)
+        if hold is not None:
+            raise CirculationError(f"This hold is already {hold[3]}.")
+        return None
+    book_id, copy_id = row
+    if copy_id is not None:
+        cursor.execute("UPDATE Copies SET is_available = TRUE WHERE copy_id = %s", (copy_id,))
+        _allocate_holds(cursor, [book_id])
+    logging.info("Hold %s on book %s cancelled.", hold_id, book_id)
+    return db_fetch_hold(cursor, hold_id)
+
+
+def db_expire_holds(cursor, batch=HOLD_EXPIRY_BATCH):
+    """Expires up to batch due holds and passes their copies on; returns how many expired."""
+    cursor.execute(EXPIRE_HOLDS_SQL, {"batch": batch})
+    expired = cursor.fetchall()
+    _allocate_holds(cursor, [book_id for book_id, _ in expired])
+    return sum(count for _, count in expired)
+
+
+def db_serve_queues(cursor):
+    """Hands any copy left on the shelf of a title with a queue to its next hold; returns the holds served."""
+    cursor.execute(UNSERVED_QUEUES_SQL)
+    return len(_allocate_holds(cursor, [row[0] for row in cursor.fetchall()]))
+
+
+def expire_holds(db, batch=HOLD_EXPIRY_BATCH, on_connection=None):
+    """Expires every due hold, batch by batch, each batch in its own transaction; returns the count."""
+    total = 0
+    while True:
+        expired = db.run(db_expire_holds, batch, on_connection=on_connection)
+        total += expired
+        if expired < batch:
+            break
+    served = db.run(db_serve_queues, on_connection=on_connection)
+    if total:
+        logging.info("%s holds expired.", total)
+    if served:
+        logging.warning("%s copies left on the shelf were passed on to waiting holds.", served)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expire", action="store_true", help="expire the holds whose time is up")
+    parser.add_argument("--batch", type=int, default=HOLD_EXPIRY_BATCH, help="holds expired per transaction")
+    args = parser.parse_args(argv)
+    if not args.expire:
+        parser.error("nothing to do; pass --expire")
+
+    logging.basicConfig(level=logging.WARNING)
+    db = Database(min_size=1, max_size=1)
+    try:
+        print(f"{expire_holds(db, args.batch)} holds expired.", file=sys.stderr)
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
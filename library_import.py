@@ -0,0 +1,172 @@
+"""Bulk import of book records from CSV or MARC 21 files.
+
+Records are read lazily, validated and de-duplicated one batch at a time,
+and each batch is streamed into Books with a single COPY in its own
+transaction, so memory use stays flat however large the file is. An ISBN
+already in the catalogue, including one from an earlier batch of the same
+file, is skipped by the check before the COPY.
+
+    python library_import.py new_branch.csv
+    python library_import.py catalogue.mrc
+"""
+import csv
+import io
+import logging
+import sys
+
+from library_db import Database
+from library_service import normalize_isbn
+
+# Records validated and copied per transaction
+IMPORT_BATCH_SIZE = 5000
+
+# Column limits from the Books table
+MAX_TEXT_LENGTH = 255
+
+MARC_FIELD_TERMINATOR = b"\x1e"
+MARC_SUBFIELD_DELIMITER = b"\x1f"
+
+
+def check_digit_ok(isbn):
+    """Returns whether a normalized ISBN-10/13 has the right check digit.
+
+    Imported records come from outside catalogues, so they are held to the
+    check digit as well as the format the service accepts.
+    """
+    if len(isbn) == 10:
+        return sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(isbn)) % 11 == 0
+    return sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(isbn)) % 10 == 0
+
+
+def read_csv_records(path):
+    """Yields (title, author, isbn) from a CSV file with a title,author,isbn header."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+            yield row.get("title", ""), row.get("author", ""), row.get("isbn", "")
+
+
+def _marc_subfield(field, code):
+    # A data field is two indicator bytes followed by delimited subfields
+    for subfield in field[2:].split(MARC_SUBFIELD_DELIMITER):
+        if subfield[:1] == code:
+            return subfield[1:]
+    return b""
+
+
+def _marc_book(record):
+    encoding = "utf-8" if record[9:10] == b"a" else "latin-1"
+    base = int(record[12:17])
+    directory = record[24:base - 1]
+    fields = {}
+    for i in range(0, len(directory) - 11, 12):
+        tag = directory[i:i + 3].decode("ascii", "replace")
+        length = int(directory[i + 3:i + 7])
+        start = base + int(directory[i + 7:i + 12])
+        fields.setdefault(tag, record[start:start + length].rstrip(MARC_FIELD_TERMINATOR))
+
+    def text(tags):
+        for tag in tags:
+            if tag in fields:
+                return _marc_subfield(fields[tag], b"a").decode(encoding, "replace").strip(" /:;,.")
+        return ""
+
+    # 020$a often carries a qualifier, e.g. "0262033844 (hardcover)"
+    isbn = text(["020"]).split(" ")[0]
+    return text(["245"]), text(["100", "110", "700"]), isbn
+
+
+def read_marc_records(path):
+    """Yields (title, author, isbn) from a binary MARC 21 (ISO 2709) file."""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(5)
+            if not head.strip():
+                return
+            record = head + f.read(int(head) - 5)
+            yield _marc_book(record)
+
+
+def read_records(path):
+    """Picks the reader from the file extension (.mrc/.marc are MARC, the rest CSV)."""
+    if path.lower().endswith((".mrc", ".marc")):
+        return read_marc_records(path)
+    return read_csv_records(path)
+
+
+def validate_batch(records):
+    """Splits a batch into valid (title, author, isbn) rows and a rejected count.
+
+    An ISBN repeated within the batch is rejected as a duplicate; repeats
+    from earlier batches are already in Books and skipped by db_copy_books.
+    """
+    valid = []
+    rejected = 0
+    seen_isbns = set()
+    for title, author, isbn_text in records:
+        isbn = normalize_isbn(isbn_text) if isbn_text else None
+        if (not title or not author or len(title) > MAX_TEXT_LENGTH or len(author) > MAX_TEXT_LENGTH
+                or (isbn_text and not (isbn and check_digit_ok(isbn))) or isbn in seen_isbns):
+            rejected += 1
+            continue
+        if isbn:
+            seen_isbns.add(isbn)
+        valid.append((title, author, isbn))
+    return valid, rejected
+
+
+def db_copy_books(cursor, books):
+    """COPYs a batch of books, skipping ISBNs already in the catalogue; returns the count."""
+    cursor.execute("SELECT isbn FROM Books WHERE isbn = ANY(%s)", ([isbn for _, _, isbn in books if isbn],))
+    existing = {row[0] for row in cursor.fetchall()}
+    rows = [book for book in books if book[2] not in existing]
+    buffer = io.StringIO()
+    # None is written as an unquoted empty field, which COPY reads as NULL
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert("COPY Books (title, author, isbn) FROM STDIN WITH (FORMAT csv)", buffer)
+    return len(rows)
+
+
+def import_books(db, records, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Imports (title, author, isbn) records; returns (imported, skipped).
+
+    progress(imported, skipped) is called after every committed batch.
+    """
+    imported = skipped = 0
+    batch = []
+    records = iter(records)
+    while True:
+        batch.clear()
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            break
+        valid, rejected = validate_batch(batch)
+        copied = db.run(db_copy_books, valid) if valid else 0
+        imported += copied
+        skipped += rejected + len(valid) - copied
+        logging.info("Import batch committed: %s imported, %s skipped so far.", imported, skipped)
+        if progress:
+            progress(imported, skipped)
+    return imported, skipped
+
+
+def main(argv):
+    if len(argv) != 2:
+        print("usage: python library_import.py FILE.csv|FILE.mrc")
+        return 2
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = Database()
+    try:
+        imported, skipped = import_books(db, read_records(argv[1]))
+    finally:
+        db.close()
+    print(f"{imported} books imported, {skipped} skipped.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,109 @@
+"""Queue-based logging, so writing log files never blocks the GUI thread or event loop.
+
+configure_logging puts a single QueueHandler on the root logger. Calls to
+logging.info and friends only put the record on an in-memory queue. A
+QueueListener thread then formats the records and writes them to a
+rotating log file, one JSON object per line, and to stdout as plain text.
+Messages should be logged with %-style arguments
+(logging.info("Book %s selected.", book_id)), so a message filtered out
+by the level is never formatted at all, and one that is kept is formatted
+on the listener thread.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get("LIBRARY_LOG_LEVEL", "INFO").upper()
+
+# Size-based rotation by default; set LIBRARY_LOG_ROTATE_WHEN (e.g. "midnight") to rotate by time instead
+LOG_MAX_BYTES = int(os.environ.get("LIBRARY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.environ.get("LIBRARY_LOG_BACKUPS", "5"))
+LOG_ROTATE_WHEN = os.environ.get("LIBRARY_LOG_ROTATE_WHEN")
+
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not passed through as extra fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Listeners started by configure_logging and not stopped yet
+_running_listeners = set()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object, including any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats every record before queueing it, which is
+    needed when the queue crosses processes, but not here. The record goes
+    on the queue as it is. Arguments are formatted a moment later, so they
+    must not be mutated after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _file_handler(path):
+    if LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS,
+                                                         encoding="utf-8")
+    return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                encoding="utf-8")
+
+
+def configure_logging(log_file, level=LOG_LEVEL, console=True):
+    """Routes all logging through a queue to log_file (JSON lines) and stdout.
+
+    Returns the started QueueListener. stop_logging writes out the records
+    still queued; it also runs at interpreter exit.
+    """
+    file_handler = _file_handler(log_file)
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    _running_listeners.add(listener)
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener):
+    """Writes out the queued records and stops the listener; safe to call more than once."""
+    # QueueListener.stop() fails if called twice, e.g. by the application and again at exit
+    if listener in _running_listeners:
+        _running_listeners.discard(listener)
+        listener.stop()
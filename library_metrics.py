@@ -0,0 +1,216 @@
+"""Latency histograms, counters and a slow-query log for every database call.
+
+Database connections use TimedCursor, so each statement is timed and its
+fetched rows counted under the name of the job that ran it. The GUI adds
+its own timings for building tables. METRICS can be exported as a
+Prometheus text page or a JSON snapshot:
+
+    GET /metrics               (library_api, Prometheus text format)
+    GET /metrics?format=json
+    library_metrics.json       (written by the desktop application on exit)
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from psycopg2.extensions import cursor as base_cursor
+
+# Statements slower than this are logged with their parameters
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_SLOW_QUERY_MS", "200"))
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Longest parameter text kept in a slow-query log line
+MAX_LOGGED_PARAMS = 500
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Thread-safe set of named histograms and counters, each with labels.
+
+    Collectors registered with add_collector are called at export time and
+    return extra (name, labels, value) gauges, such as cache sizes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the with-block into the histogram name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector):
+        self._collectors = self._collectors + [collector]
+
+    def remove_collector(self, collector):
+        self._collectors = [c for c in self._collectors if c != collector]
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def _gauges(self):
+        gauges = []
+        for collector in self._collectors:
+            try:
+                gauges.extend(collector())
+            except Exception as e:
+                logging.error("Metrics collector failed: %s", e)
+        return gauges
+
+    def snapshot(self):
+        """Returns every metric as plain JSON-serialisable data."""
+        with self._lock:
+            histograms = [
+                {"name": name, "labels": dict(labels), "count": h.count, "sum": round(h.sum, 6),
+                 "buckets": {("+Inf" if bound == float("inf") else str(bound)): n for bound, n in h.cumulative()}}
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        # Sorted by name so each metric's samples stay together, as the text format requires
+        gauges = [{"name": name, "labels": labels, "value": value}
+                  for name, labels, value in sorted(self._gauges(), key=lambda gauge: gauge[0])]
+        return {"histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for h in snapshot["histograms"]:
+            declare(h["name"], "histogram")
+            for bound, n in h["buckets"].items():
+                lines.append(f"{h['name']}_bucket{_labels(h['labels'], le=bound)} {n}")
+            lines.append(f"{h['name']}_sum{_labels(h['labels'])} {h['sum']}")
+            lines.append(f"{h['name']}_count{_labels(h['labels'])} {h['count']}")
+        for c in snapshot["counters"]:
+            declare(c["name"], "counter")
+            lines.append(f"{c['name']}{_labels(c['labels'])} {c['value']}")
+        for g in snapshot["gauges"]:
+            declare(g["name"], "gauge")
+            lines.append(f"{g['name']}{_labels(g['labels'])} {g['value']}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+METRICS = MetricsRegistry()
+
+
+class TimedCursor(base_cursor):
+    """Cursor that times every statement and counts the rows fetched.
+
+    Observations are labelled with ``job``, which Database.run sets to the
+    name of the job function; statements outside a job are labelled "other".
+    """
+
+    job = "other"
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(time.perf_counter() - start, query, vars)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(time.perf_counter() - start, query, None)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._record(time.perf_counter() - start, sql, None)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            METRICS.count("library_db_rows_fetched_total", 1, job=self.job)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        METRICS.count("library_db_rows_fetched_total", len(rows), job=self.job)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        METRICS.count("library_db_rows_fetched_total", len(rows), job=self.job)
+        return rows
+
+    def _record(self, seconds, query, vars):
+        METRICS.observe("library_db_statement_seconds", seconds, job=self.job)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            params = repr(vars)
+            if len(params) > MAX_LOGGED_PARAMS:
+                params = params[:MAX_LOGGED_PARAMS] + "..."
+            statement = " ".join(str(query).split())
+            logging.warning("Slow query in %s (%.0f ms): %s params=%s", self.job, seconds * 1000, statement, params)
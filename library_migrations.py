@@ -0,0 +1,432 @@
+"""Versioned schema migrations, applied at startup.
+
+Each migration runs once per database and is recorded in
+schema_migrations. A migration runs in one transaction together with its
+schema_migrations row, so an interrupted one is rolled back whole and
+simply runs again. The exception is index builds, which use CREATE INDEX
+CONCURRENTLY so the tables stay writable while they run; they cannot run
+in a transaction, so each one first drops a leftover invalid index from
+an interrupted attempt instead.
+
+Optional migrations (ones that need an extension, or can be blocked by
+existing data) do not stop the app when they fail. The failure is
+recorded, and startup tries again only after MIGRATION_RETRY_HOURS; an
+administrator can retry at once from the command line. A client that
+finds another one migrating starts without waiting, unless a required
+migration is still missing; then it waits up to MIGRATION_LOCK_WAIT seconds.
+
+    python library_migrations.py                  # apply pending migrations and exit
+    python library_migrations.py --retry-failed   # also retry failed optional migrations now
+"""
+import argparse
+import logging
+import os
+import time
+from collections import namedtuple
+
+import psycopg2
+
+from library_db import CHANGES_CHANNEL, Database
+
+# Arbitrary key for the advisory lock that keeps two clients from migrating at once
+MIGRATION_LOCK_ID = 7_310_204
+
+# Seconds a client waits for another client's required migrations, and between checks
+MIGRATION_LOCK_WAIT = 60
+MIGRATION_LOCK_POLL = 0.5
+
+# Hours before startup tries a failed optional migration again
+MIGRATION_RETRY_HOURS = int(os.environ.get("LIBRARY_MIGRATION_RETRY_HOURS", "24"))
+
+Migration = namedtuple("Migration", "version description statements optional", defaults=(False,))
+
+# status is 'applied', or 'failed' for an optional migration that could not be
+# applied; applied_at is then the time of the last attempt
+SCHEMA_MIGRATIONS_TABLE = [
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version INTEGER PRIMARY KEY, description TEXT NOT NULL, "
+    "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())",
+    "ALTER TABLE schema_migrations ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'applied'",
+    "ALTER TABLE schema_migrations ADD COLUMN IF NOT EXISTS error TEXT",
+]
+
+
+class MigrationError(Exception):
+    """Raised when required migrations are still being applied by another client."""
+
+
+def _index(name, definition, unique=False):
+    return [
+        f"DROP INDEX CONCURRENTLY IF EXISTS {name}",
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {definition}",
+    ]
+
+
+# Statement-level triggers announce the ids of the changed rows as
+# "table:id,id,..." on CHANGES_CHANNEL; past 500 rows the payload is
+# "table:*" to stay under the notification size limit. Writes from any
+# client, including COPY imports and manual SQL, are announced this way.
+NOTIFY_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION library_notify_change() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    ids text;
+BEGIN
+    EXECUTE format(
+        'SELECT CASE WHEN count(*) > 500 THEN ''*'' ELSE string_agg(%I::text, '','') END FROM %I',
+        TG_ARGV[0], CASE WHEN TG_OP = 'DELETE' THEN 'old_rows' ELSE 'new_rows' END
+    ) INTO ids;
+    IF ids IS NOT NULL THEN
+        PERFORM pg_notify('{CHANGES_CHANNEL}', lower(TG_TABLE_NAME) || ':' || ids);
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+# Rollup tables kept current by statement-level triggers on Loans, so reports
+# read a few thousand pre-aggregated rows instead of scanning the loan history:
+# checkouts and returns per day, and loan counts per book and per member.
+# Each changed statement applies its net deltas with one upsert per table, in
+# key order, so concurrent checkouts never lock rollup rows in opposite orders.
+ROLLUP_TABLES = [
+    "CREATE TABLE IF NOT EXISTS loan_daily_stats ("
+    "day DATE PRIMARY KEY, loans INTEGER NOT NULL DEFAULT 0, returns INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS book_loan_stats ("
+    "book_id INTEGER PRIMARY KEY, loans BIGINT NOT NULL DEFAULT 0, on_loan INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS member_loan_stats ("
+    "member_id INTEGER PRIMARY KEY, loans BIGINT NOT NULL DEFAULT 0, on_loan INTEGER NOT NULL DEFAULT 0)",
+    # Top-N reports walk these instead of sorting every book or member
+    "CREATE INDEX IF NOT EXISTS book_loan_stats_loans_idx ON book_loan_stats (loans DESC, book_id)",
+    "CREATE INDEX IF NOT EXISTS member_loan_stats_loans_idx ON member_loan_stats (loans DESC, member_id)",
+]
+
+ROLLUP_FUNCTION = """
+CREATE OR REPLACE FUNCTION library_loan_rollup() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    changes text;
+BEGIN
+    changes := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT book_id, member_id, loan_date, return_date, 1 AS sign FROM new_rows'
+        WHEN 'DELETE' THEN 'SELECT book_id, member_id, loan_date, return_date, -1 AS sign FROM old_rows'
+        ELSE 'SELECT book_id, member_id, loan_date, return_date, 1 AS sign FROM new_rows UNION ALL '
+             'SELECT book_id, member_id, loan_date, return_date, -1 FROM old_rows'
+    END;
+    EXECUTE format(
+        'INSERT INTO loan_daily_stats AS s (day, loans, returns) '
+        'SELECT day, sum(loans), sum(returns) FROM ('
+        ' SELECT loan_date AS day, sign AS loans, 0 AS returns FROM (%1$s) c'
+        ' UNION ALL SELECT return_date, 0, sign FROM (%1$s) c WHERE return_date IS NOT NULL) d '
+        'GROUP BY day HAVING sum(loans) <> 0 OR sum(returns) <> 0 ORDER BY day '
+        'ON CONFLICT (day) DO UPDATE SET loans = s.loans + excluded.loans, returns = s.returns + excluded.returns',
+        changes);
+    EXECUTE format(
+        'INSERT INTO book_loan_stats AS s (book_id, loans, on_loan) '
+        'SELECT book_id, sum(sign), sum(CASE WHEN return_date IS NULL THEN sign ELSE 0 END) FROM (%s) c '
+        'GROUP BY book_id HAVING sum(sign) <> 0 OR sum(CASE WHEN return_date IS NULL THEN sign ELSE 0 END) <> 0 '
+        'ORDER BY book_id '
+        'ON CONFLICT (book_id) DO UPDATE SET loans = s.loans + excluded.loans, on_loan = s.on_loan + excluded.on_loan',
+        changes);
+    EXECUTE format(
+        'INSERT INTO member_loan_stats AS s (member_id, loans, on_loan) '
+        'SELECT member_id, sum(sign), sum(CASE WHEN return_date IS NULL THEN sign ELSE 0 END) FROM (%s) c '
+        'GROUP BY member_id HAVING sum(sign) <> 0 OR sum(CASE WHEN return_date IS NULL THEN sign ELSE 0 END) <> 0 '
+        'ORDER BY member_id '
+        'ON CONFLICT (member_id) DO UPDATE SET loans = s.loans + excluded.loans, on_loan = s.on_loan + excluded.on_loan',
+        changes);
+    RETURN NULL;
+END
+$$
+"""
+
+# Recomputes every rollup from Loans; the lock keeps checkouts from slipping in between
+REBUILD_ROLLUPS_SQL = """
+LOCK TABLE Loans IN SHARE ROW EXCLUSIVE MODE;
+TRUNCATE loan_daily_stats, book_loan_stats, member_loan_stats;
+INSERT INTO loan_daily_stats (day, loans, returns)
+    SELECT day, sum(loans), sum(returns) FROM (
+        SELECT loan_date AS day, count(*) AS loans, 0 AS returns FROM Loans GROUP BY loan_date
+        UNION ALL
+        SELECT return_date, 0, count(*) FROM Loans WHERE return_date IS NOT NULL GROUP BY return_date
+    ) d GROUP BY day;
+INSERT INTO book_loan_stats (book_id, loans, on_loan)
+    SELECT book_id, count(*), count(*) FILTER (WHERE return_date IS NULL) FROM Loans GROUP BY book_id;
+INSERT INTO member_loan_stats (member_id, loans, on_loan)
+    SELECT member_id, count(*), count(*) FILTER (WHERE return_date IS NULL) FROM Loans GROUP BY member_id;
+"""
+
+
+# Copies of each title, each with its own barcode. Every book gets a first
+# copy when it is inserted (by the app, an import or manual SQL), available
+# unless the book row says otherwise; further copies are added by staff.
+# Barcodes of generated copies are the zero-padded copy_id.
+COPIES_TABLE = [
+    "CREATE TABLE IF NOT EXISTS Copies ("
+    "copy_id SERIAL PRIMARY KEY, "
+    "book_id INTEGER NOT NULL REFERENCES Books(book_id) ON DELETE CASCADE, "
+    "barcode VARCHAR(64) NOT NULL UNIQUE, "
+    "is_available BOOLEAN NOT NULL DEFAULT TRUE)",
+    # Serves both picking an available copy of a title and counting its copies
+    "CREATE INDEX IF NOT EXISTS copies_book_id_idx ON Copies (book_id, is_available)",
+    "CREATE OR REPLACE FUNCTION library_barcode(copy_id BIGINT) RETURNS TEXT "
+    "LANGUAGE sql IMMUTABLE AS $$ SELECT lpad(copy_id::text, 10, '0') $$",
+]
+
+FIRST_COPY_FUNCTION = """
+CREATE OR REPLACE FUNCTION library_first_copy() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO Copies (copy_id, book_id, barcode, is_available)
+    SELECT id, book_id, library_barcode(id), is_available FROM (
+        SELECT nextval(pg_get_serial_sequence('copies', 'copy_id')) AS id, book_id,
+               COALESCE(is_available, TRUE) AS is_available
+        FROM (SELECT book_id, is_available FROM new_rows ORDER BY book_id) b
+    ) c;
+    RETURN NULL;
+END
+$$
+"""
+
+# Existing titles get copy_id = book_id, so the open loans can be pointed at their copy directly
+# (a copy that is later removed leaves its past loans without a copy_id). Every step can run
+# again over its own earlier work, so a database upgraded by hand halfway still completes.
+BACKFILL_COPIES_SQL = """
+LOCK TABLE Books, Loans IN SHARE ROW EXCLUSIVE MODE;
+INSERT INTO Copies (copy_id, book_id, barcode, is_available)
+    SELECT book_id, book_id, library_barcode(book_id),
+           NOT EXISTS (SELECT 1 FROM Loans l WHERE l.book_id = Books.book_id AND l.return_date IS NULL)
+    FROM Books
+    WHERE NOT EXISTS (SELECT 1 FROM Copies c WHERE c.book_id = Books.book_id)
+    ORDER BY book_id
+    ON CONFLICT DO NOTHING;
+SELECT setval(pg_get_serial_sequence('copies', 'copy_id'), GREATEST((SELECT max(copy_id) FROM Copies), 1));
+ALTER TABLE Loans ADD COLUMN IF NOT EXISTS copy_id INTEGER;
+ALTER TABLE Loans DROP CONSTRAINT IF EXISTS loans_copy_id_fkey;
+ALTER TABLE Loans ADD CONSTRAINT loans_copy_id_fkey FOREIGN KEY (copy_id) REFERENCES Copies(copy_id)
+    ON DELETE SET NULL NOT VALID;
+UPDATE Loans SET copy_id = book_id
+    WHERE return_date IS NULL AND copy_id IS NULL
+      AND EXISTS (SELECT 1 FROM Copies c WHERE c.copy_id = Loans.book_id AND c.book_id = Loans.book_id);
+DROP TRIGGER IF EXISTS books_first_copy ON Books;
+CREATE TRIGGER books_first_copy AFTER INSERT ON Books REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION library_first_copy()
+"""
+
+
+# Holds (reservations) on titles. Waiting holds form a queue per title in
+# hold_id order; a ready hold has a copy set aside for its member until
+# expires_at. Waiting holds also expire, after a long wait.
+HOLDS_TABLE = [
+    "CREATE TABLE IF NOT EXISTS Holds ("
+    "hold_id SERIAL PRIMARY KEY, "
+    "book_id INTEGER NOT NULL REFERENCES Books(book_id) ON DELETE CASCADE, "
+    "member_id INTEGER NOT NULL REFERENCES Members(member_id) ON DELETE CASCADE, "
+    "status VARCHAR(10) NOT NULL DEFAULT 'waiting' "
+    "CHECK (status IN ('waiting', 'ready', 'fulfilled', 'cancelled', 'expired')), "
+    "copy_id INTEGER REFERENCES Copies(copy_id) ON DELETE SET NULL, "
+    "placed_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+    "expires_at TIMESTAMPTZ NOT NULL, "
+    "closed_at TIMESTAMPTZ)",
+    # A title's queue and its copies set aside; the head of the queue, and a member's position
+    # in it, are read from this index alone. It and the member index below cover closed holds
+    # too, so deleting a book or member finds its holds without scanning Holds.
+    "CREATE INDEX IF NOT EXISTS holds_queue_idx ON Holds (book_id, status, hold_id)",
+    "CREATE INDEX IF NOT EXISTS holds_member_idx ON Holds (member_id, status)",
+    # One open hold per member and title
+    "CREATE UNIQUE INDEX IF NOT EXISTS holds_open_member_idx ON Holds (member_id, book_id) "
+    "WHERE status IN ('waiting', 'ready')",
+    # The expiry job reads only the holds that are due
+    "CREATE INDEX IF NOT EXISTS holds_expiry_idx ON Holds (expires_at) WHERE status IN ('waiting', 'ready')",
+    # Removing a copy finds the holds to unlink without scanning Holds
+    "CREATE INDEX IF NOT EXISTS holds_copy_id_idx ON Holds (copy_id)",
+]
+
+
+def _rollup_triggers():
+    statements = []
+    for event, referencing in (("INSERT", "NEW TABLE AS new_rows"),
+                               ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                               ("DELETE", "OLD TABLE AS old_rows")):
+        name = f"loans_rollup_{event.lower()}"
+        statements += [
+            f"DROP TRIGGER IF EXISTS {name} ON Loans",
+            f"CREATE TRIGGER {name} AFTER {event} ON Loans REFERENCING {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION library_loan_rollup()",
+        ]
+    return statements
+
+
+def _notify_triggers(table, id_column):
+    statements = []
+    for event, transition in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        name = f"{table.lower()}_notify_{event.lower()}"
+        statements += [
+            f"DROP TRIGGER IF EXISTS {name} ON {table}",
+            f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+            f"REFERENCING {transition} TABLE AS {transition.lower()}_rows "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION library_notify_change('{id_column}')",
+        ]
+    return statements
+
+
+MIGRATIONS = [
+    Migration(1, "index active loans by book", _index(
+        "loans_active_book_idx", "Loans (book_id) WHERE return_date IS NULL"
+    ), optional=True),
+    Migration(2, "index loan foreign keys", _index(
+        "loans_book_id_idx", "Loans (book_id)"
+    ) + _index(
+        "loans_member_id_idx", "Loans (member_id)"
+    ), optional=True),
+    # Fails while duplicate ISBNs exist; retried once they are cleaned up (see MIGRATION_RETRY_HOURS)
+    Migration(3, "unique ISBN", _index(
+        "books_isbn_key", "Books (isbn)", unique=True
+    ), optional=True),
+    Migration(4, "trigram search indexes", ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + _index(
+        "books_title_trgm_idx", "Books USING gin (title gin_trgm_ops)"
+    ) + _index(
+        "books_author_trgm_idx", "Books USING gin (author gin_trgm_ops)"
+    ) + _index(
+        "books_isbn_trgm_idx", "Books USING gin (isbn gin_trgm_ops)"
+    ) + _index(
+        "members_name_trgm_idx", "Members USING gin (name gin_trgm_ops)"
+    ) + _index(
+        "members_email_trgm_idx", "Members USING gin (email gin_trgm_ops)"
+    ), optional=True),
+    # Pages of the loans tab's default active-only view, without walking the return history
+    Migration(5, "index active loans by id", _index(
+        "loans_active_idx", "Loans (loan_id) WHERE return_date IS NULL"
+    ), optional=True),
+    Migration(6, "change notification triggers", [NOTIFY_FUNCTION]
+              + _notify_triggers("Books", "book_id")
+              + _notify_triggers("Members", "member_id")
+              + _notify_triggers("Loans", "loan_id")),
+    # Queued offline checkouts/returns already applied, so a sync interrupted after its commit is not replayed
+    Migration(7, "offline sync log", [
+        "CREATE TABLE IF NOT EXISTS offline_sync ("
+        "replica_id TEXT NOT NULL, seq BIGINT NOT NULL, "
+        "synced_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (replica_id, seq))"
+    ]),
+    # Backfilled and hooked up in one transaction, so no loan is counted twice or missed
+    Migration(8, "circulation rollups", ROLLUP_TABLES + [ROLLUP_FUNCTION, ";\n".join(
+        [REBUILD_ROLLUPS_SQL.strip().rstrip(";")] + _rollup_triggers()
+    )]),
+    # Overdue report: the oldest open loans first, without sorting every active loan
+    Migration(9, "index active loans by date", _index(
+        "loans_active_date_idx", "Loans (loan_date, loan_id) WHERE return_date IS NULL"
+    ), optional=True),
+    # Copies are backfilled, the foreign key checked and the trigger created in one transaction
+    # (see migrate), so no new book is left without a copy and an interrupted run leaves nothing behind
+    Migration(10, "book copies", COPIES_TABLE + [FIRST_COPY_FUNCTION, BACKFILL_COPIES_SQL.strip(),
+                                                 "ALTER TABLE Loans VALIDATE CONSTRAINT loans_copy_id_fkey"]),
+    # Returns by barcode find the copy's open loan directly, and removing a copy (or a book with its
+    # copies) finds the loans to unlink without scanning Loans; a partial index could not serve the latter
+    Migration(11, "index loans by copy", _index("loans_copy_id_idx", "Loans (copy_id)"), optional=True),
+    Migration(12, "holds", HOLDS_TABLE),
+]
+
+
+def _drop_leftover_indexes(cursor, migration):
+    # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    for statement in migration.statements:
+        if statement.startswith("DROP INDEX"):
+            cursor.execute(statement)
+
+
+def _recorded(cursor):
+    """Returns {version: (status, tried_recently)} for every recorded migration."""
+    cursor.execute("SELECT version, status, applied_at > now() - make_interval(hours => %s) FROM schema_migrations",
+                   (MIGRATION_RETRY_HOURS,))
+    return {version: (status, recent) for version, status, recent in cursor.fetchall()}
+
+
+def _record(cursor, migration, status, error=None):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, description, status, error) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (version) DO UPDATE SET status = EXCLUDED.status, error = EXCLUDED.error, applied_at = now()",
+        (migration.version, migration.description, status, error)
+    )
+
+
+def _lock(cursor, migrations):
+    """Takes the migration lock; returns False when another client holds it and only optional work is left."""
+    deadline = time.monotonic() + MIGRATION_LOCK_WAIT
+    while True:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if cursor.fetchone()[0]:
+            return True
+        try:
+            applied = {version for version, (status, _) in _recorded(cursor).items() if status == "applied"}
+        except psycopg2.ProgrammingError:  # schema_migrations not created yet
+            applied = set()
+        if all(migration.optional or migration.version in applied for migration in migrations):
+            logging.info("Another client is applying optional migrations; starting without waiting for it.")
+            return False
+        if time.monotonic() > deadline:
+            raise MigrationError("another client is still upgrading the database; please try again shortly.")
+        time.sleep(MIGRATION_LOCK_POLL)
+
+
+def _apply(cursor, migration):
+    """Runs one migration and records it, in a single transaction unless it builds indexes concurrently."""
+    concurrent = any("CONCURRENTLY" in statement for statement in migration.statements)
+    if not concurrent:
+        cursor.execute("BEGIN")
+    try:
+        for statement in migration.statements:
+            cursor.execute(statement)
+        _record(cursor, migration, "applied")
+    except BaseException:
+        if not concurrent and not cursor.connection.closed:
+            cursor.execute("ROLLBACK")
+        raise
+    if not concurrent:
+        cursor.execute("COMMIT")
+
+
+def migrate(db, migrations=MIGRATIONS, retry_failed=False):
+    """Applies every migration not yet recorded; returns the versions applied now.
+
+    Optional migrations that failed within MIGRATION_RETRY_HOURS are skipped
+    unless retry_failed is set.
+    """
+    applied_now = []
+    with db.autocommit_cursor() as cursor:
+        if not _lock(cursor, migrations):
+            return applied_now
+        try:
+            for statement in SCHEMA_MIGRATIONS_TABLE:
+                cursor.execute(statement)
+            recorded = _recorded(cursor)
+            for migration in migrations:
+                status, recent = recorded.get(migration.version, (None, False))
+                if status == "applied" or (status == "failed" and recent and not retry_failed):
+                    continue
+                logging.info("Applying migration %s: %s.", migration.version, migration.description)
+                try:
+                    _apply(cursor, migration)
+                except psycopg2.Error as e:
+                    if not migration.optional:
+                        raise
+                    _drop_leftover_indexes(cursor, migration)
+                    _record(cursor, migration, "failed", str(e).strip())
+                    logging.warning("Optional migration %s (%s) not applied, will retry in %s hours: %s",
+                                    migration.version, migration.description, MIGRATION_RETRY_HOURS, e)
+                    continue
+                applied_now.append(migration.version)
+        finally:
+            if not cursor.connection.closed:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    return applied_now
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations and exit.")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="also retry optional migrations that failed recently")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    database = Database()
+    try:
+        print(f"Applied migrations: {migrate(database, retry_failed=args.retry_failed) or 'none'}")
+    finally:
+        database.close()
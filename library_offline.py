@@ -0,0 +1,678 @@
+"""Local SQLite replica that keeps a desk working while PostgreSQL is unreachable.
+
+LocalReplica mirrors the catalogue, the members and the open loans into a
+SQLite file next to the application. While the database is up, a
+background thread keeps it current from the same change notifications that
+update the tables on screen. FailoverService stands in for LibraryService.
+It passes every call to the online service, and answers from the replica
+when the database cannot be reached: at startup, or when a connection
+drops mid-session.
+
+While offline, checkouts and returns are checked against the replica and
+written to a durable queue in the same SQLite transaction. Once PostgreSQL
+is back, the queue is replayed in order, in batches of SYNC_BATCH_SIZE per
+transaction, keeping the original dates. An operation the database refuses
+is recorded as a conflict; for example, a book that another desk loaned
+out during the outage. Every replayed operation is logged in the
+offline_sync table, so a sync interrupted after its commit never applies
+an operation twice.
+
+The replica tracks loans per title, not per copy: offline, a title with an
+open loan counts as out, and scanning barcodes or managing copies waits
+for the database. So do holds; a copy set aside for one is not known to the
+replica, and an offline loan of it comes back from the sync as a conflict.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from functools import partial
+
+import psycopg2
+from psycopg2.extensions import QueryCanceledError, TransactionRollbackError
+
+from library_db import CirculationError, CommitUnknownError, db_loan_book, db_return_book
+from library_reports import REPORT_LIMIT
+from library_service import (ValidationError, _page, _require_id, _validate_ids, db_fetch_books_by_id,
+                             db_fetch_books_page, db_fetch_loans_by_id, db_fetch_loans_page,
+                             db_fetch_members_by_id, db_fetch_members_page, like_pattern, validate_book_ids,
+                             HOLD_QUEUE_LIMIT, PAGE_SIZE)
+
+# SQLite file holding the replica and the queue of offline checkouts/returns
+REPLICA_PATH = os.environ.get("LIBRARY_REPLICA_PATH", "library_replica.sqlite3")
+
+# Queued operations replayed per PostgreSQL transaction
+SYNC_BATCH_SIZE = 100
+
+# Rows copied per query when the replica is refreshed in full
+REPLICA_PAGE_SIZE = 10000
+
+# Concurrent calls allowed while offline; SQLite serialises them anyway
+OFFLINE_CONCURRENCY = 2
+
+# Loans made offline are shown as loan PROVISIONAL_LOAN_IDS + queue seq until synced. Loans.loan_id
+# is a SERIAL (int4), so no real loan can take one, and they sort after every real loan as they will
+# once replayed.
+PROVISIONAL_LOAN_IDS = 2 ** 31
+
+REPLICA_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS books (book_id INTEGER PRIMARY KEY, title TEXT, author TEXT, isbn TEXT)",
+    "CREATE TABLE IF NOT EXISTS members (member_id INTEGER PRIMARY KEY, name TEXT, email TEXT)",
+    # Open loans only; pending_seq marks a loan made offline that is still in the queue
+    "CREATE TABLE IF NOT EXISTS loans (loan_id INTEGER PRIMARY KEY, book_id INTEGER, member_id INTEGER, "
+    "loan_date TEXT, return_date TEXT, title TEXT, member_name TEXT, pending_seq INTEGER)",
+    "CREATE INDEX IF NOT EXISTS loans_book_idx ON loans (book_id)",
+    "CREATE TABLE IF NOT EXISTS sync_queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, "
+    "book_id INTEGER NOT NULL, member_id INTEGER, op_date TEXT NOT NULL, queued_at TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS conflicts (seq INTEGER PRIMARY KEY, op TEXT NOT NULL, book_id INTEGER NOT NULL, "
+    "member_id INTEGER, op_date TEXT NOT NULL, reason TEXT NOT NULL, detected_at TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+]
+
+TABLE_KEYS = {"books": "book_id", "members": "member_id", "loans": "loan_id"}
+TABLE_COLUMNS = {"books": 4, "members": 3, "loans": 7}
+
+
+class OfflineError(ValidationError):
+    """Raised for operations that need the database while it is unreachable."""
+
+
+def is_connection_error(e):
+    """Tells a lost or refused connection apart from errors in the request itself.
+
+    Only failures before COMMIT count: nothing was saved, so the call can be
+    answered offline. A connection lost during COMMIT (CommitUnknownError) is
+    not one of them, as the write may have been saved and queueing it again
+    would apply it twice.
+
+    An exhausted pool (PoolError) is not one either: the database is there,
+    only busy. A closed pool is reported by Database as InterfaceError.
+    """
+    if isinstance(e, (QueryCanceledError, TransactionRollbackError)):
+        return False
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _loan_row(row):
+    loan_id, book_id, member_id, loan_date, return_date, title, member_name = row[:7]
+    return (loan_id, book_id, member_id, date.fromisoformat(loan_date),
+            date.fromisoformat(return_date) if return_date else None, title, member_name)
+
+
+def _stored_loan(loan):
+    return (loan[0], loan[1], loan[2], loan[3].isoformat(), None, loan[5], loan[6])
+
+
+def _upsert_sql(table):
+    # Mirrored loans leave pending_seq empty
+    placeholders = ", ".join("?" * TABLE_COLUMNS[table]) + (", NULL" if table == "loans" else "")
+    return f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})"
+
+
+class LocalReplica:
+    """Thread-safe SQLite copy of books, members and open loans, plus the offline queue."""
+
+    def __init__(self, path=REPLICA_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        # FULL makes every queued checkout durable as soon as it is acknowledged
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        for statement in REPLICA_SCHEMA:
+            self._conn.execute(statement)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'replica_id'").fetchone()
+        if row is None:
+            row = (uuid.uuid4().hex,)
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('replica_id', ?)", row)
+        self.replica_id = row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def has_data(self):
+        return bool(self._query("SELECT EXISTS (SELECT 1 FROM books) OR EXISTS (SELECT 1 FROM members)")[0][0])
+
+    def last_refresh(self):
+        row = self._query("SELECT value FROM meta WHERE key = 'last_refresh'")
+        return row[0][0] if row else None
+
+    # --- Mirroring ---
+    def replace_table(self, table, pages):
+        """Replaces a table with the rows from an iterable of pages, in one transaction."""
+        with self._transaction() as conn:
+            # Loans made offline stay until the queue has been replayed
+            conn.execute(f"DELETE FROM {table}" + (" WHERE pending_seq IS NULL" if table == "loans" else ""))
+            for rows in pages:
+                conn.executemany(_upsert_sql(table), (_stored_loan(row) if table == "loans" else row
+                                                      for row in rows))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_refresh', ?)", (_now(),))
+
+    def apply_rows(self, table, ids, rows):
+        """Brings the given ids up to date: rows found are stored, the others deleted.
+
+        For loans only open ones are kept, so a returned loan is deleted too.
+        """
+        key = TABLE_KEYS[table]
+        if table == "loans":
+            rows = [_stored_loan(row) for row in rows if row[4] is None]
+        with self._transaction() as conn:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", ((row_id,) for row_id in ids))
+            conn.executemany(_upsert_sql(table), rows)
+
+    # --- Reads ---
+    def _search(self, table, columns, after_id, limit, term):
+        key = TABLE_KEYS[table]
+        sql = f"SELECT {', '.join(columns)} FROM {table} WHERE {key} > ?"
+        params = [after_id]
+        if term:
+            matches = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns[1:])
+            sql += f" AND ({matches} OR {key} = ?)"
+            params += [like_pattern(term)] * (len(columns) - 1) + [int(term) if term.isdigit() else None]
+        return self._query(sql + f" ORDER BY {key} LIMIT ?", params + [limit])
+
+    def _by_id(self, table, columns, ids):
+        key = TABLE_KEYS[table]
+        return self._query(f"SELECT {', '.join(columns)} FROM {table} WHERE {key} IN "
+                           f"({', '.join('?' * len(ids))}) ORDER BY {key}", list(ids))
+
+    def list_books(self, after_id, limit, term=""):
+        return self._search("books", ("book_id", "title", "author", "isbn"), after_id, limit, term)
+
+    def get_books(self, book_ids):
+        return self._by_id("books", ("book_id", "title", "author", "isbn"), book_ids)
+
+    def list_members(self, after_id, limit, term=""):
+        return self._search("members", ("member_id", "name", "email"), after_id, limit, term)
+
+    def get_members(self, member_ids):
+        return self._by_id("members", ("member_id", "name", "email"), member_ids)
+
+    def list_loans(self, after_id, limit):
+        return [_loan_row(row) for row in self._query(
+            "SELECT * FROM loans WHERE loan_id > ? ORDER BY loan_id LIMIT ?", (after_id, limit))]
+
+    def get_loans(self, loan_ids):
+        return [_loan_row(row) for row in self._by_id("loans", ("*",), loan_ids)]
+
+    # --- Offline circulation ---
+    def _enqueue(self, conn, op, book_id, member_id, today):
+        return conn.execute(
+            "INSERT INTO sync_queue (op, book_id, member_id, op_date, queued_at) VALUES (?, ?, ?, ?, ?)",
+            (op, book_id, member_id, today.isoformat(), _now())
+        ).lastrowid
+
+    def loan_book(self, book_id, member_id, today):
+        """Queues a checkout if the replica shows it is possible; returns the provisional loan row."""
+        with self._transaction() as conn:
+            book = conn.execute("SELECT title FROM books WHERE book_id = ?", (book_id,)).fetchone()
+            if book is None:
+                raise CirculationError("This book doesn't exist.")
+            member = conn.execute("SELECT name FROM members WHERE member_id = ?", (member_id,)).fetchone()
+            if member is None:
+                raise CirculationError("This member doesn't exist.")
+            if conn.execute("SELECT 1 FROM loans WHERE book_id = ?", (book_id,)).fetchone():
+                raise CirculationError("This book is currently on loan.")
+            seq = self._enqueue(conn, "loan", book_id, member_id, today)
+            # Shown until the sync replaces it with the real loan
+            loan = (PROVISIONAL_LOAN_IDS + seq, book_id, member_id, today, None, book[0], member[0])
+            conn.execute("INSERT INTO loans VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _stored_loan(loan) + (seq,))
+        return loan
+
+    def return_book(self, book_id, today):
+        """Queues a return of the book's oldest open loan; returns the closed loan row in a list.
+
+        The database closes one open loan per return, the one with the lowest
+        id, so the replica closes the same one.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM loans WHERE book_id = ? ORDER BY loan_id LIMIT 1",
+                               (book_id,)).fetchone()
+            if row is None:
+                raise CirculationError(" This book didn't got loaned or has been returned.")
+            self._enqueue(conn, "return", book_id, None, today)
+            conn.execute("DELETE FROM loans WHERE loan_id = ?", (row[0],))
+        loan = _loan_row(row)
+        return [loan[:4] + (today,) + loan[5:]]
+
+    # --- Queue ---
+    def pending(self, limit=SYNC_BATCH_SIZE):
+        """Returns the oldest queued operations as (seq, op, book_id, member_id, op_date)."""
+        return [(seq, op, book_id, member_id, date.fromisoformat(op_date)) for seq, op, book_id, member_id, op_date
+                in self._query("SELECT seq, op, book_id, member_id, op_date FROM sync_queue ORDER BY seq LIMIT ?",
+                               (limit,))]
+
+    def pending_count(self):
+        return self._query("SELECT count(*) FROM sync_queue")[0][0]
+
+    def finish(self, results):
+        """Removes replayed operations from the queue and records the conflicts among them.
+
+        results holds (seq, loans, reason) per operation: the loan rows the
+        database returned, or the reason it refused the operation.
+        """
+        with self._transaction() as conn:
+            for seq, loans, reason in results:
+                if reason is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO conflicts SELECT seq, op, book_id, member_id, op_date, ?, ? "
+                        "FROM sync_queue WHERE seq = ?", (reason, _now(), seq)
+                    )
+                conn.execute("DELETE FROM sync_queue WHERE seq = ?", (seq,))
+                conn.execute("DELETE FROM loans WHERE pending_seq = ?", (seq,))
+                for loan in loans or []:
+                    conn.execute("DELETE FROM loans WHERE loan_id = ?", (loan[0],))
+                    if loan[4] is None:
+                        conn.execute(_upsert_sql("loans"), _stored_loan(loan))
+
+    def conflicts(self):
+        return self._query("SELECT seq, op, book_id, member_id, op_date, reason, detected_at FROM conflicts "
+                           "ORDER BY seq")
+
+
+def db_replay_queued(cursor, replica_id, operations):
+    """Replays queued offline operations in order; returns (seq, loans, reason) for each.
+
+    Each operation runs under a savepoint, so one the database refuses
+    (reason is set) does not undo the others. Operations this replica
+    already replayed in an earlier, interrupted sync are skipped.
+    """
+    results = []
+    for seq, op, book_id, member_id, op_date in operations:
+        cursor.execute("INSERT INTO offline_sync (replica_id, seq) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                       (replica_id, seq))
+        if cursor.rowcount == 0:
+            results.append((seq, None, None))
+            continue
+        cursor.execute("SAVEPOINT queued_op")
+        try:
+            if op == "loan":
+                loans = [db_loan_book(cursor, book_id, member_id, op_date)]
+            else:
+                loans = db_return_book(cursor, book_id, op_date)
+        except (CirculationError, psycopg2.IntegrityError, psycopg2.DataError) as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT queued_op")
+            results.append((seq, None, str(e).strip()))
+            continue
+        cursor.execute("RELEASE SAVEPOINT queued_op")
+        results.append((seq, loans, None))
+    return results
+
+
+class ReplicaUpdater(threading.Thread):
+    """Applies change notifications to the replica off the listener thread.
+
+    queue_change(service, table, ids) asks for the given rows to be fetched
+    again. ids of None (and table of None) ask for a full copy of that table
+    (or of every table).
+    """
+
+    def __init__(self, replica):
+        super().__init__(name="library-replica-updater", daemon=True)
+        self._replica = replica
+        self._queue = queue.SimpleQueue()
+
+    def queue_change(self, service, table, ids):
+        self._queue.put((service, table, ids))
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            service, table, ids = item
+            try:
+                self._update(service.db, table, ids)
+            except Exception as e:
+                # The next full refresh, on the next reconnect, catches up
+                logging.warning("Replica update for %s failed: %s", table or "all tables", e)
+
+    def _update(self, db, table, ids):
+        fetch_page = {"books": db_fetch_books_page, "members": db_fetch_members_page,
+                      "loans": lambda cursor, after_id, limit: db_fetch_loans_page(cursor, after_id, limit, True)}
+        fetch_ids = {"books": db_fetch_books_by_id, "members": db_fetch_members_by_id, "loans": db_fetch_loans_by_id}
+        for name in ([table] if table else list(fetch_page)):
+            if name not in fetch_page:
+                continue
+            if ids is None:
+                self._replica.replace_table(name, self._pages(db, fetch_page[name]))
+                logging.info("Replica of %s refreshed.", name)
+            elif ids:
+                self._replica.apply_rows(name, ids, db.run(fetch_ids[name], ids))
+
+    @staticmethod
+    def _pages(db, job):
+        after_id = 0
+        while True:
+            rows = db.run(job, after_id, REPLICA_PAGE_SIZE)
+            if rows:
+                yield rows
+            if len(rows) < REPLICA_PAGE_SIZE:
+                return
+            after_id = rows[-1][0]
+
+
+class FailoverService:
+    """LibraryService stand-in that falls back to a LocalReplica when PostgreSQL is down.
+
+    open_online() opens the real service (normally library_service.open_service).
+    Reads, checkouts and returns keep working offline. Adding, editing and
+    removing books or members raises OfflineError until reconnect()
+    succeeds.
+    """
+
+    def __init__(self, open_online, replica):
+        self._open_online = open_online
+        self.replica = replica
+        self.online = None
+        self._handlers = []
+        self._unreported_conflicts = []
+        self._lock = threading.Lock()
+        self._updater = ReplicaUpdater(replica)
+        self._updater.start()
+
+    @property
+    def db(self):
+        online = self.online
+        return online.db if online else None
+
+    @property
+    def max_concurrency(self):
+        online = self.online
+        # One pooled connection is kept back for the replica updater
+        return max(1, online.max_concurrency - 1) if online else OFFLINE_CONCURRENCY
+
+    def status(self):
+        """Returns (online, queued operations, conflicts found since the last call).
+
+        May wait for a replica refresh to finish, so call it off the GUI thread.
+        """
+        with self._lock:
+            conflicts, self._unreported_conflicts = self._unreported_conflicts, []
+        return self.online is not None, self.replica.pending_count(), conflicts
+
+    def connect(self):
+        """Goes online, or starts offline if the database is unreachable but the replica has data."""
+        try:
+            return self._go_online()
+        except Exception as e:
+            if not is_connection_error(e) or not self.replica.has_data():
+                raise
+            logging.warning("Database unreachable, working offline from the local replica (copied %s): %s",
+                            self.replica.last_refresh(), e)
+            return None
+
+    def reconnect(self):
+        """Tries to go back online; returns None while the database is still unreachable.
+
+        Once connected, the offline queue is replayed first, and
+        (applied, conflicts) is returned.
+        """
+        if self.online is not None:
+            return None
+        try:
+            return self._go_online()
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            logging.info("Database still unreachable: %s", e)
+            return None
+
+    def _go_online(self):
+        service = self._open_online()
+        try:
+            result = self.sync(service)
+        except Exception:
+            service.close()
+            raise
+        service.add_change_handler(partial(self._updater.queue_change, service))
+        for handler in self._handlers:
+            service.add_change_handler(handler)
+        # A full copy catches up on everything that changed while offline
+        self._updater.queue_change(service, None, None)
+        with self._lock:
+            self.online = service
+        logging.info("Library database online; %s queued operations applied, %s conflicts.",
+                     result[0], len(result[1]))
+        return result
+
+    def _go_offline(self, service, error):
+        with self._lock:
+            if self.online is not service:
+                return
+            self.online = None
+        logging.warning("Lost the library database, working offline from the local replica: %s", error)
+        try:
+            service.close()
+        except Exception as e:
+            logging.warning("Error closing the lost connection pool: %s", e)
+
+    def sync(self, service):
+        """Replays the offline queue through service in batches; returns (applied, conflicts).
+
+        conflicts lists (op, book_id, member_id, op_date, reason) for every
+        operation the database refused.
+        """
+        applied, conflicts = 0, []
+        while True:
+            batch = self.replica.pending(SYNC_BATCH_SIZE)
+            if not batch:
+                return applied, conflicts
+            try:
+                results = service.db.run(db_replay_queued, self.replica.replica_id, batch)
+            except CommitUnknownError as e:
+                # offline_sync records every operation applied, so replaying the batch on the next attempt is safe
+                raise psycopg2.OperationalError(str(e)) from e
+            self.replica.finish(results)
+            by_seq = {operation[0]: operation for operation in batch}
+            for seq, loans, reason in results:
+                if reason is None:
+                    applied += 1
+                    continue
+                conflict = by_seq[seq][1:] + (reason,)
+                conflicts.append(conflict)
+                with self._lock:
+                    self._unreported_conflicts.append(conflict)
+                logging.warning("Offline %s of book %s conflicts: %s", conflict[0], conflict[1], reason)
+
+    def close(self):
+        self._updater.stop()
+        with self._lock:
+            online, self.online = self.online, None
+        if online:
+            online.close()
+        self.replica.close()
+
+    def add_change_handler(self, handler):
+        """Registers handler with the online service, now and after every reconnect."""
+        self._handlers.append(handler)
+        online = self.online
+        if online:
+            online.add_change_handler(handler)
+
+    def cache_stats(self):
+        online = self.online
+        return online.cache_stats() if online else {}
+
+    def _call(self, name, offline, *args, on_connection=None):
+        """Calls the online service's method, or offline(*args) while the database is unreachable."""
+        online = self.online
+        if online is not None:
+            try:
+                return getattr(online, name)(*args, on_connection=on_connection)
+            except Exception as e:
+                if not is_connection_error(e):
+                    raise
+                self._go_offline(online, e)
+        if offline is None:
+            raise OfflineError("the library database is unreachable; this will work again once it is back.")
+        return offline(*args)
+
+    # --- Books ---
+    def list_books(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        def offline(after_id, limit, term):
+            return self.replica.list_books(*_page(after_id, limit), (term or "").strip())
+        return self._call("list_books", offline, after_id, limit, term, on_connection=on_connection)
+
+    def get_book(self, book_id, on_connection=None):
+        def offline(book_id):
+            rows = self.replica.get_books([_require_id(book_id, "please insert the book id.")])
+            return rows[0] if rows else None
+        return self._call("get_book", offline, book_id, on_connection=on_connection)
+
+    def get_books(self, book_ids, on_connection=None):
+        return self._call("get_books", lambda ids: self.replica.get_books(validate_book_ids(ids)),
+                          book_ids, on_connection=on_connection)
+
+    def add_book(self, title, author, isbn=None, on_connection=None):
+        return self._call("add_book", None, title, author, isbn, on_connection=on_connection)
+
+    def update_book(self, book_id, title, author, isbn=None, on_connection=None):
+        return self._call("update_book", None, book_id, title, author, isbn, on_connection=on_connection)
+
+    def delete_book(self, book_id, on_connection=None):
+        return self._call("delete_book", None, book_id, on_connection=on_connection)
+
+    # --- Members ---
+    def list_members(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        def offline(after_id, limit, term):
+            return self.replica.list_members(*_page(after_id, limit), (term or "").strip())
+        return self._call("list_members", offline, after_id, limit, term, on_connection=on_connection)
+
+    def get_member(self, member_id, on_connection=None):
+        def offline(member_id):
+            rows = self.replica.get_members([_require_id(member_id, "please insert the members id.")])
+            return rows[0] if rows else None
+        return self._call("get_member", offline, member_id, on_connection=on_connection)
+
+    def get_members(self, member_ids, on_connection=None):
+        return self._call("get_members", lambda ids: self.replica.get_members(_validate_ids(ids)),
+                          member_ids, on_connection=on_connection)
+
+    def add_member(self, name, email=None, on_connection=None):
+        return self._call("add_member", None, name, email, on_connection=on_connection)
+
+    def update_member(self, member_id, name, email=None, on_connection=None):
+        return self._call("update_member", None, member_id, name, email, on_connection=on_connection)
+
+    def delete_member(self, member_id, on_connection=None):
+        return self._call("delete_member", None, member_id, on_connection=on_connection)
+
+    # --- Loans ---
+    def list_loans(self, after_id=0, limit=PAGE_SIZE, active_only=True, on_connection=None):
+        """Offline, only open loans are known, so the history shows those too."""
+        def offline(after_id, limit, active_only):
+            return self.replica.list_loans(*_page(after_id, limit))
+        return self._call("list_loans", offline, after_id, limit, active_only, on_connection=on_connection)
+
+    def get_loans(self, loan_ids, on_connection=None):
+        return self._call("get_loans", lambda ids: self.replica.get_loans(_validate_ids(ids)),
+                          loan_ids, on_connection=on_connection)
+
+    def loan_book(self, book_id, member_id, on_connection=None):
+        def offline(book_id, member_id):
+            book_id = _require_id(book_id, "please insert the book and the members id.")
+            member_id = _require_id(member_id, "please insert the book and the members id.")
+            return self.replica.loan_book(book_id, member_id, date.today())
+        return self._call("loan_book", offline, book_id, member_id, on_connection=on_connection)
+
+    def return_book(self, book_id, on_connection=None):
+        def offline(book_id):
+            return self.replica.return_book(_require_id(book_id, "please insert the book id."), date.today())
+        return self._call("return_book", offline, book_id, on_connection=on_connection)
+
+    def loan_books(self, book_ids, member_id, on_connection=None):
+        def offline(book_ids, member_id):
+            member_id = _require_id(member_id, "please insert the book and the members id.")
+            if not self.replica.get_members([member_id]):
+                raise CirculationError("This member doesn't exist.")
+            loans, refused = [], []
+            for book_id in validate_book_ids(book_ids):
+                try:
+                    loans.append(self.replica.loan_book(book_id, member_id, date.today()))
+                except CirculationError:
+                    refused.append(book_id)
+            return loans, sorted(refused)
+        return self._call("loan_books", offline, book_ids, member_id, on_connection=on_connection)
+
+    def return_books(self, book_ids, on_connection=None):
+        def offline(book_ids):
+            loans, not_on_loan = [], []
+            for book_id in validate_book_ids(book_ids):
+                try:
+                    loans += self.replica.return_book(book_id, date.today())
+                except CirculationError:
+                    not_on_loan.append(book_id)
+            return loans, sorted(not_on_loan)
+        return self._call("return_books", offline, book_ids, on_connection=on_connection)
+
+    def checkout_copies(self, barcodes, member_id, on_connection=None):
+        return self._call("checkout_copies", None, barcodes, member_id, on_connection=on_connection)
+
+    def return_copies(self, barcodes, on_connection=None):
+        return self._call("return_copies", None, barcodes, on_connection=on_connection)
+
+    # --- Copies ---
+    def get_copies(self, book_id, on_connection=None):
+        return self._call("get_copies", None, book_id, on_connection=on_connection)
+
+    def availability(self, book_ids, on_connection=None):
+        return self._call("availability", None, book_ids, on_connection=on_connection)
+
+    def add_copy(self, book_id, barcode=None, on_connection=None):
+        return self._call("add_copy", None, book_id, barcode, on_connection=on_connection)
+
+    def delete_copy(self, copy_id, on_connection=None):
+        return self._call("delete_copy", None, copy_id, on_connection=on_connection)
+
+    # --- Holds ---
+    def place_hold(self, book_id, member_id, on_connection=None):
+        return self._call("place_hold", None, book_id, member_id, on_connection=on_connection)
+
+    def get_hold(self, hold_id, on_connection=None):
+        return self._call("get_hold", None, hold_id, on_connection=on_connection)
+
+    def cancel_hold(self, hold_id, on_connection=None):
+        return self._call("cancel_hold", None, hold_id, on_connection=on_connection)
+
+    def member_holds(self, member_id, on_connection=None):
+        return self._call("member_holds", None, member_id, on_connection=on_connection)
+
+    def book_holds(self, book_id, limit=HOLD_QUEUE_LIMIT, on_connection=None):
+        return self._call("book_holds", None, book_id, limit, on_connection=on_connection)
+
+    # --- Reports ---
+    def report(self, name, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        """The replica holds no loan history, so reports wait for the database."""
+        return self._call("report", None, name, limit, start, end, on_connection=on_connection)
+
+    def export_report(self, name, file, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        return self._call("export_report", None, name, file, limit, start, end, on_connection=on_connection)
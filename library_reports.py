@@ -0,0 +1,135 @@
+"""Circulation reports served from rollup tables instead of scans of Loans.
+
+Migration 8 adds loan_daily_stats (checkouts and returns per day) and
+book_loan_stats/member_loan_stats (loans per book and per member, and
+how many are still out). Triggers on Loans keep them current in the same
+transaction as each checkout, return, import or manual edit, so a report
+reads a few thousand pre-aggregated rows however long the loan history
+grows. The overdue report reads open loans only, in loan date order.
+
+Results come back as row tuples, the same as every other service call.
+to_columns turns them into one list per column, the layout dashboards and
+pandas.DataFrame take directly, and to_arrays into NumPy arrays (needs
+numpy). db_copy_report streams a report as CSV straight from PostgreSQL.
+
+    python library_reports.py monthly --start 2020-01-01    # print a report as CSV
+    python library_reports.py --rebuild                     # recompute the rollups from Loans
+"""
+import argparse
+import logging
+import sys
+from collections import namedtuple
+from datetime import date
+
+from library_db import LOAN_PERIOD_DAYS, Database
+from library_migrations import REBUILD_ROLLUPS_SQL
+
+# Rows in a top-N or overdue report when the caller does not ask for a number, and the most allowed
+REPORT_LIMIT = 50
+MAX_REPORT_LIMIT = 1000
+
+# Report columns holding dates, which the API sends as ISO strings
+DATE_COLUMNS = {"loan_date", "day", "month"}
+
+# ranged reports take start/end dates (end exclusive); the others take limit.
+# The SQL gets %(limit)s, %(start)s, %(end)s and %(loan_period)s.
+Report = namedtuple("Report", "name title columns ranged sql")
+
+REPORTS = {report.name: report for report in [
+    Report("overdue", "Overdue loans",
+           ("loan_id", "book_id", "title", "member_id", "member_name", "loan_date", "days_overdue"), False,
+           "SELECT l.loan_id, l.book_id, b.title, l.member_id, m.name AS member_name, l.loan_date, "
+           "CURRENT_DATE - l.loan_date - %(loan_period)s AS days_overdue "
+           "FROM Loans l LEFT JOIN Books b ON b.book_id = l.book_id "
+           "LEFT JOIN Members m ON m.member_id = l.member_id "
+           "WHERE l.return_date IS NULL AND l.loan_date < CURRENT_DATE - %(loan_period)s "
+           "ORDER BY l.loan_date, l.loan_id LIMIT %(limit)s"),
+    Report("top_books", "Most borrowed titles (all time)",
+           ("book_id", "title", "author", "loans", "on_loan"), False,
+           "SELECT s.book_id, b.title, b.author, s.loans, s.on_loan "
+           "FROM book_loan_stats s JOIN Books b ON b.book_id = s.book_id "
+           "WHERE s.loans > 0 ORDER BY s.loans DESC, s.book_id LIMIT %(limit)s"),
+    Report("top_members", "Loans per member (all time)",
+           ("member_id", "name", "email", "loans", "on_loan"), False,
+           "SELECT s.member_id, m.name, m.email, s.loans, s.on_loan "
+           "FROM member_loan_stats s JOIN Members m ON m.member_id = s.member_id "
+           "WHERE s.loans > 0 ORDER BY s.loans DESC, s.member_id LIMIT %(limit)s"),
+    Report("monthly", "Monthly circulation",
+           ("month", "loans", "returns"), True,
+           "SELECT date_trunc('month', day)::date AS month, sum(loans) AS loans, sum(returns) AS returns "
+           "FROM loan_daily_stats "
+           "WHERE day >= COALESCE(%(start)s::date, '-infinity') AND day < COALESCE(%(end)s::date, 'infinity') "
+           "GROUP BY 1 HAVING sum(loans) <> 0 OR sum(returns) <> 0 ORDER BY 1"),
+    Report("daily", "Daily circulation",
+           ("day", "loans", "returns"), True,
+           "SELECT day, loans, returns FROM loan_daily_stats "
+           "WHERE day >= COALESCE(%(start)s::date, '-infinity') AND day < COALESCE(%(end)s::date, 'infinity') "
+           "AND (loans <> 0 OR returns <> 0) ORDER BY day"),
+]}
+
+
+def report_params(limit=REPORT_LIMIT, start=None, end=None):
+    return {"limit": limit, "start": start, "end": end, "loan_period": LOAN_PERIOD_DAYS}
+
+
+# --- Database jobs ---
+def db_run_report(cursor, name, params):
+    """Runs one report from REPORTS and returns its rows."""
+    cursor.execute(REPORTS[name].sql, params)
+    return cursor.fetchall()
+
+
+def db_copy_report(cursor, name, params, file):
+    """Writes one report to file as CSV with a header row, formatted by PostgreSQL."""
+    query = cursor.mogrify(REPORTS[name].sql, params).decode()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+
+
+def db_rebuild_rollups(cursor):
+    """Recomputes the rollup tables from Loans, e.g. after a TRUNCATE, which the triggers do not see."""
+    cursor.execute(REBUILD_ROLLUPS_SQL)
+
+
+# --- Columnar export ---
+def to_columns(columns, rows):
+    """Returns {column: [values]} for a list of row tuples, transposed in one pass."""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {column: list(column_values) for column, column_values in zip(columns, values)}
+
+
+def to_arrays(columns, rows):
+    """Returns {column: numpy array} for a list of row tuples; dates become datetime64[D]."""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("to_arrays needs NumPy (pip install numpy)") from None
+    return {column: numpy.array(values, dtype="datetime64[D]" if column in DATE_COLUMNS else None)
+            for column, values in to_columns(columns, rows).items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("report", nargs="?", choices=sorted(REPORTS))
+    parser.add_argument("--limit", type=int, default=REPORT_LIMIT)
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollup tables from Loans")
+    args = parser.parse_args(argv)
+    if not args.report and not args.rebuild:
+        parser.error("name a report or pass --rebuild")
+
+    logging.basicConfig(level=logging.WARNING)
+    db = Database(min_size=1, max_size=1)
+    try:
+        if args.rebuild:
+            db.run(db_rebuild_rollups)
+            print("Rollup tables rebuilt.", file=sys.stderr)
+        if args.report:
+            db.run(db_copy_report, args.report, report_params(args.limit, args.start, args.end), sys.stdout)
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
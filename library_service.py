@@ -0,0 +1,588 @@
+"""GUI-free library operations shared by the desktop client and the HTTP API.
+
+LibraryService validates its arguments and runs each operation as one
+pooled transaction, so the same rules apply whether a request comes from
+a desk's Qt window or a kiosk over HTTP. Every method takes an optional
+on_connection hook, passed on to Database.run, so a caller on another
+thread can cancel the running statement.
+
+Single book and member lookups are served from a RecordCache, which the
+service's own writes update and a ChangeListener keeps in sync with
+everyone else's. Circulation reports come from the rollup tables in
+library_reports. Scanned copies are checked out and returned by barcode,
+a whole batch of scans per transaction. Holds queue members for a title
+that is out (see library_holds).
+"""
+import re
+from datetime import date
+
+from library_cache import CACHE_SIZE, CACHE_TTL, RecordCache
+from library_db import (LISTEN_RETRY_SECONDS, ChangeListener, Database, db_loan_book,
+                        db_return_book, db_loan_books, db_return_books, db_checkout_copies,
+                        db_return_copies, db_fetch_copies, db_availability, db_add_copy, db_delete_copy,
+                        _allocate_holds)
+from library_holds import (HOLD_EXPIRY_BATCH, db_book_holds, db_cancel_hold, db_fetch_hold, db_member_holds,
+                           db_place_hold, expire_holds)
+from library_metrics import METRICS
+from library_migrations import migrate
+from library_reports import MAX_REPORT_LIMIT, REPORT_LIMIT, REPORTS, db_copy_report, db_run_report, report_params
+
+# Rows per page when the caller does not ask for a size, and the most allowed
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# Field names of the row tuples the service returns
+BOOK_COLUMNS = ("book_id", "title", "author", "isbn")
+MEMBER_COLUMNS = ("member_id", "name", "email")
+LOAN_COLUMNS = ("loan_id", "book_id", "member_id", "loan_date", "return_date", "title", "member_name")
+COPY_COLUMNS = ("copy_id", "book_id", "barcode", "is_available")
+AVAILABILITY_COLUMNS = ("book_id", "copies", "available")
+HOLD_COLUMNS = ("hold_id", "book_id", "member_id", "status", "placed_at", "expires_at", "position", "barcode",
+                "title", "member_name")
+
+# Most barcodes accepted in one scan batch, and the longest barcode
+MAX_SCAN_BATCH = 500
+MAX_BARCODE_LENGTH = 64
+
+# Holds listed from the head of a title's queue unless the caller asks for more
+HOLD_QUEUE_LIMIT = 50
+
+# ISBN-10 (which may end in an X check digit) or ISBN-13, once separators are removed
+ISBN_PATTERN = re.compile(r"^\d{9}[\dX]$|^\d{13}$")
+
+
+class ValidationError(Exception):
+    """Raised when a request is rejected before it reaches the database."""
+
+
+def like_pattern(term):
+    """Builds an ILIKE pattern: substring match, or prefix match for terms under 3 characters.
+
+    pg_trgm indexes need three characters to work with, so short terms only
+    match at the start of a value, which the index can still serve.
+    """
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%" if len(term) >= 3 else f"{escaped}%"
+
+
+def normalize_isbn(value):
+    """Returns the ISBN without hyphens or spaces and with an upper-case X, or None if it is not one."""
+    isbn = str(value).replace("-", "").replace(" ", "").upper()
+    return isbn if ISBN_PATTERN.match(isbn) else None
+
+
+# --- Database jobs ---
+def db_fetch_books_page(cursor, after_id, limit):
+    """Fetches the next keyset page of books after the given book_id."""
+    cursor.execute(
+        "SELECT book_id, title, author, isbn FROM Books WHERE book_id > %s ORDER BY book_id LIMIT %s",
+        (after_id, limit)
+    )
+    return cursor.fetchall()
+
+
+def db_search_books_page(cursor, after_id, limit, term):
+    """Fetches the next keyset page of books whose title, author, ISBN or ID match term."""
+    cursor.execute(
+        "SELECT book_id, title, author, isbn FROM Books "
+        "WHERE (title ILIKE %(pattern)s OR author ILIKE %(pattern)s OR isbn ILIKE %(pattern)s "
+        "OR book_id = %(id)s) AND book_id > %(after_id)s ORDER BY book_id LIMIT %(limit)s",
+        {"pattern": like_pattern(term), "id": int(term) if term.isdigit() else None,
+         "after_id": after_id, "limit": limit}
+    )
+    return cursor.fetchall()
+
+
+def db_fetch_book(cursor, book_id):
+    """Fetches one book row, or None if there is no such book."""
+    cursor.execute("SELECT book_id, title, author, isbn FROM Books WHERE book_id = %s", (book_id,))
+    return cursor.fetchone()
+
+
+def db_fetch_books_by_id(cursor, book_ids):
+    """Fetches the book rows among book_ids that still exist."""
+    cursor.execute("SELECT book_id, title, author, isbn FROM Books WHERE book_id = ANY(%s)", (list(book_ids),))
+    return cursor.fetchall()
+
+
+def db_insert_book(cursor, title, author, isbn):
+    cursor.execute(
+        "INSERT INTO Books (title, author, isbn) VALUES (%s, %s, %s) "
+        "RETURNING book_id, title, author, isbn",
+        (title, author, isbn)
+    )
+    return cursor.fetchone()
+
+
+def db_update_book(cursor, book_id, title, author, isbn):
+    cursor.execute(
+        "UPDATE Books SET title = %s, author = %s, isbn = %s WHERE book_id = %s "
+        "RETURNING book_id, title, author, isbn",
+        (title, author, isbn, book_id)
+    )
+    return cursor.fetchone()
+
+
+def db_delete_book(cursor, book_id):
+    cursor.execute("DELETE FROM Books WHERE book_id = %s", (book_id,))
+
+
+def db_fetch_members_page(cursor, after_id, limit):
+    """Fetches the next keyset page of members after the given member_id."""
+    cursor.execute(
+        "SELECT member_id, name, email FROM Members WHERE member_id > %s ORDER BY member_id LIMIT %s",
+        (after_id, limit)
+    )
+    return cursor.fetchall()
+
+
+def db_search_members_page(cursor, after_id, limit, term):
+    """Fetches the next keyset page of members whose name, email or ID match term."""
+    cursor.execute(
+        "SELECT member_id, name, email FROM Members "
+        "WHERE (name ILIKE %(pattern)s OR email ILIKE %(pattern)s OR member_id = %(id)s) "
+        "AND member_id > %(after_id)s ORDER BY member_id LIMIT %(limit)s",
+        {"pattern": like_pattern(term), "id": int(term) if term.isdigit() else None,
+         "after_id": after_id, "limit": limit}
+    )
+    return cursor.fetchall()
+
+
+def db_fetch_member(cursor, member_id):
+    """Fetches one member row, or None if there is no such member."""
+    cursor.execute("SELECT member_id, name, email FROM Members WHERE member_id = %s", (member_id,))
+    return cursor.fetchone()
+
+
+def db_fetch_members_by_id(cursor, member_ids):
+    """Fetches the member rows among member_ids that still exist."""
+    cursor.execute("SELECT member_id, name, email FROM Members WHERE member_id = ANY(%s)", (list(member_ids),))
+    return cursor.fetchall()
+
+
+def db_insert_member(cursor, name, email):
+    cursor.execute(
+        "INSERT INTO Members (name, email) VALUES (%s, %s) RETURNING member_id, name, email",
+        (name, email)
+    )
+    return cursor.fetchone()
+
+
+def db_update_member(cursor, member_id, name, email):
+    cursor.execute(
+        "UPDATE Members SET name = %s, email = %s WHERE member_id = %s "
+        "RETURNING member_id, name, email",
+        (name, email, member_id)
+    )
+    return cursor.fetchone()
+
+
+def db_delete_member(cursor, member_id):
+    """Deletes a member, passing the copies set aside for their ready holds on to the next in line.
+
+    The member's holds go with them (ON DELETE CASCADE), and would otherwise
+    leave those copies set aside for no one.
+    """
+    cursor.execute("UPDATE Copies SET is_available = TRUE WHERE copy_id IN "
+                   "(SELECT copy_id FROM Holds WHERE member_id = %s AND status = 'ready') RETURNING book_id",
+                   (member_id,))
+    book_ids = {row[0] for row in cursor.fetchall()}
+    cursor.execute("DELETE FROM Members WHERE member_id = %s", (member_id,))
+    _allocate_holds(cursor, book_ids)
+
+
+def db_fetch_loans_page(cursor, after_id, limit, active_only=True):
+    """Fetches the next keyset page of loan rows after the given loan_id.
+
+    Titles and member names are joined in here rather than looked up per
+    row; with active_only, returned loans never leave the server.
+    """
+    active = "AND l.return_date IS NULL " if active_only else ""
+    cursor.execute(
+        "SELECT l.loan_id, l.book_id, l.member_id, l.loan_date, l.return_date, b.title, m.name "
+        "FROM Loans l LEFT JOIN Books b ON b.book_id = l.book_id "
+        "LEFT JOIN Members m ON m.member_id = l.member_id "
+        f"WHERE l.loan_id > %s {active}ORDER BY l.loan_id LIMIT %s",
+        (after_id, limit)
+    )
+    return cursor.fetchall()
+
+
+def db_fetch_loans_by_id(cursor, loan_ids):
+    """Fetches the loan rows among loan_ids that still exist."""
+    cursor.execute(
+        "SELECT l.loan_id, l.book_id, l.member_id, l.loan_date, l.return_date, b.title, m.name "
+        "FROM Loans l LEFT JOIN Books b ON b.book_id = l.book_id "
+        "LEFT JOIN Members m ON m.member_id = l.member_id "
+        "WHERE l.loan_id = ANY(%s)",
+        (list(loan_ids),)
+    )
+    return cursor.fetchall()
+
+
+# --- Validation ---
+def _page(after_id, limit):
+    if not _is_id(after_id, allow_zero=True) or not _is_id(limit):
+        raise ValidationError("after and limit must be numbers.")
+    return after_id, min(limit, MAX_PAGE_SIZE)
+
+
+def _is_id(value, allow_zero=False):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= (0 if allow_zero else 1)
+
+
+def _require_id(value, message):
+    if value is None:
+        raise ValidationError(message)
+    if not _is_id(value):
+        raise ValidationError("IDs must be numbers.")
+    return value
+
+
+def validate_book(title, author, isbn):
+    """Returns (title, author, isbn) ready to store; raises ValidationError otherwise."""
+    if not title or not author:
+        raise ValidationError("please insert name ans author.")
+    if not isbn:
+        return title, author, None
+    normalized = normalize_isbn(isbn)
+    if normalized is None:
+        raise ValidationError("ISBN must be 10 or 13 digits; an ISBN-10 may end in X.")
+    return title, author, normalized
+
+
+def validate_member(name, email):
+    """Returns (name, email) ready to store; raises ValidationError otherwise."""
+    if not name:
+        raise ValidationError("please insert the members name.")
+    return name, email or None
+
+
+def _validate_ids(ids):
+    if not isinstance(ids, (list, tuple)) or not all(_is_id(i) for i in ids):
+        raise ValidationError("IDs must be numbers.")
+    return list(ids)
+
+
+def validate_book_ids(book_ids):
+    """Returns a non-empty list of book ids; raises ValidationError otherwise."""
+    if not book_ids:
+        raise ValidationError("please insert the book id.")
+    if not isinstance(book_ids, (list, tuple)) or not all(_is_id(i) for i in book_ids):
+        raise ValidationError("Book ID must be a number.")
+    return list(book_ids)
+
+
+def validate_barcode(barcode):
+    """Returns the barcode without surrounding whitespace; raises ValidationError otherwise."""
+    if not isinstance(barcode, str) or not barcode.strip():
+        raise ValidationError("please scan or type a barcode.")
+    if len(barcode.strip()) > MAX_BARCODE_LENGTH:
+        raise ValidationError(f"barcodes are at most {MAX_BARCODE_LENGTH} characters.")
+    return barcode.strip()
+
+
+def validate_barcodes(barcodes):
+    """Returns a non-empty list of barcodes; raises ValidationError otherwise."""
+    if not barcodes or not isinstance(barcodes, (list, tuple)):
+        raise ValidationError("please scan or type a barcode.")
+    if len(barcodes) > MAX_SCAN_BATCH:
+        raise ValidationError(f"at most {MAX_SCAN_BATCH} barcodes at a time.")
+    return [validate_barcode(barcode) for barcode in barcodes]
+
+
+def validate_report(name, limit, start, end):
+    """Returns (name, params) for db_run_report; raises ValidationError otherwise."""
+    if name not in REPORTS:
+        raise ValidationError(f"no such report: {name}.")
+    if not _is_id(limit):
+        raise ValidationError("limit must be a number.")
+    for value in (start, end):
+        if value is not None and not isinstance(value, date):
+            raise ValidationError("start and end must be dates.")
+    if not REPORTS[name].ranged:
+        start = end = None
+    return name, report_params(min(limit, MAX_REPORT_LIMIT), start, end)
+
+
+class LibraryService:
+    """Validated library operations over a Database pool.
+
+    Methods block, so they are meant to be called from worker threads. They
+    return plain row tuples (see the *_COLUMNS constants) and raise
+    ValidationError for bad input and CirculationError for refused loans.
+    """
+
+    def __init__(self, db, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL):
+        self.db = db
+        # One caller per pooled connection keeps every call off the pool's wait list
+        self.max_concurrency = db.max_size
+        self.books = RecordCache("books", cache_size, cache_ttl)
+        self.members = RecordCache("members", cache_size, cache_ttl)
+        self._listener = None
+        METRICS.add_collector(self._cache_gauges)
+
+    def start_listener(self):
+        """Starts invalidating the caches on changes committed by other clients."""
+        self._listener = ChangeListener(self.db, [self._invalidate_cached])
+        self._listener.start()
+        # Rows cached before LISTEN is in place could miss their invalidation
+        self._listener.listening.wait(LISTEN_RETRY_SECONDS)
+
+    def close(self):
+        METRICS.remove_collector(self._cache_gauges)
+        if self._listener:
+            self._listener.stop()
+        self.db.close()
+
+    def add_change_handler(self, handler):
+        """Calls handler(table, ids) on the listener thread for every committed change.
+
+        ids is None when every row of table may have changed, and table is
+        None when anything may have (after the listener reconnected).
+        """
+        if self._listener:
+            self._listener.add_handler(handler)
+
+    def _invalidate_cached(self, table, ids):
+        caches = {"books": [self.books], "members": [self.members], None: [self.books, self.members]}
+        for cache in caches.get(table, []):
+            if ids is None:
+                cache.clear()
+            for row_id in ids or []:
+                cache.invalidate(row_id)
+
+    def cache_stats(self):
+        return {"books": self.books.stats(), "members": self.members.stats()}
+
+    def _cache_gauges(self):
+        """Exports the cache counters as (name, labels, value) gauges for METRICS."""
+        for cache, stats in self.cache_stats().items():
+            for key, value in stats.items():
+                if value is not None:
+                    yield f"library_cache_{key}", {"cache": cache}, value
+
+    def _load(self, job, on_connection):
+        return lambda key: self.db.run(job, key, on_connection=on_connection)
+
+    def _cache_rows(self, cache, job, *args, on_connection=None):
+        # Pages warm the cache too; the generation check drops rows an invalidation raced with
+        generation = cache.generation()
+        rows = self.db.run(job, *args, on_connection=on_connection)
+        for row in rows:
+            cache.put(row[0], row, generation)
+        return rows
+
+    def _get_many(self, cache, job, row_ids, on_connection):
+        rows = {}
+        missing = []
+        for row_id in row_ids:
+            found, row = cache.lookup(row_id)
+            if found:
+                rows[row_id] = row
+            else:
+                missing.append(row_id)
+        if missing:
+            generation = cache.generation()
+            fetched = {row[0]: row for row in self.db.run(job, missing, on_connection=on_connection)}
+            for row_id in missing:
+                rows[row_id] = fetched.get(row_id)
+                cache.put(row_id, rows[row_id], generation)
+        return [row for row in rows.values() if row is not None]
+
+    def _store(self, cache, row_id, row):
+        if row is None:
+            cache.invalidate(row_id)
+        else:
+            cache.put(row_id, row)
+        return row
+
+    # --- Books ---
+    def list_books(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        """Returns the next page of books after after_id, filtered by term if given."""
+        after_id, limit = _page(after_id, limit)
+        term = (term or "").strip()
+        if term:
+            return self._cache_rows(self.books, db_search_books_page, after_id, limit, term,
+                                    on_connection=on_connection)
+        return self._cache_rows(self.books, db_fetch_books_page, after_id, limit, on_connection=on_connection)
+
+    def get_book(self, book_id, on_connection=None):
+        """Returns one book row, or None; repeated lookups are served from the cache."""
+        book_id = _require_id(book_id, "please insert the book id.")
+        return self.books.get_or_load(book_id, self._load(db_fetch_book, on_connection))
+
+    def get_books(self, book_ids, on_connection=None):
+        """Returns the rows of the books in book_ids that exist, fetching uncached ones in one query."""
+        return self._get_many(self.books, db_fetch_books_by_id, validate_book_ids(book_ids), on_connection)
+
+    def add_book(self, title, author, isbn=None, on_connection=None):
+        row = self.db.run(db_insert_book, *validate_book(title, author, isbn), on_connection=on_connection)
+        return self._store(self.books, row[0], row)
+
+    def update_book(self, book_id, title, author, isbn=None, on_connection=None):
+        """Returns the updated row, or None if the book no longer exists."""
+        book_id = _require_id(book_id, "please select a book first.")
+        row = self.db.run(db_update_book, book_id, *validate_book(title, author, isbn),
+                          on_connection=on_connection)
+        return self._store(self.books, book_id, row)
+
+    def delete_book(self, book_id, on_connection=None):
+        book_id = _require_id(book_id, "please select a book first.")
+        self.db.run(db_delete_book, book_id, on_connection=on_connection)
+        self.books.invalidate(book_id)
+
+    # --- Members ---
+    def list_members(self, after_id=0, limit=PAGE_SIZE, term="", on_connection=None):
+        """Returns the next page of members after after_id, filtered by term if given."""
+        after_id, limit = _page(after_id, limit)
+        term = (term or "").strip()
+        if term:
+            return self._cache_rows(self.members, db_search_members_page, after_id, limit, term,
+                                    on_connection=on_connection)
+        return self._cache_rows(self.members, db_fetch_members_page, after_id, limit, on_connection=on_connection)
+
+    def get_member(self, member_id, on_connection=None):
+        """Returns one member row, or None; repeated lookups are served from the cache."""
+        member_id = _require_id(member_id, "please insert the members id.")
+        return self.members.get_or_load(member_id, self._load(db_fetch_member, on_connection))
+
+    def get_members(self, member_ids, on_connection=None):
+        """Returns the rows of the members in member_ids that exist, fetching uncached ones in one query."""
+        return self._get_many(self.members, db_fetch_members_by_id, _validate_ids(member_ids), on_connection)
+
+    def add_member(self, name, email=None, on_connection=None):
+        row = self.db.run(db_insert_member, *validate_member(name, email), on_connection=on_connection)
+        return self._store(self.members, row[0], row)
+
+    def update_member(self, member_id, name, email=None, on_connection=None):
+        """Returns the updated row, or None if the member no longer exists."""
+        member_id = _require_id(member_id, "please select a member first.")
+        row = self.db.run(db_update_member, member_id, *validate_member(name, email),
+                          on_connection=on_connection)
+        return self._store(self.members, member_id, row)
+
+    def delete_member(self, member_id, on_connection=None):
+        member_id = _require_id(member_id, "please select a member first.")
+        self.db.run(db_delete_member, member_id, on_connection=on_connection)
+        self.members.invalidate(member_id)
+
+    # --- Loans ---
+    def list_loans(self, after_id=0, limit=PAGE_SIZE, active_only=True, on_connection=None):
+        """Returns the next page of loan rows after after_id."""
+        after_id, limit = _page(after_id, limit)
+        return self.db.run(db_fetch_loans_page, after_id, limit, bool(active_only), on_connection=on_connection)
+
+    def get_loans(self, loan_ids, on_connection=None):
+        """Returns the loan rows among loan_ids that exist."""
+        return self.db.run(db_fetch_loans_by_id, _validate_ids(loan_ids), on_connection=on_connection)
+
+    def loan_book(self, book_id, member_id, on_connection=None):
+        """Loans one book; returns the loan row or raises CirculationError with the reason."""
+        book_id = _require_id(book_id, "please insert the book and the members id.")
+        member_id = _require_id(member_id, "please insert the book and the members id.")
+        return self.db.run(db_loan_book, book_id, member_id, on_connection=on_connection)
+
+    def return_book(self, book_id, on_connection=None):
+        """Returns one book; returns its closed loan rows or raises CirculationError."""
+        book_id = _require_id(book_id, "please insert the book id.")
+        return self.db.run(db_return_book, book_id, on_connection=on_connection)
+
+    def loan_books(self, book_ids, member_id, on_connection=None):
+        """Loans a stack of books to one member; returns (loans, refused_ids)."""
+        book_ids = validate_book_ids(book_ids)
+        member_id = _require_id(member_id, "please insert the book and the members id.")
+        return self.db.run(db_loan_books, book_ids, member_id, on_connection=on_connection)
+
+    def return_books(self, book_ids, on_connection=None):
+        """Returns a stack of books; returns (loans, not_on_loan_ids)."""
+        return self.db.run(db_return_books, validate_book_ids(book_ids), on_connection=on_connection)
+
+    def checkout_copies(self, barcodes, member_id, on_connection=None):
+        """Loans scanned copies to one member; returns ([(barcode, loan)], [(barcode, reason)])."""
+        barcodes = validate_barcodes(barcodes)
+        member_id = _require_id(member_id, "please insert the members id.")
+        return self.db.run(db_checkout_copies, barcodes, member_id, on_connection=on_connection)
+
+    def return_copies(self, barcodes, on_connection=None):
+        """Returns scanned copies; returns ([(barcode, loan)], [(barcode, reason)], [(barcode, held_for)]).
+
+        held_for names the member whose hold a returned copy was set aside for.
+        """
+        return self.db.run(db_return_copies, validate_barcodes(barcodes), on_connection=on_connection)
+
+    # --- Copies ---
+    def get_copies(self, book_id, on_connection=None):
+        """Returns the copy rows of one book."""
+        book_id = _require_id(book_id, "please select a book first.")
+        return self.db.run(db_fetch_copies, book_id, on_connection=on_connection)
+
+    def availability(self, book_ids, on_connection=None):
+        """Returns (book_id, copies, available) rows for the books in book_ids that have copies."""
+        return self.db.run(db_availability, validate_book_ids(book_ids), on_connection=on_connection)
+
+    def add_copy(self, book_id, barcode=None, on_connection=None):
+        """Adds a copy of a book; the barcode is generated unless one is given. Returns the copy row."""
+        book_id = _require_id(book_id, "please select a book first.")
+        if barcode is not None:
+            barcode = validate_barcode(barcode)
+        return self.db.run(db_add_copy, book_id, barcode, on_connection=on_connection)
+
+    def delete_copy(self, copy_id, on_connection=None):
+        """Removes a copy that is not on loan; returns its row, or None if there is no such copy."""
+        copy_id = _require_id(copy_id, "please select a copy first.")
+        return self.db.run(db_delete_copy, copy_id, on_connection=on_connection)
+
+    # --- Holds ---
+    def place_hold(self, book_id, member_id, on_connection=None):
+        """Queues a member for a title that is out; returns the hold row with its position."""
+        book_id = _require_id(book_id, "please insert the book and the members id.")
+        member_id = _require_id(member_id, "please insert the book and the members id.")
+        return self.db.run(db_place_hold, book_id, member_id, on_connection=on_connection)
+
+    def get_hold(self, hold_id, on_connection=None):
+        """Returns one hold row, or None if there is no such hold."""
+        hold_id = _require_id(hold_id, "please select a hold first.")
+        return self.db.run(db_fetch_hold, hold_id, on_connection=on_connection)
+
+    def cancel_hold(self, hold_id, on_connection=None):
+        """Cancels an open hold; returns its row, or None if there is no such hold."""
+        hold_id = _require_id(hold_id, "please select a hold first.")
+        return self.db.run(db_cancel_hold, hold_id, on_connection=on_connection)
+
+    def member_holds(self, member_id, on_connection=None):
+        """Returns a member's waiting and ready holds."""
+        member_id = _require_id(member_id, "please insert the members id.")
+        return self.db.run(db_member_holds, member_id, on_connection=on_connection)
+
+    def book_holds(self, book_id, limit=HOLD_QUEUE_LIMIT, on_connection=None):
+        """Returns a title's ready holds and the first limit holds in its queue."""
+        book_id = _require_id(book_id, "please select a book first.")
+        _, limit = _page(0, limit)
+        return self.db.run(db_book_holds, book_id, limit, on_connection=on_connection)
+
+    def expire_holds(self, batch=HOLD_EXPIRY_BATCH, on_connection=None):
+        """Expires every hold whose time is up, a batch per transaction; returns how many expired."""
+        return expire_holds(self.db, batch, on_connection=on_connection)
+
+    # --- Reports ---
+    def report(self, name, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        """Returns the rows of a report in REPORTS; start and end only apply to ranged ones."""
+        return self.db.run(db_run_report, *validate_report(name, limit, start, end), on_connection=on_connection)
+
+    def export_report(self, name, file, limit=REPORT_LIMIT, start=None, end=None, on_connection=None):
+        """Writes a report to the text file as CSV with a header row."""
+        self.db.run(db_copy_report, *validate_report(name, limit, start, end), file, on_connection=on_connection)
+
+
+def open_service(**pool_settings):
+    """Opens a connection pool, brings the schema up to date and returns a LibraryService."""
+    db = Database(**pool_settings)
+    try:
+        migrate(db)
+    except Exception:
+        db.close()
+        raise
+    service = LibraryService(db)
+    service.start_listener()
+    return service
@@ -1,47 +1,567 @@
+import os
 import sys
-import psycopg2
 import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import date, timedelta
+from functools import partial
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
-                             QLabel, QLineEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QMessageBox, QTabWidget, QGridLayout)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIntValidator
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('library_app.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+                             QLabel, QLineEdit, QPushButton, QTableView,
+                             QMessageBox, QTabWidget, QGridLayout, QHeaderView,
+                             QFileDialog, QCheckBox, QComboBox, QDateEdit, QListWidget,
+                             QListWidgetItem)
+from PyQt5.QtCore import (Qt, QAbstractTableModel, QModelIndex, QObject, QRunnable,
+                          QThreadPool, QRegExp, QTimer, QDate, pyqtSignal)
+from PyQt5.QtGui import QColor, QIntValidator, QRegExpValidator
+from library_db import CirculationError, LOAN_PERIOD_DAYS
+from library_service import MAX_SCAN_BATCH, PAGE_SIZE, ValidationError, open_service
+from library_reports import REPORT_LIMIT, REPORTS
+# library_client, library_offline and library_import are imported where they are
+# first used, so their urllib/ssl and sqlite3 imports stay off the startup path
+from library_metrics import METRICS
+from library_logging import configure_logging, stop_logging
+
+# Log file (JSON lines, rotated); records are written by a background thread
+LOG_FILE = 'library_app.log'
+
+# Matches shown per page of a live search, and the typing pause before it runs
+SEARCH_LIMIT = 50
+SEARCH_DEBOUNCE_MS = 250
+
+# Pause after a pushed change before the batch collected so far is applied
+CHANGE_BATCH_MS = 100
+
+# Titles spelled out in the Loan tab preview before the rest are counted
+PREVIEW_BOOKS = 3
+
+# How often the connection indicator is updated (and, while offline, a reconnect tried)
+STATUS_CHECK_MS = 5000
+
+# Offline conflicts listed in the message box after a sync before the rest are counted
+MAX_LISTED_CONFLICTS = 10
+
+# Months of history the ranged reports cover when the Reports tab opens
+REPORT_DEFAULT_MONTHS = 12
+
+# Scan results kept in the Loan tab's scan log, newest first
+SCAN_LOG_LINES = 200
+
+# Barcodes listed under a book's copy count before the rest are counted
+LISTED_COPIES = 5
+
+# Where the metrics snapshot is written when the application closes
+METRICS_FILE = os.environ.get("LIBRARY_METRICS_FILE", "library_metrics.json")
+
+class RowTableModel(QAbstractTableModel):
+    """Read-only table model over a compact list of row tuples.
+
+    The view only asks for the cells it paints, so no per-cell objects are
+    created when a large result set is loaded. When a ``fetch_page`` call is
+    given, rows are loaded one keyset page at a time as the view scrolls:
+    ``fetch_page(after_id, limit)`` is run through ``run_call`` and must
+    return up to ``limit`` rows ordered by their first column, all with an
+    id greater than ``after_id``.
+
+    Rows stay sorted by that id column, so single rows can be patched in
+    place with ``upsert_row``/``remove_row`` after a write instead of
+    reloading the table.
+
+    Each page's round trip and the time spent inserting it into the view
+    are recorded in METRICS, labelled with ``name``.
+    """
+
+    load_failed = pyqtSignal(object)
+
+    def __init__(self, headers, fetch_page=None, run_call=None, page_size=PAGE_SIZE, parent=None, name="table"):
+        super().__init__(parent)
+        self.name = name
+        self._headers = list(headers)
+        self._rows = []
+        self._ids = []
+        self._fetch_page = fetch_page
+        self._run_call = run_call
+        self._page_size = page_size
+        self._exhausted = True
+        self._pending = None
+        self._requested_at = 0.0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        value = self._rows[index.row()][index.column()]
+        return str(value) if value is not None else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self._headers[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted and self._pending is None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self._request_page()
+
+    def set_fetch_page(self, fetch_page, page_size=PAGE_SIZE):
+        """Switches the query behind the model, e.g. to a search, and reloads."""
+        self._fetch_page = fetch_page
+        self._page_size = page_size
+        self.reload()
+
+    def reload(self):
+        """Drops the loaded rows and requests the first page again.
+
+        A page still in flight for the previous load is cancelled, so its
+        stale rows never reach the view.
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        self.beginResetModel()
+        self._rows = []
+        self._ids = []
+        self._exhausted = self._fetch_page is None
+        self.endResetModel()
+        if not self._exhausted:
+            self._request_page()
+
+    def _request_page(self):
+        after_id = self._ids[-1] if self._ids else 0
+        self._requested_at = time.perf_counter()
+        self._pending = self._run_call(self._fetch_page, after_id, self._page_size,
+                                     on_result=self._page_loaded, on_error=self._page_failed)
+
+    def _page_loaded(self, rows):
+        self._pending = None
+        self._exhausted = len(rows) < self._page_size
+        start = time.perf_counter()
+        if rows:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self._rows.extend(rows)
+            self._ids.extend(row[0] for row in rows)
+            self.endInsertRows()
+        end = time.perf_counter()
+        METRICS.observe("library_ui_page_seconds", end - self._requested_at, table=self.name)
+        METRICS.observe("library_ui_populate_seconds", end - start, table=self.name)
+        METRICS.count("library_ui_rows_loaded_total", len(rows), table=self.name)
+
+    def _page_failed(self, error):
+        self._pending = None
+        # Stop the view from retrying on every scroll; the next reload resets it
+        self._exhausted = True
+        self.load_failed.emit(error)
+
+    def _position(self, row_id):
+        pos = bisect_left(self._ids, row_id)
+        return pos, pos < len(self._ids) and self._ids[pos] == row_id
+
+    def upsert_row(self, row):
+        """Inserts or replaces a single row, keyed by its first column."""
+        pos, found = self._position(row[0])
+        if found:
+            self._rows[pos] = row
+            self.dataChanged.emit(self.index(pos, 0), self.index(pos, len(self._headers) - 1))
+        elif pos < len(self._ids) or self._exhausted:
+            self.beginInsertRows(QModelIndex(), pos, pos)
+            self._rows.insert(pos, row)
+            self._ids.insert(pos, row[0])
+            self.endInsertRows()
+        # Otherwise the row sorts after the loaded pages and arrives with fetchMore
+
+    def remove_row(self, row_id):
+        """Removes the row with the given id if it is loaded."""
+        pos, found = self._position(row_id)
+        if found:
+            self.beginRemoveRows(QModelIndex(), pos, pos)
+            del self._rows[pos]
+            del self._ids[pos]
+            self.endRemoveRows()
+
+    def replace_row(self, row):
+        """Replaces a row only if it is loaded, keyed by its first column."""
+        pos, found = self._position(row[0])
+        if found:
+            self._rows[pos] = row
+            self.dataChanged.emit(self.index(pos, 0), self.index(pos, len(self._headers) - 1))
+
+    def row_data(self, row):
+        """Returns the raw tuple stored for a row."""
+        return self._rows[row]
+
+    def set_rows(self, headers, rows):
+        """Shows a fixed result set, such as a report, in the order given.
+
+        The rows are not paged or patched afterwards, so they need not be
+        sorted by id.
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        self.beginResetModel()
+        self._headers = list(headers)
+        self._rows = list(rows)
+        self._ids = []
+        self._fetch_page = None
+        self._exhausted = True
+        self.endResetModel()
+
+
+def make_table_view(model):
+    """Creates a row-selecting table view with fixed-height rows for a model."""
+    view = QTableView()
+    view.setModel(model)
+    view.setSelectionBehavior(QTableView.SelectRows)
+    # Fixed row heights keep Qt from measuring every row up front
+    view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    return view
+
+
+def make_debounce_timer(parent, slot):
+    """Creates a single-shot timer that runs slot once typing pauses."""
+    timer = QTimer(parent)
+    timer.setSingleShot(True)
+    timer.setInterval(SEARCH_DEBOUNCE_MS)
+    timer.timeout.connect(slot)
+    return timer
+
+
+class TaskSignals(QObject):
+    """Signals a DbTask uses to hand its outcome back to the GUI thread."""
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    finished = pyqtSignal()
+
+
+class DbTask(QRunnable):
+    """Runs a blocking function on a QThreadPool worker thread.
+
+    Results and exceptions are delivered through queued signals, so the
+    connected callbacks run on the GUI thread. A cancelled task is skipped
+    if it has not started yet and never reports a result; if it is running
+    a statement on a connection handed to ``set_connection``, that statement
+    is cancelled on the server as well.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self.cancelled = False
+        self.setAutoDelete(False)
+        self._connection = None
+        self._connection_lock = threading.Lock()
+
+    def set_connection(self, conn):
+        with self._connection_lock:
+            self._connection = conn
+            if conn is not None and self.cancelled:
+                conn.cancel()
+
+    def cancel(self):
+        self.cancelled = True
+        # Holding the lock keeps the connection from going back to the pool
+        # (and to another job) while the cancel request is sent
+        with self._connection_lock:
+            if self._connection is not None:
+                self._connection.cancel()
+
+    def run(self):
+        try:
+            if not self.cancelled:
+                result = self.fn(*self.args, **self.kwargs)
+                if not self.cancelled:
+                    self.signals.result.emit(result)
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.error.emit(e)
+        finally:
+            self.signals.finished.emit()
+
+
+def parse_ids(text):
+    """Splits ids separated by spaces or commas; returns None if one is not a number."""
+    ids = text.replace(",", " ").split()
+    if not all(i.isdigit() for i in ids):
+        return None
+    return [int(i) for i in ids]
+
+
+def describe_copies(copies):
+    """Summarises a book's copy rows as "N copies, M available: barcode, ..."."""
+    available = sum(1 for copy in copies if copy[3])
+    text = f"{len(copies)} {'copy' if len(copies) == 1 else 'copies'}, {available} available"
+    if copies:
+        text += ": " + ", ".join(f"{copy[2]}{'' if copy[3] else ' (on loan)'}" for copy in copies[:LISTED_COPIES])
+    if len(copies) > LISTED_COPIES:
+        text += f" and {len(copies) - LISTED_COPIES} more"
+    return text
+
+
+def scan_outcomes(mode, result):
+    """Turns a checkout_copies/return_copies result into {barcode: (log line, refused)}."""
+    loaned, refused, *held = result
+    held_for = dict(held[0]) if held else {}
+    outcomes = {}
+    for barcode, loan in loaned:
+        if mode == "checkout":
+            outcomes[barcode] = (f"{barcode}  checked out: {loan[5]} to {loan[6] or f'#{loan[2]}'}", False)
+        elif barcode in held_for:
+            outcomes[barcode] = (f"{barcode}  returned: {loan[5]}; set aside for {held_for[barcode]}'s hold", False)
+        else:
+            outcomes[barcode] = (f"{barcode}  returned: {loan[5]}", False)
+    for barcode, reason in refused:
+        outcomes[barcode] = (f"{barcode}  refused: {reason}", True)
+    return outcomes
+
+
+def loan_view_row(loan, today=None):
+    """Turns a loan row into the loans table's (id, book id, title, member, loan date, days, status)."""
+    loan_id, book_id, member_id, loan_date, return_date, title, member_name = loan
+    today = today or date.today()
+    days = ((return_date or today) - loan_date).days
+    if return_date:
+        status = f"Returned {return_date}"
+    elif days > LOAN_PERIOD_DAYS:
+        status = f"Overdue by {days - LOAN_PERIOD_DAYS} days"
+    else:
+        status = f"Due {loan_date + timedelta(days=LOAN_PERIOD_DAYS)}"
+    return loan_id, book_id, title, member_name or f"#{member_id}", loan_date, days, status
+
+
+# --- Worker jobs (run on worker threads; they must never touch widgets) ---
+def open_library():
+    """Connects to the shared library API if LIBRARY_API_URL is set, otherwise opens a local service.
+
+    A local service falls back to the SQLite replica when PostgreSQL cannot
+    be reached; it only fails here if there is no replica to fall back on.
+    """
+    url = os.environ.get("LIBRARY_API_URL")
+    if url:
+        from library_client import LibraryClient
+        client = LibraryClient(url)
+        client.health()
+        return client
+    from library_offline import FailoverService, LocalReplica
+    service = FailoverService(open_service, LocalReplica())
+    try:
+        service.connect()
+    except Exception:
+        service.close()
+        raise
+    return service
+
+
+def check_library(service):
+    """Tries to bring an offline FailoverService back online; returns (reconnected, status)."""
+    reconnected = service.reconnect() is not None
+    return reconnected, service.status()
+
+
+def describe_conflicts(conflicts):
+    """Lists offline checkouts/returns the database refused, for a message box."""
+    lines = [f"{op} of book {book_id}" + (f" to member {member_id}" if member_id else "") + f" on {op_date}: {reason}"
+             for op, book_id, member_id, op_date, reason in conflicts[:MAX_LISTED_CONFLICTS]]
+    if len(conflicts) > MAX_LISTED_CONFLICTS:
+        lines.append(f"and {len(conflicts) - MAX_LISTED_CONFLICTS} more")
+    return "\n".join(lines)
+
+
+def export_report_file(service, path, name, limit, start, end):
+    """Worker job: writes a report to path as CSV."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        service.export_report(name, f, limit, start, end)
+
+
+def report_header(column):
+    return column.replace("_", " ").capitalize()
+
+
+def describe_loan(service, book_ids, member_id, on_connection=None):
+    """Resolves the IDs typed on the Loan tab into a preview of the titles and member name."""
+    parts = []
+    for book_id in book_ids[:PREVIEW_BOOKS]:
+        book = service.get_book(book_id, on_connection=on_connection)
+        parts.append(f"'{book[1]}'" if book else f"no book {book_id}")
+    if len(book_ids) > PREVIEW_BOOKS:
+        parts.append(f"and {len(book_ids) - PREVIEW_BOOKS} more")
+    text = ", ".join(parts)
+    if member_id is not None:
+        member = service.get_member(member_id, on_connection=on_connection)
+        text += f" → {member[1] if member else f'no member {member_id}'}"
+        try:
+            holds = service.member_holds(member_id, on_connection=on_connection) if member else []
+        except ValidationError:  # offline: the replica knows nothing of holds
+            holds = []
+        ready = [f"'{hold[8]}' ({hold[7]})" for hold in holds if hold[3] == "ready"]
+        if ready:
+            text += f"; ready for pickup: {', '.join(ready)}"
+    return text
+
+
+def fetch_loan_view_page(list_loans, after_id, limit, on_connection=None, **kwargs):
+    """Fetches a page of loans through list_loans and turns it into loans table rows."""
+    today = date.today()
+    return [loan_view_row(loan, today)
+            for loan in list_loans(after_id, limit, on_connection=on_connection, **kwargs)]
+
 
 class LibraryApp(QWidget):
+    # Emitted from the import worker thread with (imported, skipped)
+    import_progress = pyqtSignal(int, int)
+    # Emitted from the change listener thread with (table, ids)
+    change_received = pyqtSignal(object, object)
+
     def __init__(self):
         super().__init__()
-        self.db_conn = None
-        self.db_cursor = None
+        self.service = None
+        self.db = None
+        self.thread_pool = QThreadPool(self)
+        self._tasks = set()
+        self._preview_task = None
+        self._report_task = None
+        self._copies_task = None
+        # Scans waiting to be sent as (mode, member_id, barcode); one batch is in flight at a time
+        self._scans = deque()
+        self._scan_task = None
+        self._pending_changes = {}
+        self.change_timer = QTimer(self)
+        self.change_timer.setSingleShot(True)
+        self.change_timer.setInterval(CHANGE_BATCH_MS)
+        self.change_timer.timeout.connect(self.apply_changes)
+        self.change_received.connect(self.queue_change)
+        self._status_task = None
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(STATUS_CHECK_MS)
+        self.status_timer.timeout.connect(self.check_connection)
+        self.selected_book_id = None
+        self.selected_member_id = None
+        self.init_ui()
         self.init_db_connection()
-        if self.db_conn:
-            self.init_ui()
 
     def init_db_connection(self):
-        """Initializes the connection to the PostgreSQL database."""
-        try:
-            logging.info("Attempting to connect to the database...")
-            self.db_conn = psycopg2.connect(
-                host="localhost",
-                database="myDatabase",
-                user="postgres",
-                password="1360"
+        """Connects to the PostgreSQL database (or the library API) without blocking the window."""
+        logging.info("Attempting to connect to the database...")
+        self.connection_label.setText("Connecting to the library database...")
+        self.run_task(open_library, on_result=self.db_connected, on_error=self.db_connection_failed)
+
+    def db_connected(self, service):
+        self.service = service
+        logging.info("Successfully connected to the database.")
+        self.tab_widget.setEnabled(True)
+        self.load_tables()
+        # From now on other desks' changes are pushed instead of reloaded
+        service.add_change_handler(self.change_received.emit)
+        from library_offline import FailoverService
+        if isinstance(service, FailoverService):
+            self.check_connection()
+            self.status_timer.start()
+        else:
+            self.connection_label.setText(f"Connected to the library API at {service.base_url}.")
+
+    def load_tables(self):
+        """Points the tables of the tabs built so far at the service, which loads their first pages.
+
+        Tabs that have not been opened yet load their data when they are.
+        """
+        # Only set when the database is local and online; bulk import needs it directly
+        self.db = self.service.db
+        # One worker per pooled connection, so jobs never wait on the pool
+        self.thread_pool.setMaxThreadCount(self.service.max_concurrency)
+        for tab in self._built_tabs:
+            self._tabs[tab][2]()
+
+    def check_connection(self):
+        """Updates the connection indicator; while offline, also tries to reconnect."""
+        if self._status_task is not None:
+            return
+
+        def checked(result):
+            self._status_task = None
+            reconnected, (online, pending, conflicts) = result
+            if reconnected:
+                logging.info("Back online; reloading tables.")
+                self.load_tables()
+            self.show_connection_status(online, pending)
+            if conflicts:
+                QMessageBox.warning(self, "offline sync",
+                                    f"{len(conflicts)} checkouts/returns made offline could not be applied:\n"
+                                    + describe_conflicts(conflicts))
+
+        def failed(e):
+            self._status_task = None
+            logging.error("Connection check failed: %s", e)
+
+        self._status_task = self.run_task(check_library, self.service, on_result=checked, on_error=failed)
+
+    def show_connection_status(self, online, pending):
+        if online and not pending:
+            self.connection_label.setText("Connected to the library database.")
+        elif online:
+            self.connection_label.setText(f"Connected; syncing {pending} checkouts/returns made offline.")
+        else:
+            self.connection_label.setText(
+                f"Offline: working from the local copy; {pending} checkouts/returns waiting to sync. "
+                "Adding, editing and removing books or members is unavailable."
             )
-            self.db_cursor = self.db_conn.cursor()
-            logging.info("Successfully connected to the database.")
-        except psycopg2.Error as e:
-            logging.error(f"Error connecting to the database: {e}")
-            QMessageBox.critical(self, "database error", f"error in connection to the database: {e}")
-            self.db_conn = None
+        self.connection_label.setStyleSheet("" if online else "color: #b00020; font-weight: bold;")
+
+    def db_connection_failed(self, e):
+        logging.error("Error connecting to the database: %s", e)
+        self.connection_label.setText("Could not connect to the library database.")
+        QMessageBox.critical(self, "database error", f"error in connection to the database: {e}")
+        self.close()
+
+    def run_task(self, fn, *args, on_result=None, on_error=None):
+        """Runs fn(*args) on the worker pool and returns the DbTask.
+
+        on_result/on_error are called on the GUI thread. Cancelling the
+        returned task drops its outcome even if it has already finished.
+        """
+        return self.start_task(DbTask(fn, *args), on_result, on_error)
+
+    def start_task(self, task, on_result=None, on_error=None):
+        if on_result:
+            task.signals.result.connect(lambda result: task.cancelled or on_result(result))
+        if on_error:
+            task.signals.error.connect(lambda e: task.cancelled or on_error(e))
+        task.signals.finished.connect(lambda: self._tasks.discard(task))
+        self._tasks.add(task)
+        self.thread_pool.start(task)
+        return task
+
+    def run_call(self, fn, *args, on_result=None, on_error=None):
+        """Runs a LibraryService call fn(*args) on the worker pool.
+
+        Cancelling the returned task also cancels its statement on the server.
+        """
+        task = DbTask(fn, *args)
+        task.kwargs["on_connection"] = task.set_connection
+        return self.start_task(task, on_result, on_error)
+
+    def show_db_error(self, log_message, title, message, error):
+        """Logs a failed database job and reports it to the user."""
+        if isinstance(error, ValidationError):
+            logging.warning("%s: %s", log_message, error)
+            QMessageBox.warning(self, "خطا", str(error))
+            return
+        if isinstance(error, CirculationError):
+            # Already logged by the job with the book/member details
+            QMessageBox.critical(self, "error", str(error))
+            return
+        logging.error("%s: %s", log_message, error)
+        QMessageBox.critical(self, title, f"{message}: {error}")
 
     def init_ui(self):
         """Sets up the main user interface."""
@@ -49,29 +569,58 @@ class LibraryApp(QWidget):
         self.setGeometry(100, 100, 800, 600)
 
         main_layout = QVBoxLayout(self)
+        # Connection indicator, filled in once the database (or its local replica) is open
+        self.connection_label = QLabel()
+        main_layout.addWidget(self.connection_label)
         self.tab_widget = QTabWidget()
+        # Enabled once the database connection is up
+        self.tab_widget.setEnabled(False)
         main_layout.addWidget(self.tab_widget)
 
-        # Tab for Books
+        # Tabs start empty; each one's widgets are built, and its data loaded, when it is first opened
         self.books_tab = QWidget()
-        self.tab_widget.addTab(self.books_tab, "Books management")
-        self.setup_books_tab()
-
-        # Tab for Members
         self.members_tab = QWidget()
-        self.tab_widget.addTab(self.members_tab, "Members management")
-        self.setup_members_tab()
-        
-        # Tab for Loans
         self.loans_tab = QWidget()
+        self.reports_tab = QWidget()
+        # tab: (metrics name, build, load)
+        self._tabs = {
+            self.books_tab: ("books_tab", self.setup_books_tab, self.load_books_tab),
+            self.members_tab: ("members_tab", self.setup_members_tab, self.search_members),
+            self.loans_tab: ("loans_tab", self.setup_loans_tab, self.load_loans_tab),
+            self.reports_tab: ("reports_tab", self.setup_reports_tab, self.run_report),
+        }
+        self._built_tabs = set()
+        self.tab_widget.addTab(self.books_tab, "Books management")
+        self.tab_widget.addTab(self.members_tab, "Members management")
         self.tab_widget.addTab(self.loans_tab, "Loan management")
-        self.setup_loans_tab()
+        self.tab_widget.addTab(self.reports_tab, "Reports")
+        self.tab_widget.currentChanged.connect(self.tab_opened)
+        self.tab_opened(self.tab_widget.currentIndex())
+
+        logging.info("Application UI initialized.")
+
+    def tab_opened(self, index):
+        """Builds a tab the first time it is opened and loads its data once connected.
+
+        Reports are run again on every visit, since they are not kept current.
+        """
+        tab = self.tab_widget.widget(index)
+        name, build, load = self._tabs[tab]
+        if tab not in self._built_tabs:
+            with METRICS.timer("library_ui_build_seconds", widget=name):
+                build()
+            self._built_tabs.add(tab)
+        elif tab is not self.reports_tab:
+            return
+        if self.service is not None:
+            load()
+
+    def load_books_tab(self):
+        self.import_books_btn.setEnabled(self.db is not None)
+        self.search_books()
 
-        # Refresh data on startup
-        self.refresh_books_table()
-        self.refresh_members_table()
-        self.refresh_loans_table()
-        logging.info("Application UI initialized and data refreshed.")
+    def load_loans_tab(self):
+        self.filter_loans(self.show_returned_checkbox.isChecked())
 
     def setup_books_tab(self):
         """Sets up the UI for the Books tab."""
@@ -83,8 +632,8 @@ class LibraryApp(QWidget):
         self.book_author_input = QLineEdit()
         self.book_isbn_input = QLineEdit()
         
-        # Set validator for ISBN
-        self.book_isbn_input.setValidator(QIntValidator())
+        # ISBN-10 or ISBN-13 digits; an ISBN-10 may end in an X check digit
+        self.book_isbn_input.setValidator(QRegExpValidator(QRegExp(r"[0-9Xx]{0,13}")))
         
         form_layout.addWidget(QLabel("Book Name:"), 0, 0)
         form_layout.addWidget(self.book_title_input, 0, 1)
@@ -109,14 +658,44 @@ class LibraryApp(QWidget):
         button_layout.addWidget(self.delete_book_btn)
         layout.addLayout(button_layout)
 
+        # Bulk import from CSV/MARC
+        import_layout = QHBoxLayout()
+        self.import_books_btn = QPushButton("Import Books...")
+        self.import_books_btn.clicked.connect(self.import_books_file)
+        self.import_status_label = QLabel()
+        self.import_progress.connect(self.show_import_progress)
+        import_layout.addWidget(self.import_books_btn)
+        import_layout.addWidget(self.import_status_label, 1)
+        layout.addLayout(import_layout)
+
+        # Live search, debounced so typing does not fire a query per key
+        self.book_search_input = QLineEdit()
+        self.book_search_input.setPlaceholderText("Search by title, author, ISBN or ID")
+        self.book_search_timer = make_debounce_timer(self, self.search_books)
+        self.book_search_input.textChanged.connect(lambda _: self.book_search_timer.start())
+        layout.addWidget(self.book_search_input)
+
         # Table to display books
-        self.books_table = QTableWidget()
-        self.books_table.setColumnCount(4)
-        self.books_table.setHorizontalHeaderLabels(["ID", "Label", "Author", "ISBN"])
-        self.books_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.books_table.itemClicked.connect(self.select_book)
+        self.books_model = RowTableModel(["ID", "Label", "Author", "ISBN"], run_call=self.run_call, parent=self,
+                                         name="books")
+        self.books_model.load_failed.connect(
+            lambda e: self.show_db_error("Error fetching books from database", "خطا", "error in receive book", e))
+        self.books_table = make_table_view(self.books_model)
+        self.books_table.clicked.connect(self.select_book)
         layout.addWidget(self.books_table)
 
+        # Copies of the selected book; each copy has its own barcode
+        copies_layout = QHBoxLayout()
+        self.book_copies_label = QLabel()
+        self.copy_barcode_input = QLineEdit()
+        self.copy_barcode_input.setPlaceholderText("New copy's barcode (blank to generate one)")
+        self.add_copy_btn = QPushButton("Add Copy")
+        self.add_copy_btn.clicked.connect(self.add_copy)
+        copies_layout.addWidget(self.book_copies_label, 1)
+        copies_layout.addWidget(self.copy_barcode_input)
+        copies_layout.addWidget(self.add_copy_btn)
+        layout.addLayout(copies_layout)
+
     def setup_members_tab(self):
         """Sets up the UI for the Members tab."""
         layout = QVBoxLayout(self.members_tab)
@@ -147,12 +726,20 @@ class LibraryApp(QWidget):
         button_layout.addWidget(self.delete_member_btn)
         layout.addLayout(button_layout)
 
+        # Live search, debounced so typing does not fire a query per key
+        self.member_search_input = QLineEdit()
+        self.member_search_input.setPlaceholderText("Search by name, email or ID")
+        self.member_search_timer = make_debounce_timer(self, self.search_members)
+        self.member_search_input.textChanged.connect(lambda _: self.member_search_timer.start())
+        layout.addWidget(self.member_search_input)
+
         # Table to display members
-        self.members_table = QTableWidget()
-        self.members_table.setColumnCount(3)
-        self.members_table.setHorizontalHeaderLabels(["ID", "Name", "Email"])
-        self.members_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.members_table.itemClicked.connect(self.select_member)
+        self.members_model = RowTableModel(["ID", "Name", "Email"], run_call=self.run_call, parent=self,
+                                           name="members")
+        self.members_model.load_failed.connect(
+            lambda e: self.show_db_error("Error fetching members from database", "خطا", "error in member receive", e))
+        self.members_table = make_table_view(self.members_model)
+        self.members_table.clicked.connect(self.select_member)
         layout.addWidget(self.members_table)
     
     def setup_loans_tab(self):
@@ -164,17 +751,24 @@ class LibraryApp(QWidget):
         self.loan_book_id_input = QLineEdit()
         self.loan_member_id_input = QLineEdit()
         
-        # Set validators for loan IDs
-        self.loan_book_id_input.setValidator(QIntValidator())
+        # Set validators for loan IDs; several book IDs loan or return a whole stack
+        self.loan_book_id_input.setValidator(QRegExpValidator(QRegExp(r"[0-9, ]*")))
         self.loan_member_id_input.setValidator(QIntValidator())
         
-        form_layout.addWidget(QLabel("Book ID:"), 0, 0)
+        form_layout.addWidget(QLabel("Book ID(s):"), 0, 0)
         form_layout.addWidget(self.loan_book_id_input, 0, 1)
         form_layout.addWidget(QLabel("Member ID:"), 1, 0)
         form_layout.addWidget(self.loan_member_id_input, 1, 1)
         
         layout.addLayout(form_layout)
 
+        # What the typed IDs refer to, looked up through the cache as staff type
+        self.loan_preview_label = QLabel()
+        self.loan_preview_timer = make_debounce_timer(self, self.preview_loan)
+        self.loan_book_id_input.textChanged.connect(lambda _: self.loan_preview_timer.start())
+        self.loan_member_id_input.textChanged.connect(lambda _: self.loan_preview_timer.start())
+        layout.addWidget(self.loan_preview_label)
+
         # Buttons
         button_layout = QHBoxLayout()
         self.loan_book_btn = QPushButton("Loan a Book")
@@ -182,209 +776,298 @@ class LibraryApp(QWidget):
         self.return_book_btn = QPushButton("Retrurn a book")
         self.return_book_btn.clicked.connect(self.return_book)
         
+        # A title with no copy on the shelf can be held; the member is queued for the next one back
+        self.place_hold_btn = QPushButton("Place Hold")
+        self.place_hold_btn.clicked.connect(self.place_hold)
+
         button_layout.addWidget(self.loan_book_btn)
         button_layout.addWidget(self.return_book_btn)
+        button_layout.addWidget(self.place_hold_btn)
         layout.addLayout(button_layout)
 
+        # Scan mode: every barcode a scanner types (ending in Enter) is checked out to the
+        # member above or returned, without a dialog; results go to the log below
+        scan_layout = QHBoxLayout()
+        self.scan_mode_combo = QComboBox()
+        self.scan_mode_combo.addItem("Check out", "checkout")
+        self.scan_mode_combo.addItem("Return", "return")
+        self.scan_input = QLineEdit()
+        self.scan_input.setPlaceholderText("Scan a copy's barcode")
+        self.scan_input.returnPressed.connect(self.scan_barcode)
+        scan_layout.addWidget(QLabel("Scan:"))
+        scan_layout.addWidget(self.scan_mode_combo)
+        scan_layout.addWidget(self.scan_input, 1)
+        layout.addLayout(scan_layout)
+        self.scan_log = QListWidget()
+        self.scan_log.setMaximumHeight(120)
+        layout.addWidget(self.scan_log)
+
+        # Active loans only unless staff ask for the return history
+        self.show_returned_checkbox = QCheckBox("Show returned loans")
+        self.show_returned_checkbox.toggled.connect(self.filter_loans)
+        layout.addWidget(self.show_returned_checkbox)
+
         # Table to display loans
-        self.loans_table = QTableWidget()
-        self.loans_table.setColumnCount(5)
-        self.loans_table.setHorizontalHeaderLabels(["ID", "Book id", "Member id", "Loan Date", "Date of Return"])
+        self.loans_model = RowTableModel(["ID", "Book id", "Title", "Member", "Loan Date", "Days", "Status"],
+                                         run_call=self.run_call, parent=self, name="loans")
+        self.loans_model.load_failed.connect(
+            lambda e: self.show_db_error("Error fetching loan records from database", "error", "error in loan list", e))
+        self.loans_table = make_table_view(self.loans_model)
         layout.addWidget(self.loans_table)
 
+    def setup_reports_tab(self):
+        """Sets up the UI for the Reports tab."""
+        layout = QVBoxLayout(self.reports_tab)
+
+        # Report choice and, for the circulation series, the date range
+        form_layout = QHBoxLayout()
+        self.report_combo = QComboBox()
+        for report in REPORTS.values():
+            self.report_combo.addItem(report.title, report.name)
+        self.report_combo.currentIndexChanged.connect(lambda _: self.run_report())
+        today = QDate.currentDate()
+        self.report_start_input = QDateEdit(today.addMonths(-REPORT_DEFAULT_MONTHS).addDays(1 - today.day()))
+        self.report_end_input = QDateEdit(today)
+        for date_input in (self.report_start_input, self.report_end_input):
+            date_input.setCalendarPopup(True)
+            date_input.setDisplayFormat("yyyy-MM-dd")
+            date_input.dateChanged.connect(lambda _: self.run_report())
+        form_layout.addWidget(QLabel("Report:"))
+        form_layout.addWidget(self.report_combo, 1)
+        form_layout.addWidget(QLabel("From:"))
+        form_layout.addWidget(self.report_start_input)
+        form_layout.addWidget(QLabel("To:"))
+        form_layout.addWidget(self.report_end_input)
+        layout.addLayout(form_layout)
+
+        # Buttons
+        button_layout = QHBoxLayout()
+        self.refresh_report_btn = QPushButton("Refresh")
+        self.refresh_report_btn.clicked.connect(self.run_report)
+        self.export_report_btn = QPushButton("Export CSV...")
+        self.export_report_btn.clicked.connect(self.export_report)
+        self.report_status_label = QLabel()
+        button_layout.addWidget(self.refresh_report_btn)
+        button_layout.addWidget(self.export_report_btn)
+        button_layout.addWidget(self.report_status_label, 1)
+        layout.addLayout(button_layout)
+
+        # Table to display the report
+        self.report_model = RowTableModel([], parent=self, name="report")
+        self.report_table = make_table_view(self.report_model)
+        layout.addWidget(self.report_table)
+
 
     # --- CRUD Functions for Books ---
     def add_book(self):
         title = self.book_title_input.text()
         author = self.book_author_input.text()
-        isbn_text = self.book_isbn_input.text()
-
-        if not title or not author:
-            logging.warning("Attempted to add a book with missing title or author.")
-            QMessageBox.warning(self, "خطا", "please insert name ans author.")
-            return
-
-        if not isbn_text.isdigit() and isbn_text:
-            logging.warning(f"Attempted to add book '{title}' with non-numeric ISBN: {isbn_text}")
-            QMessageBox.warning(self, "خطا", "ISBN must be a number.")
-            return
-        
-        isbn = int(isbn_text) if isbn_text else None
+        isbn = self.book_isbn_input.text()
 
-        try:
-            self.db_cursor.execute(
-                "INSERT INTO Books (title, author, isbn) VALUES (%s, %s, %s)",
-                (title, author, isbn)
-            )
-            self.db_conn.commit()
-            logging.info(f"Book '{title}' added successfully.")
+        def done(row):
+            logging.info("Book '%s' added successfully.", title)
             QMessageBox.information(self, "Success", f"کتاب '{title}' added successfully.")
-            self.refresh_books_table()
+            # Search results are reloaded, so the new book only shows if it matches
+            if self.book_search_input.text().strip():
+                self.books_model.reload()
+            else:
+                self.books_model.upsert_row(row)
             self.clear_book_inputs()
-        except Exception as e:
-            logging.error(f"Error adding book '{title}': {e}")
-            QMessageBox.critical(self, "Errorا", f"Error in adding book: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.add_book, title, author, isbn, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error adding book '{title}'", "Errorا", "Error in adding book", e))
 
     def refresh_books_table(self):
-        """Fetches and displays all books from the database."""
-        try:
-            self.db_cursor.execute("SELECT book_id, title, author, isbn FROM Books")
-            books = self.db_cursor.fetchall()
-            self.books_table.setRowCount(len(books))
-            for row_index, row_data in enumerate(books):
-                for col_index, col_data in enumerate(row_data):
-                    self.books_table.setItem(row_index, col_index, QTableWidgetItem(str(col_data) if col_data is not None else ""))
-            logging.info("Books table refreshed.")
-        except Exception as e:
-            logging.error(f"Error fetching books from database: {e}")
-            QMessageBox.critical(self, "خطا", f"error in receive book: {e}")
+        """Reloads the first page of books; the rest is fetched on scroll."""
+        self.books_model.reload()
+        logging.info("Books table refresh requested.")
+
+    def search_books(self):
+        """Shows the top matches for the search box, or every book when it is empty.
 
-    def select_book(self, item):
+        Reloading cancels a search still running for an earlier keystroke.
+        """
+        term = self.book_search_input.text().strip()
+        if term:
+            self.books_model.set_fetch_page(partial(self.service.list_books, term=term), SEARCH_LIMIT)
+        else:
+            self.books_model.set_fetch_page(self.service.list_books)
+
+    def select_book(self, index):
         """Loads selected row data into input fields."""
-        row = item.row()
-        self.selected_book_id = self.books_table.item(row, 0).text()
-        self.book_title_input.setText(self.books_table.item(row, 1).text())
-        self.book_author_input.setText(self.books_table.item(row, 2).text())
-        
-        # Check if item exists before setting text
-        isbn_item = self.books_table.item(row, 3)
-        if isbn_item:
-            self.book_isbn_input.setText(isbn_item.text())
-        logging.info(f"Book with ID {self.selected_book_id} selected.")
+        book_id, title, author, isbn = self.books_model.row_data(index.row())
+        self.selected_book_id = book_id
+        self.book_title_input.setText(title)
+        self.book_author_input.setText(author)
+        self.book_isbn_input.setText(isbn or "")
+        logging.info("Book with ID %s selected.", self.selected_book_id)
+        self.load_copies(book_id)
 
-    def update_book(self):
-        try:
-            book_id = self.selected_book_id
-            title = self.book_title_input.text()
-            author = self.book_author_input.text()
-            isbn_text = self.book_isbn_input.text()
-
-            if not isbn_text.isdigit() and isbn_text:
-                logging.warning(f"Attempted to update book {book_id} with non-numeric ISBN: {isbn_text}")
-                QMessageBox.warning(self, "خطا", "ISBN must be a number.")
-                return
+    def load_copies(self, book_id):
+        """Shows how many copies of the book there are and which are available."""
+        if self._copies_task is not None:
+            self._copies_task.cancel()
+        self.book_copies_label.setText("Loading copies...")
+        self._copies_task = self.run_call(
+            self.service.get_copies, book_id,
+            on_result=lambda copies: self.book_copies_label.setText(describe_copies(copies)),
+            on_error=lambda e: self.book_copies_label.setText(f"Could not load copies: {e}"))
+
+    def add_copy(self):
+        book_id = self.selected_book_id
+        barcode = self.copy_barcode_input.text().strip() or None
+
+        def done(row):
+            logging.info("Copy %s of book %s added.", row[2], book_id)
+            QMessageBox.information(self, "success", f"copy {row[2]} added.")
+            self.copy_barcode_input.clear()
+            self.load_copies(book_id)
+
+        self.run_call(self.service.add_copy, book_id, barcode, on_result=done,
+                      on_error=lambda e: self.show_db_error(f"Error adding a copy of book {book_id}", "error",
+                                                            "error in adding copy", e))
 
-            isbn = int(isbn_text) if isbn_text else None
+    def update_book(self):
+        book_id = self.selected_book_id
+        title = self.book_title_input.text()
+        author = self.book_author_input.text()
+        isbn = self.book_isbn_input.text()
             
-            self.db_cursor.execute(
-                "UPDATE Books SET title = %s, author = %s, isbn = %s WHERE book_id = %s",
-                (title, author, isbn, book_id)
-            )
-            self.db_conn.commit()
-            logging.info(f"Book with ID {book_id} updated successfully.")
+        def done(row):
+            logging.info("Book with ID %s updated successfully.", book_id)
             QMessageBox.information(self, "success", "book updated successfully.")
-            self.refresh_books_table()
+            if row:
+                self.books_model.upsert_row(row)
+            else:
+                # Removed by someone else in the meantime
+                self.books_model.remove_row(book_id)
             self.clear_book_inputs()
-        except Exception as e:
-            logging.error(f"Error updating book {book_id}: {e}")
-            QMessageBox.critical(self, "errorا", f"error in updating book: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.update_book, book_id, title, author, isbn, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error updating book {book_id}", "errorا", "error in updating book", e))
 
     def delete_book(self):
-        try:
-            book_id = self.selected_book_id
-            self.db_cursor.execute("DELETE FROM Books WHERE book_id = %s", (book_id,))
-            self.db_conn.commit()
-            logging.info(f"Book with ID {book_id} removed successfully.")
+        book_id = self.selected_book_id
+
+        def done(_):
+            logging.info("Book with ID %s removed successfully.", book_id)
             QMessageBox.information(self, "success", "book removed suuccessfully.")
-            self.refresh_books_table()
+            self.books_model.remove_row(book_id)
             self.clear_book_inputs()
-        except Exception as e:
-            logging.error(f"Error removing book {book_id}: {e}")
-            QMessageBox.critical(self, "error", f"error in remove book: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.delete_book, book_id, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error removing book {book_id}", "error", "error in remove book", e))
 
     def clear_book_inputs(self):
         self.book_title_input.clear()
         self.book_author_input.clear()
         self.book_isbn_input.clear()
+        self.book_copies_label.clear()
         self.selected_book_id = None
         logging.info("Book input fields cleared.")
 
+    def import_books_file(self):
+        """Bulk-imports books from a CSV or MARC file on a worker thread."""
+        from library_import import IMPORT_BATCH_SIZE, import_books, read_records
+        path, _ = QFileDialog.getOpenFileName(self, "Import books", "",
+                                              "Catalogue files (*.csv *.mrc *.marc);;All files (*)")
+        if not path:
+            return
+        logging.info("Importing books from %s.", path)
+        self.import_books_btn.setEnabled(False)
+        self.import_status_label.setText("Importing...")
+
+        def done(result):
+            imported, skipped = result
+            self.import_books_btn.setEnabled(True)
+            logging.info("Import from %s finished: %s imported, %s skipped.", path, imported, skipped)
+            QMessageBox.information(self, "success", f"{imported} books imported, {skipped} skipped.")
+            self.refresh_books_table()
+
+        def failed(e):
+            self.import_books_btn.setEnabled(True)
+            self.import_status_label.setText("")
+            self.show_db_error(f"Error importing books from {path}", "error", "error in import", e)
+            # Batches committed before the failure are kept
+            self.refresh_books_table()
+
+        self.run_task(import_books, self.db, read_records(path), IMPORT_BATCH_SIZE,
+                      self.import_progress.emit, on_result=done, on_error=failed)
+
+    def show_import_progress(self, imported, skipped):
+        self.import_status_label.setText(f"{imported} imported, {skipped} skipped")
+
     # --- CRUD Functions for Members ---
     def add_member(self):
         name = self.member_name_input.text()
         email = self.member_email_input.text()
-        if not name:
-            logging.warning("Attempted to add a member with missing name.")
-            QMessageBox.warning(self, "error", "please insert the members name.")
-            return
 
-        try:
-            self.db_cursor.execute(
-                "INSERT INTO Members (name, email) VALUES (%s, %s)",
-                (name, email)
-            )
-            self.db_conn.commit()
-            logging.info(f"Member '{name}' added successfully.")
+        def done(row):
+            logging.info("Member '%s' added successfully.", name)
             QMessageBox.information(self, "success", f"member '{name}' added successfully.")
-            self.refresh_members_table()
+            # Search results are reloaded, so the new member only shows if they match
+            if self.member_search_input.text().strip():
+                self.members_model.reload()
+            else:
+                self.members_model.upsert_row(row)
             self.clear_member_inputs()
-        except Exception as e:
-            logging.error(f"Error adding member '{name}': {e}")
-            QMessageBox.critical(self, "error", f"error in adding member: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.add_member, name, email, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error adding member '{name}'", "error", "error in adding member", e))
     
     def refresh_members_table(self):
-        """Fetches and displays all members from the database."""
-        try:
-            self.db_cursor.execute("SELECT member_id, name, email FROM Members")
-            members = self.db_cursor.fetchall()
-            self.members_table.setRowCount(len(members))
-            for row_index, row_data in enumerate(members):
-                for col_index, col_data in enumerate(row_data):
-                    self.members_table.setItem(row_index, col_index, QTableWidgetItem(str(col_data) if col_data is not None else ""))
-            logging.info("Members table refreshed.")
-        except Exception as e:
-            logging.error(f"Error fetching members from database: {e}")
-            QMessageBox.critical(self, "خطا", f"error in member receive: {e}")
-            
-    def select_member(self, item):
+        """Reloads the first page of members; the rest is fetched on scroll."""
+        self.members_model.reload()
+        logging.info("Members table refresh requested.")
+
+    def search_members(self):
+        """Shows the top matches for the search box, or every member when it is empty.
+
+        Reloading cancels a search still running for an earlier keystroke.
+        """
+        term = self.member_search_input.text().strip()
+        if term:
+            self.members_model.set_fetch_page(partial(self.service.list_members, term=term), SEARCH_LIMIT)
+        else:
+            self.members_model.set_fetch_page(self.service.list_members)
+
+    def select_member(self, index):
         """Loads selected row data into input fields."""
-        row = item.row()
-        self.selected_member_id = self.members_table.item(row, 0).text()
-        self.member_name_input.setText(self.members_table.item(row, 1).text())
-        
-        # Check if item exists before setting text
-        email_item = self.members_table.item(row, 2)
-        if email_item:
-            self.member_email_input.setText(email_item.text())
-        logging.info(f"Member with ID {self.selected_member_id} selected.")
+        member_id, name, email = self.members_model.row_data(index.row())
+        self.selected_member_id = member_id
+        self.member_name_input.setText(name)
+        self.member_email_input.setText(email or "")
+        logging.info("Member with ID %s selected.", self.selected_member_id)
         
     def update_member(self):
-        try:
-            member_id = self.selected_member_id
-            name = self.member_name_input.text()
-            email = self.member_email_input.text()
+        member_id = self.selected_member_id
+        name = self.member_name_input.text()
+        email = self.member_email_input.text()
             
-            self.db_cursor.execute(
-                "UPDATE Members SET name = %s, email = %s WHERE member_id = %s",
-                (name, email, member_id)
-            )
-            self.db_conn.commit()
-            logging.info(f"Member with ID {member_id} updated successfully.")
+        def done(row):
+            logging.info("Member with ID %s updated successfully.", member_id)
             QMessageBox.information(self, "success", "member updated successfully.")
-            self.refresh_members_table()
+            if row:
+                self.members_model.upsert_row(row)
+            else:
+                # Removed by someone else in the meantime
+                self.members_model.remove_row(member_id)
             self.clear_member_inputs()
-        except Exception as e:
-            logging.error(f"Error updating member {member_id}: {e}")
-            QMessageBox.critical(self, "errorا", f"error in member update: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.update_member, member_id, name, email, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error updating member {member_id}", "errorا", "error in member update", e))
 
     def delete_member(self):
-        try:
-            member_id = self.selected_member_id
-            self.db_cursor.execute("DELETE FROM Members WHERE member_id = %s", (member_id,))
-            self.db_conn.commit()
-            logging.info(f"Member with ID {member_id} removed successfully.")
+        member_id = self.selected_member_id
+
+        def done(_):
+            logging.info("Member with ID %s removed successfully.", member_id)
             QMessageBox.information(self, "success", "member removed successfully.")
-            self.refresh_members_table()
+            self.members_model.remove_row(member_id)
             self.clear_member_inputs()
-        except Exception as e:
-            logging.error(f"Error removing member {member_id}: {e}")
-            QMessageBox.critical(self, "error", f"error in member remove: {e}")
-            self.db_conn.rollback()
+
+        self.run_call(self.service.delete_member, member_id, on_result=done,
+                    on_error=lambda e: self.show_db_error(f"Error removing member {member_id}", "error", "error in member remove", e))
 
     def clear_member_inputs(self):
         self.member_name_input.clear()
@@ -397,129 +1080,344 @@ class LibraryApp(QWidget):
         book_id_text = self.loan_book_id_input.text()
         member_id_text = self.loan_member_id_input.text()
         
-        if not book_id_text or not member_id_text:
+        if not book_id_text.strip() or not member_id_text:
             logging.warning("Attempted to loan a book with missing book or member ID.")
             QMessageBox.warning(self, "error", "please insert the book and the members id.")
             return
         
         # Check if inputs are numbers
-        if not book_id_text.isdigit() or not member_id_text.isdigit():
+        book_ids = parse_ids(book_id_text)
+        if book_ids is None or not member_id_text.isdigit():
             logging.warning("Attempted loan with non-numeric IDs.")
             QMessageBox.warning(self, "خطا", "Book ID and Member ID must be numbers.")
             return
 
-        book_id = int(book_id_text)
         member_id = int(member_id_text)
+        if len(book_ids) > 1:
+            self.loan_books(book_ids, member_id)
+            return
+        book_id = book_ids[0]
+        logging.info("Attempting to loan book ID %s to member ID %s.", book_id, member_id)
         
-        try:
-            logging.info(f"Attempting to loan book ID {book_id} to member ID {member_id}.")
-            
-            # Check if book exists and is available
-            self.db_cursor.execute("SELECT is_available FROM Books WHERE book_id = %s", (book_id,))
-            result = self.db_cursor.fetchone()
-            if not result:
-                logging.error(f"Book with ID {book_id} does not exist.")
-                QMessageBox.critical(self, "error", "This book doesn't exist.")
-                return
-            if not result[0]:
-                logging.warning(f"Book with ID {book_id} is already on loan.")
-                QMessageBox.critical(self, "error", "This book is currently on loan.")
-                return
-
-            # Check if member exists
-            self.db_cursor.execute("SELECT 1 FROM Members WHERE member_id = %s", (member_id,))
-            if not self.db_cursor.fetchone():
-                logging.error(f"Member with ID {member_id} does not exist.")
-                QMessageBox.critical(self, "error", "This member doesn't exist.")
-                return
-
-            # Insert new loan record
-            self.db_cursor.execute(
-                "INSERT INTO Loans (book_id, member_id, loan_date) VALUES (%s, %s, CURRENT_DATE)",
-                (book_id, member_id)
-            )
-            
-            # Update book availability
-            self.db_cursor.execute("UPDATE Books SET is_available = FALSE WHERE book_id = %s", (book_id,))
-            
-            self.db_conn.commit()
-            logging.info(f"Loan of book {book_id} to member {member_id} completed successfully.")
+        def done(loan):
+            logging.info("Loan of book %s to member %s completed successfully.", book_id, member_id)
             QMessageBox.information(self, "موفقیت", "the book got loaned successfully.")
-            self.refresh_loans_table()
-        except Exception as e:
-            logging.error(f"Error loaning book: {e}")
-            QMessageBox.critical(self, "error", f"error in loan: {e}")
-            self.db_conn.rollback()
+            self.show_loans([loan])
+
+        self.run_call(self.service.loan_book, book_id, member_id, on_result=done,
+                    on_error=lambda e: self.show_db_error("Error loaning book", "error", "error in loan", e))
 
     def return_book(self):
         book_id_text = self.loan_book_id_input.text()
-        if not book_id_text:
+        if not book_id_text.strip():
             logging.warning("Attempted to return a book with missing book ID.")
             QMessageBox.warning(self, "error", "please insert the book id.")
             return
 
         # Check if input is a number
-        if not book_id_text.isdigit():
+        book_ids = parse_ids(book_id_text)
+        if book_ids is None:
             logging.warning("Attempted to return book with non-numeric ID.")
             QMessageBox.warning(self, "خطا", "Book ID must be a number.")
             return
             
-        book_id = int(book_id_text)
+        if len(book_ids) > 1:
+            self.return_books(book_ids)
+            return
+        book_id = book_ids[0]
+        logging.info("Attempting to return book with ID %s.", book_id)
 
-        try:
-            logging.info(f"Attempting to return book with ID {book_id}.")
-            
-            # Check if book is currently on loan
-            self.db_cursor.execute("SELECT 1 FROM Loans WHERE book_id = %s AND return_date IS NULL", (book_id,))
-            if not self.db_cursor.fetchone():
-                logging.warning(f"Book with ID {book_id} is not currently on loan.")
-                QMessageBox.critical(self, "error", " This book didn't got loaned or has been returned.")
+        def done(loans):
+            logging.info("Book with ID %s returned successfully.", book_id)
+            QMessageBox.information(self, "success", "book returned successfully.")
+            self.show_loans(loans)
+
+        self.run_call(self.service.return_book, book_id, on_result=done,
+                    on_error=lambda e: self.show_db_error("Error returning book", "errorا", "error in the book turn back", e))
+
+    def loan_books(self, book_ids, member_id):
+        """Loans a stack of books to one member in a single transaction."""
+        logging.info("Attempting to loan books %s to member ID %s.", book_ids, member_id)
+
+        def done(result):
+            loans, refused = result
+            logging.info("%s books loaned to member %s.", len(loans), member_id)
+            self.show_loans(loans)
+            message = f"{len(loans)} books got loaned successfully."
+            if refused:
+                message += f"\nNot found or already on loan: {', '.join(map(str, refused))}"
+            QMessageBox.information(self, "موفقیت", message)
+
+        self.run_call(self.service.loan_books, book_ids, member_id, on_result=done,
+                    on_error=lambda e: self.show_db_error("Error loaning books", "error", "error in loan", e))
+
+    def return_books(self, book_ids):
+        """Returns a stack of books in a single transaction."""
+        logging.info("Attempting to return books %s.", book_ids)
+
+        def done(result):
+            loans, not_on_loan = result
+            logging.info("%s books returned.", len(loans))
+            self.show_loans(loans)
+            message = f"{len(loans)} books returned successfully."
+            if not_on_loan:
+                message += f"\nNot on loan: {', '.join(map(str, not_on_loan))}"
+            QMessageBox.information(self, "success", message)
+
+        self.run_call(self.service.return_books, book_ids, on_result=done,
+                    on_error=lambda e: self.show_db_error("Error returning books", "errorا", "error in the book turn back", e))
+
+    def place_hold(self):
+        """Queues the member for the typed book, which has no copy on the shelf."""
+        book_ids = parse_ids(self.loan_book_id_input.text())
+        member_id_text = self.loan_member_id_input.text()
+        if not book_ids or len(book_ids) > 1 or not member_id_text.isdigit():
+            logging.warning("Attempted to place a hold without one book ID and a member ID.")
+            QMessageBox.warning(self, "error", "please insert one book id and the members id.")
+            return
+        book_id, member_id = book_ids[0], int(member_id_text)
+        logging.info("Attempting to place a hold on book ID %s for member ID %s.", book_id, member_id)
+
+        def done(hold):
+            logging.info("Hold %s placed on book %s for member %s.", hold[0], book_id, member_id)
+            QMessageBox.information(self, "success", f"'{hold[8]}' is held for {hold[9]}; "
+                                                      f"number {hold[6]} in the queue.")
+
+        self.run_call(self.service.place_hold, book_id, member_id, on_result=done,
+                      on_error=lambda e: self.show_db_error("Error placing hold", "error", "error in hold", e))
+
+    # --- Scan mode ---
+    def scan_barcode(self):
+        """Queues the scanned barcode and sends it as soon as no other batch is in flight."""
+        barcode = self.scan_input.text().strip()
+        self.scan_input.clear()
+        if not barcode:
+            return
+        mode = self.scan_mode_combo.currentData()
+        member_id = None
+        if mode == "checkout":
+            member_text = self.loan_member_id_input.text()
+            if not member_text.isdigit():
+                self.log_scan(f"{barcode}  refused: enter the member ID first", True)
                 return
+            member_id = int(member_text)
+        self._scans.append((mode, member_id, barcode))
+        self.send_scans()
 
-            # Update loan record with return date
-            self.db_cursor.execute(
-                "UPDATE Loans SET return_date = CURRENT_DATE WHERE book_id = %s AND return_date IS NULL", 
-                (book_id,)
-            )
-            
-            # Update book availability
-            self.db_cursor.execute("UPDATE Books SET is_available = TRUE WHERE book_id = %s", (book_id,))
-            
-            self.db_conn.commit()
-            logging.info(f"Book with ID {book_id} returned successfully.")
-            QMessageBox.information(self, "success", "book returned successfully.")
-            self.refresh_loans_table()
-        except Exception as e:
-            logging.error(f"Error returning book: {e}")
-            QMessageBox.critical(self, "errorا", f"error in the book turn back: {e}")
-            self.db_conn.rollback()
+    def send_scans(self):
+        """Sends the waiting scans for the same mode and member as one batch."""
+        if self._scan_task is not None or not self._scans:
+            return
+        mode, member_id, _ = self._scans[0]
+        batch = []
+        while self._scans and self._scans[0][:2] == (mode, member_id) and len(batch) < MAX_SCAN_BATCH:
+            batch.append(self._scans.popleft()[2])
+        if mode == "checkout":
+            fn, args = self.service.checkout_copies, (batch, member_id)
+        else:
+            fn, args = self.service.return_copies, (batch,)
+        self._scan_task = self.run_call(fn, *args, on_result=partial(self.scans_done, mode, batch),
+                                        on_error=partial(self.scans_failed, batch))
+
+    def scans_done(self, mode, batch, result):
+        self._scan_task = None
+        outcomes = scan_outcomes(mode, result)
+        for barcode in dict.fromkeys(batch):
+            self.log_scan(*outcomes[barcode])
+        self.show_loans([loan for _, loan in result[0]])
+        logging.info("%s of %s scans processed (%s).", len(result[0]), len(batch), mode)
+        self.send_scans()
+
+    def scans_failed(self, batch, error):
+        self._scan_task = None
+        logging.warning("Scan batch of %s failed: %s", len(batch), error)
+        for barcode in dict.fromkeys(batch):
+            self.log_scan(f"{barcode}  failed: {str(error).strip()}", True)
+        self.send_scans()
+
+    def log_scan(self, text, refused=False):
+        item = QListWidgetItem(text)
+        if refused:
+            item.setForeground(QColor("red"))
+        self.scan_log.insertItem(0, item)
+        while self.scan_log.count() > SCAN_LOG_LINES:
+            self.scan_log.takeItem(self.scan_log.count() - 1)
+
+    def preview_loan(self):
+        """Shows which books and member the typed IDs belong to."""
+        if self._preview_task is not None:
+            self._preview_task.cancel()
+            self._preview_task = None
+        book_ids = parse_ids(self.loan_book_id_input.text()) or []
+        member_text = self.loan_member_id_input.text()
+        member_id = int(member_text) if member_text.isdigit() else None
+        if not book_ids and member_id is None:
+            self.loan_preview_label.clear()
+            return
+        # An ID the service rejects (such as 0) just leaves the preview empty
+        self._preview_task = self.run_call(describe_loan, self.service, book_ids, member_id,
+                                           on_result=self.loan_preview_label.setText,
+                                           on_error=lambda e: self.loan_preview_label.clear())
+
+    def show_loans(self, loans):
+        """Patches loan rows returned by a checkout or return into the loans table."""
+        show_returned = self.show_returned_checkbox.isChecked()
+        today = date.today()
+        for loan in loans:
+            if loan[4] is not None and not show_returned:
+                self.loans_model.remove_row(loan[0])
+            else:
+                self.loans_model.upsert_row(loan_view_row(loan, today))
+
+    def filter_loans(self, show_returned):
+        """Switches the loans table between active loans and the full history."""
+        self.loans_model.set_fetch_page(partial(fetch_loan_view_page, self.service.list_loans,
+                                                active_only=not show_returned))
+        logging.info("Loans table showing %s loans.", 'all' if show_returned else 'active')
 
     def refresh_loans_table(self):
-        """Fetches and displays all loan records from the database."""
-        try:
-            self.db_cursor.execute("SELECT * FROM Loans")
-            loans = self.db_cursor.fetchall()
-            self.loans_table.setRowCount(len(loans))
-            for row_index, row_data in enumerate(loans):
-                for col_index, col_data in enumerate(row_data):
-                    self.loans_table.setItem(row_index, col_index, QTableWidgetItem(str(col_data) if col_data is not None else ""))
-            logging.info("Loans table refreshed.")
-        except Exception as e:
-            logging.error(f"Error fetching loan records from database: {e}")
-            QMessageBox.critical(self, "error", f"error in loan list: {e}")
+        """Reloads the first page of loan records; the rest is fetched on scroll."""
+        self.loans_model.reload()
+        logging.info("Loans table refresh requested.")
+
+    # --- Reports ---
+    def report_args(self):
+        """Returns (name, limit, start, end) for the report chosen in the Reports tab."""
+        name = self.report_combo.currentData()
+        # The To date is inclusive on screen and exclusive in the query
+        start = self.report_start_input.date().toPyDate()
+        end = self.report_end_input.date().addDays(1).toPyDate()
+        return name, REPORT_LIMIT, start, end
+
+    def run_report(self):
+        """Runs the chosen report; a report still running for an earlier choice is cancelled."""
+        if self.service is None:
+            return
+        if self._report_task is not None:
+            self._report_task.cancel()
+        name, limit, start, end = self.report_args()
+        self.report_start_input.setEnabled(REPORTS[name].ranged)
+        self.report_end_input.setEnabled(REPORTS[name].ranged)
+        self.report_status_label.setText("Loading...")
+
+        def done(rows):
+            self._report_task = None
+            self.report_model.set_rows(map(report_header, REPORTS[name].columns), rows)
+            self.report_status_label.setText(f"{len(rows)} rows")
+
+        def failed(e):
+            self._report_task = None
+            self.report_status_label.setText("")
+            self.show_db_error(f"Error running report {name}", "error", "error in report", e)
+
+        self._report_task = self.run_call(self.service.report, name, limit, start, end, on_result=done,
+                                          on_error=failed)
+
+    def export_report(self):
+        """Saves the chosen report as a CSV file, written by PostgreSQL on a worker thread."""
+        name, limit, start, end = self.report_args()
+        path, _ = QFileDialog.getSaveFileName(self, "Export report", f"{name}.csv", "CSV files (*.csv)")
+        if not path:
+            return
+        logging.info("Exporting report %s to %s.", name, path)
+
+        def done(_):
+            logging.info("Report %s exported to %s.", name, path)
+            QMessageBox.information(self, "success", f"report saved to {path}.")
+
+        self.run_task(export_report_file, self.service, path, name, limit, start, end, on_result=done,
+                      on_error=lambda e: self.show_db_error(f"Error exporting report {name}", "error",
+                                                            "error in report export", e))
+
+    # --- Changes pushed by other clients ---
+    def queue_change(self, table, ids):
+        """Collects pushed changes so a burst of them is applied in one go."""
+        for name in [table] if table else ["books", "members", "loans"]:
+            if ids is None:
+                self._pending_changes[name] = None
+            elif self._pending_changes.get(name, ()) is not None:
+                self._pending_changes.setdefault(name, set()).update(ids)
+        self.change_timer.start()
+
+    def apply_changes(self):
+        """Fetches just the changed rows and patches them into the open tables."""
+        changes, self._pending_changes = self._pending_changes, {}
+        for table, ids in changes.items():
+            # A tab not opened yet has nothing to patch; it loads current rows when it is
+            if {"books": self.books_tab, "members": self.members_tab,
+                    "loans": self.loans_tab}.get(table) not in self._built_tabs:
+                continue
+            if table == "books":
+                model, fetch, apply = self.books_model, self.service.get_books, self.apply_book_changes
+            elif table == "members":
+                model, fetch, apply = self.members_model, self.service.get_members, self.apply_member_changes
+            elif table == "loans":
+                model, fetch, apply = self.loans_model, self.service.get_loans, self.apply_loan_changes
+            else:
+                continue
+            if ids is None:
+                model.reload()
+                continue
+            ids = sorted(ids)
+            self.run_call(fetch, ids, on_result=partial(apply, ids),
+                          on_error=lambda e, table=table: logging.warning("Could not apply %s changes: %s", table, e))
+
+    def apply_row_changes(self, model, ids, rows, searching):
+        present = {row[0] for row in rows}
+        for row in rows:
+            # A filtered view only refreshes the rows it shows; new ones may not match
+            if searching:
+                model.replace_row(row)
+            else:
+                model.upsert_row(row)
+        for row_id in ids:
+            if row_id not in present:
+                model.remove_row(row_id)
+
+    def apply_book_changes(self, ids, rows):
+        self.apply_row_changes(self.books_model, ids, rows, bool(self.book_search_input.text().strip()))
+
+    def apply_member_changes(self, ids, rows):
+        self.apply_row_changes(self.members_model, ids, rows, bool(self.member_search_input.text().strip()))
+
+    def apply_loan_changes(self, ids, loans):
+        self.show_loans(loans)
+        present = {loan[0] for loan in loans}
+        for loan_id in ids:
+            if loan_id not in present:
+                self.loans_model.remove_row(loan_id)
 
     def closeEvent(self, event):
-        """Closes the database connection when the application is closed."""
-        if self.db_conn:
-            self.db_cursor.close()
-            self.db_conn.close()
+        """Closes the database connections when the application is closed."""
+        self.status_timer.stop()
+        # Drop queued jobs and let running ones finish before closing the pool
+        for task in list(self._tasks):
+            task.cancel()
+        self.thread_pool.waitForDone()
+        if self.db:
+            logging.info("Cache statistics: %s", self.service.cache_stats())
+        # Saved before the service closes, so the cache gauges are still included
+        self.save_metrics()
+        if self.service:
+            self.service.close()
             logging.info("Database connection closed.")
         event.accept()
 
+    def save_metrics(self):
+        """Writes the metrics collected this session to METRICS_FILE as JSON."""
+        try:
+            with open(METRICS_FILE, "w", encoding="utf-8") as f:
+                f.write(METRICS.to_json())
+            logging.info("Metrics written to %s.", METRICS_FILE)
+        except OSError as e:
+            logging.error("Could not write metrics to %s: %s", METRICS_FILE, e)
+
 if __name__ == '__main__':
+    log_listener = configure_logging(LOG_FILE)
     app = QApplication(sys.argv)
     ex = LibraryApp()
-    if ex.db_conn:
-        ex.show()
+    ex.show()
 
-        sys.exit(app.exec_())
+    exit_code = app.exec_()
+    stop_logging(log_listener)
+    sys.exit(exit_code)